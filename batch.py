@@ -0,0 +1,196 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Command-line batch mode: streams a CSV or Parquet file of households through the
+# calculation engine in fixed-size chunks and writes the results as it goes, so peak
+# memory depends on the chunk size rather than the size of the file.
+#
+#   python batch.py households.csv results.csv --chunksize 100000 --keep customer_id province
+#
+# With --workers N each chunk is scored across N processes (see parallel.py).
+#
+# Households can be located with region, utility and/or postal_code columns: prices and
+# carbon intensities not given as columns are then those of the region (see regions.py),
+# and a gas_total column, in the region's gas billing unit, is converted to gas_total_kWh.
+# A grid_carbon column of 'average' or 'marginal' then uses the region's hourly grid series.
+
+import argparse
+import sys
+import time
+
+import pandas as pd
+
+from engine import INPUT_DEFAULTS, calculate, to_columns
+
+
+DEFAULT_CHUNKSIZE = 100000
+#columns locating each household, for regional prices and carbon intensities
+REGION_COLUMNS = ('region', 'utility', 'postal_code')
+
+
+def _is_parquet(path):
+    return str(path).lower().endswith(('.parquet', '.pq'))
+
+
+def read_chunks(path, chunksize=DEFAULT_CHUNKSIZE, columns=None):
+    """
+    Yield DataFrames of at most chunksize rows from a CSV or Parquet file.
+    columns - optional collection of column names to read, others are skipped
+    """
+    if _is_parquet(path):
+        import pyarrow.parquet as pq  # only needed for Parquet input
+
+        pf = pq.ParquetFile(path)
+        if columns is not None:
+            columns = [c for c in pf.schema_arrow.names if c in columns]
+        for batch in pf.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        usecols = None if columns is None else (lambda c: c in columns)
+        yield from pd.read_csv(path, chunksize=chunksize, usecols=usecols)
+
+
+def input_columns(df):
+    """
+    engine inputs present in df; blank flags and settings take the form defaults,
+    blank consumption figures are left as NaN so they show up in the results
+    """
+    inputs = {}
+    for name, default in INPUT_DEFAULTS.items():
+        if name not in df.columns:
+            continue
+        col = df[name]
+        if isinstance(default, (bool, str)):
+            col = col.fillna(default).astype(type(default))
+        inputs[name] = col.to_numpy()
+
+    located = [name for name in REGION_COLUMNS if name in df.columns]
+    if located:
+        from region_store import ENGINE_INPUTS, lookup
+
+        regional = lookup(n=len(df), **{name: df[name].fillna('').astype(str).to_numpy() for name in located})
+        for name in ENGINE_INPUTS:
+            inputs.setdefault(name, regional[name])
+        #the hourly grid series, used if a grid_carbon column asks for one
+        inputs.setdefault('grid_region', regional['region'])
+        if 'gas_total' in df.columns and 'gas_total_kWh' not in inputs:
+            inputs['gas_total_kWh'] = df['gas_total'].to_numpy(dtype=float) * regional['gas_kWh_per_unit']
+    return inputs
+
+
+def input_names(keep=()):
+    """
+    columns to read from a households file: engine inputs, location columns and keep
+    """
+    return set(INPUT_DEFAULTS) | set(REGION_COLUMNS) | {'gas_total'} | set(keep)
+
+
+def score_chunk(df, keep=(), scorer=None):
+    """
+    df - DataFrame of households, columns named as engine inputs
+    keep - columns copied unchanged to the output, e.g. an id column
+    scorer - optional parallel.ParallelScorer to spread the chunk over worker processes
+    returns DataFrame with the kept columns followed by the flattened results
+    """
+    if scorer is None:
+        results = to_columns(calculate(**input_columns(df)))
+    else:
+        results = scorer.score(input_columns(df), len(df))
+    out = pd.DataFrame(results, index=df.index)
+    if keep:
+        out = pd.concat([df[list(keep)], out], axis=1)
+    return out
+
+
+class ChunkWriter:
+    """
+    Append result chunks to a CSV or Parquet file.  pyarrow (installed with streamlit)
+    is used when available as it writes CSV several times faster than pandas.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._parquet = _is_parquet(path)
+        self._writer = None
+        self._first = True
+        try:
+            import pyarrow  # noqa: F401
+            self._arrow = True
+        except ImportError:
+            self._arrow = False
+        if self._parquet and not self._arrow:
+            raise ImportError('pyarrow is required to write Parquet files')
+
+    def write(self, df):
+        if not self._arrow:
+            df.to_csv(self.path, mode='w' if self._first else 'a', header=self._first, index=False)
+            self._first = False
+            return
+
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._writer is None:
+            if self._parquet:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            else:
+                self._writer = pa_csv.CSVWriter(self.path, table.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def run(input_path, output_path, chunksize=DEFAULT_CHUNKSIZE, keep=(), verbose=False, workers=1):
+    """
+    Score every household in input_path and write the results to output_path.
+    workers - number of processes to score each chunk with
+    returns (number of rows, elapsed seconds)
+    """
+    rows = 0
+    wanted = input_names(keep)
+    scorer = None
+    if workers > 1:
+        from parallel import ParallelScorer
+        scorer = ParallelScorer(workers, chunksize)
+
+    start = time.perf_counter()
+    try:
+        with ChunkWriter(output_path) as writer:
+            for df in read_chunks(input_path, chunksize, wanted):
+                writer.write(score_chunk(df, keep, scorer))
+                rows += len(df)
+                if verbose:
+                    elapsed = time.perf_counter() - start
+                    print(f'{rows:,} rows, {rows/elapsed:,.0f} rows/s', file=sys.stderr)
+    finally:
+        if scorer is not None:
+            scorer.close()
+    return rows, time.perf_counter() - start
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description='Score a file of households with the heat pump calculator.')
+    parser.add_argument('input', help='CSV or Parquet file, one household per row, columns named as engine inputs')
+    parser.add_argument('output', help='CSV or Parquet file for the results')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE, help='rows per chunk (default %(default)s)')
+    parser.add_argument('--keep', nargs='*', default=[], help='input columns copied to the output, e.g. an id column')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes (default %(default)s)')
+    parser.add_argument('--verbose', action='store_true', help='report progress after each chunk')
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    rows, elapsed = run(args.input, args.output, args.chunksize, args.keep, args.verbose, args.workers)
+    print(f'Scored {rows:,} rows in {elapsed:.2f} s ({rows/max(elapsed, 1e-9):,.0f} rows/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,453 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Performance benchmarks: engine latency and throughput, the helper table and chart
+# builders, and full reruns of the Streamlit script through its headless test harness.
+# Each run is appended to a JSON-lines history and compared with the median of recent
+# runs on the same machine; the run fails (exit code 1) if a benchmark got slower or
+# used more memory than the thresholds allow.
+#
+#   python benchmarks.py                  run everything, save and check for regressions
+#   python benchmarks.py --quick          skip the 1M row and page benchmarks
+#   python benchmarks.py --only engine_batch_100k page_rerun --no-save
+#
+# page_cold_start also fails the run if the first render of a fresh process is over
+# COLD_START_BUDGET_S or imports any of HEAVY_MODULES.
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_HISTORY = os.path.join(HERE, 'benchmark_history.jsonl')
+
+#fail when the best time exceeds the baseline by this factor, or peak memory by this factor
+TIME_THRESHOLD = 1.25
+MEMORY_THRESHOLD = 1.5
+#timings this short are too noisy for the time threshold alone - allow this much extra (s)
+TIME_SLACK = 0.0005
+#baseline is the median of this many most recent runs on the same machine
+BASELINE_RUNS = 5
+#first render of the page in a fresh process must take no longer than this (s) and must not
+#import any of these: they are only needed once results are shown
+COLD_START_BUDGET_S = 1.0
+HEAVY_MODULES = ('numpy', 'pandas', 'altair', 'PIL', 'pyarrow', 'jinja2', 'scipy')
+
+
+def measure(func, repeat=5, number=1):
+    """
+    time func() repeat times (each the mean of number calls) and record peak traced memory
+    returns dict of best and median seconds per call and peak MB
+    """
+    func()  #warm up: imports, caches, first-touch allocation
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'best_s': min(times), 'median_s': statistics.median(times), 'peak_mb': peak / 2**20}
+
+
+def _households(n):
+    from parallel import random_households
+    return random_households(n)
+
+
+#__________benchmarks______________
+#each returns a zero-argument function to time, and optionally the number of rows it handles
+
+def bench_engine_scalar():
+    from engine import calculate
+    return lambda: calculate(gas_total_kWh=15000.0, elec_total_kWh=3500.0, hw_lday=200.0), 1
+
+
+def _bench_engine_batch(n):
+    def setup():
+        from engine import calculate
+        inputs = _households(n)
+        return lambda: calculate(**inputs), n
+    return setup
+
+
+def _energy_table(results):
+    from engine import ENERGY_BREAKDOWN
+    from results import ResultTable
+    return ResultTable.from_results(results, ['energy', 'emissions'], ENERGY_BREAKDOWN,
+                                    ['Energy (kWh)', 'Emissions (kg of CO2)'])
+
+
+def bench_generate_df():
+    from engine import calculate
+    from helper import generate_df
+    table = _energy_table(calculate())
+    return lambda: generate_df(table), None
+
+
+def bench_result_table_1m():
+    #breakdowns of a million households into the compact table and out to Arrow
+    from engine import calculate
+    results = calculate(**_households(1000000))
+    return lambda: _energy_table(results).to_arrow('household'), 1000000
+
+
+def bench_lifecycle_100k():
+    #20 year projection of 100k households under every scenario, including the IRR search
+    from lifecycle import project
+    inputs = _households(100000)
+    return lambda: project(inputs), 100000
+
+
+def bench_catalog_100k():
+    #100k households against a 5,000 model catalog, top 5 by running cost
+    from catalog import example_catalog, recommend_models
+    inputs, models = _households(100000), example_catalog(5000)
+    return lambda: recommend_models(inputs, 'cost', 5, models), 100000
+
+
+def _meter_readings(offset_minutes=0):
+    """
+    30 days of hourly gas and electricity readings of 10k meters, every other meter read offset_minutes later
+    """
+    import numpy as np
+    import pandas as pd
+    from hourly import synthetic_weather
+    from meters import degree_days
+    hdd = degree_days(synthetic_weather(8.5, 13.5))
+    n_meters, hours = 10000, 30*24
+    rng = np.random.default_rng(0)
+    meter_ids = pd.Categorical.from_codes(np.repeat(np.arange(n_meters), hours), [f'M{m:06d}' for m in range(n_meters)])
+    offsets = np.repeat(np.arange(n_meters) % 2 * offset_minutes, hours).astype('timedelta64[m]')
+    stamps = np.tile(np.datetime64('2023-01-01T01:00') + np.arange(hours).astype('timedelta64[h]'), n_meters) + offsets
+    gas, elec = rng.uniform(0, 3, len(stamps)), rng.uniform(0, 1, len(stamps))
+    return hdd, meter_ids, stamps, gas, elec
+
+
+def bench_meters_10k():
+    #the readings into the degree-day sums
+    from meters import MeterAccumulator
+    hdd, meter_ids, stamps, gas, elec = _meter_readings()
+    def run():
+        acc = MeterAccumulator(hdd, 60)
+        acc.add(meter_ids, stamps, gas, elec)
+        return acc.fit()
+    return run, len(stamps)
+
+
+def bench_meters_staggered_10k():
+    #half the meters read 30 minutes later and the interval found per meter; fails if a
+    #meter's interval is taken from another meter's readings
+    import numpy as np
+    from meters import MeterAccumulator
+    hdd, meter_ids, stamps, gas, elec = _meter_readings(30)
+    def run():
+        acc = MeterAccumulator(hdd)
+        acc.add(meter_ids, stamps, gas, elec)
+        fit = acc.fit()
+        if not np.allclose(fit['gas_days'], 30):
+            raise RuntimeError(f"staggered meters fitted on {fit['gas_days'].min():.1f} to {fit['gas_days'].max():.1f} days, not 30")
+        return fit
+    return run, len(stamps)
+
+
+def bench_grid_carbon_100k():
+    #100k households on the marginal series of their region: one (households x uses) product per series
+    import numpy as np
+    from engine import calculate
+    rng = np.random.default_rng(0)
+    n = 100000
+    inputs = {'gas_total_kWh': rng.uniform(5000, 30000, n), 'elec_total_kWh': rng.uniform(1500, 6000, n),
+              'grid_region': rng.choice(['Ontario', 'BC', 'Alberta', 'Quebec', 'UK'], n), 'grid_carbon': 'marginal'}
+    def run():
+        return calculate(**inputs)
+    return run, n
+
+
+def bench_dispatch_10k():
+    #a year of hourly PV, battery and cylinder dispatch for 10k homes on a time-of-use tariff
+    import numpy as np
+    from dispatch import household_dispatch
+    from engine import prepare_inputs, split_demand
+    rng = np.random.default_rng(0)
+    n = 10000
+    inp = prepare_inputs(gas_total_kWh=rng.uniform(5000, 30000, n), hw_lday=rng.uniform(50, 500, n),
+                         elec_tariff='Ontario ULO')
+    split = split_demand(inp)
+    system = {'pv_kWp': rng.uniform(0, 8, n), 'battery_kWh': rng.choice([0.0, 10.0, 13.5], n)}
+    def run():
+        return household_dispatch('Typical', inp, split, 'Ontario', 'tariff', system=system)
+    return run, n
+
+
+def bench_portfolio_filter_1m():
+    #one dashboard interaction on a million scored households: filter, then the histogram,
+    #percentile and totals rows sent to the charts
+    import portfolio
+    pf = portfolio.from_frame(portfolio.example_results(1000000))
+    regions = list(pf.labels['region'])
+    def run():
+        mask = pf.mask({'region': regions[:2]})
+        cases = pf.cases('cost_saving')
+        return (portfolio.histogram_frame(pf, 'cost_saving', cases, mask),
+                portfolio.quantile_frame(pf, 'cost_saving', cases, 'region', mask),
+                portfolio.totals_frame(pf, 'costs', cases[0], 'region', mask))
+    return run, 1000000
+
+
+def bench_graph_price_edit():
+    #a new gas unit price on every call: the three cases' costs and the costs chart data are
+    #recomputed, everything else is served from the graph's cache
+    import itertools
+    from cache import ResultCache
+    from depgraph import case_nodes, engine_graph
+    graph = engine_graph(ResultCache(maxsize=100000, ttl=None))
+    names = [name for key in ('energy', 'emissions', 'costs') for name in case_nodes(key)]
+    prices = itertools.count(10.0, 0.01)
+    def run():
+        inputs = {'gas_total_kWh': 15000.0, 'elec_total_kWh': 3500.0, 'gas_unit': next(prices)}
+        return [graph.get(name, inputs) for name in names]
+    return run, 1
+
+
+def _energy_df():
+    from engine import calculate
+    from helper import generate_df
+    return generate_df(_energy_table(calculate()))
+
+
+def bench_graph_shared_hit():
+    #a results page's nodes in a new server process, served from another process's SQLite cache
+    import tempfile
+    from cache import ResultCache, SharedCache
+    from depgraph import case_nodes, engine_graph
+    shared = SharedCache(os.path.join(tempfile.mkdtemp(), 'results.sqlite'))
+    names = [name for key in ('energy', 'emissions', 'costs') for name in case_nodes(key)]
+    inputs = {'gas_total_kWh': 12000.0, 'elec_total_kWh': 3000.0, 'hw_lday': 350.0}
+    for name in names:
+        engine_graph(ResultCache(shared=shared)).get(name, inputs)
+    def run():
+        graph = engine_graph(ResultCache(shared=shared))
+        return [graph.get(name, inputs) for name in names]
+    return run, 1
+
+
+def bench_chart_build():
+    #the Altair chart and its serialization, as st.altair_chart would do
+    from helper import make_stacked_bar_horiz
+    df = _energy_df()
+    return lambda: make_stacked_bar_horiz(df, 'Energy (kWh)').to_dict(), None
+
+
+def bench_chart_spec():
+    #the prebuilt Vega-Lite spec the results page uses
+    from helper import stacked_bar_horiz_spec
+    return lambda: stacked_bar_horiz_spec('Energy (kWh)'), None
+
+
+def _app_test():
+    if HERE not in sys.path:
+        sys.path.insert(0, HERE)
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(os.path.join(HERE, 'streamlit_app.py'), default_timeout=120)
+    at.run()
+    return at
+
+
+def _submit(at):
+    next(b for b in at.button if b.label == 'Update results').click()
+    at.run()
+    if at.exception:
+        raise RuntimeError(f'app raised: {at.exception[0].value}')
+
+
+def bench_page_first_run():
+    #script run with the form only, as on opening the page
+    return lambda: _app_test(), None
+
+
+_COLD_START = '''
+import json, sys, time
+sys.path.insert(0, {here!r})
+from streamlit.testing.v1 import AppTest
+start = time.perf_counter()
+AppTest.from_file({app!r}, default_timeout=120).run()
+print(json.dumps({{'seconds': time.perf_counter() - start,
+                  'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def cold_start():
+    """
+    first render of the page in a new Python process: returns (seconds, heavy modules imported)
+    """
+    code = _COLD_START.format(here=HERE, app=os.path.join(HERE, 'streamlit_app.py'), heavy=HEAVY_MODULES)
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    report = json.loads(out.strip().splitlines()[-1])
+    return report['seconds'], report['heavy']
+
+
+def bench_page_cold_start():
+    #the whole new process is timed, as a user opening the app after a restart would wait for it
+    def run():
+        seconds, heavy = cold_start()
+        if heavy:
+            raise RuntimeError('first render imported ' + ', '.join(heavy))
+    return run, None
+
+
+def bench_page_rerun():
+    #Update results with the result cache emptied first: the full calculation and page build
+    from cache import results_cache
+    at = _app_test()
+
+    def rerun():
+        results_cache.clear()
+        _submit(at)
+    return rerun, None
+
+
+def bench_page_rerun_cached():
+    #Update results again with the same inputs, as after any other widget interaction
+    at = _app_test()
+    return lambda: _submit(at), None
+
+
+#name: (setup, repeat, quick)
+BENCHMARKS = {
+    'engine_scalar': (bench_engine_scalar, 200, True),
+    'engine_batch_1k': (_bench_engine_batch(1000), 50, True),
+    'engine_batch_100k': (_bench_engine_batch(100000), 10, True),
+    'engine_batch_1m': (_bench_engine_batch(1000000), 3, False),
+    'generate_df': (bench_generate_df, 200, True),
+    'result_table_1m': (bench_result_table_1m, 5, False),
+    'lifecycle_100k': (bench_lifecycle_100k, 3, False),
+    'catalog_100k': (bench_catalog_100k, 5, False),
+    'meters_10k': (bench_meters_10k, 5, False),
+    'meters_staggered_10k': (bench_meters_staggered_10k, 5, False),
+    'grid_carbon_100k': (bench_grid_carbon_100k, 10, True),
+    'dispatch_10k': (bench_dispatch_10k, 2, False),
+    'portfolio_filter_1m': (bench_portfolio_filter_1m, 5, False),
+    'graph_price_edit': (bench_graph_price_edit, 200, True),
+    'graph_shared_hit': (bench_graph_shared_hit, 200, True),
+    'chart_build': (bench_chart_build, 20, True),
+    'chart_spec': (bench_chart_spec, 200, True),
+    'page_cold_start': (bench_page_cold_start, 3, False),
+    'page_first_run': (bench_page_first_run, 3, False),
+    'page_rerun': (bench_page_rerun, 5, False),
+    'page_rerun_cached': (bench_page_rerun_cached, 5, False),
+}
+
+
+def run_benchmarks(names):
+    results = {}
+    for name in names:
+        setup, repeat, quick = BENCHMARKS[name]
+        func, rows = setup()
+        result = measure(func, repeat)
+        if rows:
+            result['rows_per_s'] = rows / result['best_s']
+        results[name] = result
+        print(f"{name:20s} best {result['best_s']*1000:10.3f} ms   median {result['median_s']*1000:10.3f} ms   "
+              f"peak {result['peak_mb']:8.1f} MB" + (f"   {result['rows_per_s']:,.0f} rows/s" if rows else ''), flush=True)
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def baseline(history, machine, runs=BASELINE_RUNS):
+    """
+    median best time and peak memory of each benchmark over the most recent runs on machine
+    """
+    records = [r for r in history if r.get('machine') == machine][-runs:]
+    base = {}
+    for name in {n for r in records for n in r['results']}:
+        values = [r['results'][name] for r in records if name in r['results']]
+        base[name] = {'best_s': statistics.median(v['best_s'] for v in values),
+                      'peak_mb': statistics.median(v['peak_mb'] for v in values)}
+    return base
+
+
+def regressions(results, base, time_threshold=TIME_THRESHOLD, memory_threshold=MEMORY_THRESHOLD):
+    """
+    list of messages for benchmarks slower or bigger than the baseline allows
+    """
+    found = []
+    for name, result in results.items():
+        if name not in base:
+            continue
+        limit = base[name]['best_s'] * time_threshold + TIME_SLACK
+        if result['best_s'] > limit:
+            found.append(f"{name}: {result['best_s']*1000:.3f} ms vs baseline {base[name]['best_s']*1000:.3f} ms")
+        #small allocations vary with caches warmed by earlier benchmarks; ignore below 1 MB
+        if result['peak_mb'] > max(base[name]['peak_mb'] * memory_threshold, 1.0):
+            found.append(f"{name}: peak {result['peak_mb']:.1f} MB vs baseline {base[name]['peak_mb']:.1f} MB")
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the performance benchmarks and check for regressions.')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='benchmarks to run')
+    parser.add_argument('--quick', action='store_true', help='skip the slow benchmarks')
+    parser.add_argument('--history', default=DEFAULT_HISTORY, help='JSON-lines history file (default %(default)s)')
+    parser.add_argument('--no-save', action='store_true', help="don't add this run to the history")
+    parser.add_argument('--time-threshold', type=float, default=TIME_THRESHOLD)
+    parser.add_argument('--memory-threshold', type=float, default=MEMORY_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    names = args.only or [name for name, (setup, repeat, quick) in BENCHMARKS.items() if quick or not args.quick]
+    machine = f'{platform.node()} {platform.machine()} {os.cpu_count()} cpu'
+    results = run_benchmarks(names)
+
+    history = load_history(args.history)
+    found = regressions(results, baseline(history, machine), args.time_threshold, args.memory_threshold)
+    if 'page_cold_start' in results and results['page_cold_start']['best_s'] > COLD_START_BUDGET_S:
+        found.append(f"page_cold_start: {results['page_cold_start']['best_s']:.2f} s is over the "
+                     f"{COLD_START_BUDGET_S:.1f} s budget")
+
+    if sys.platform != 'win32':
+        import resource
+        max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f'process high-water mark {max_rss_mb:,.0f} MB')
+    else:
+        max_rss_mb = None
+
+    if not args.no_save:
+        record = {'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                  'commit': _git_commit(), 'machine': machine, 'python': platform.python_version(),
+                  'numpy': np.__version__, 'max_rss_mb': max_rss_mb, 'results': results}
+        with open(args.history, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    if found:
+        print('REGRESSIONS:\n  ' + '\n  '.join(found))
+        return 1
+    print('no regressions' if history else 'no history yet - this run is the baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# In-process result cache.  Streamlit reruns the whole script on every interaction but
+# imports this module only once per server process, so entries are shared by all
+# sessions served by the process.
+#
+# With several server processes (replicas behind a load balancer) set HP_CACHE_DIR to a
+# local directory and results are also kept in a SQLite file there, shared by every
+# process on the machine.  Entries are tagged with a hash of the model's source and data
+# files, so a change to the engine, tariffs or SAP constants starts a fresh cache.
+#
+#   HP_CACHE_DIR=/var/cache/heatpump streamlit run streamlit_app.py
+
+import hashlib
+import os
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+#files whose contents decide the cached values - the app and helper build the chart data
+#and sensitivity tables it caches, so they are included; tooling is left out
+MODEL_FILES = ('engine.py', 'defaults.py', 'tariffs.py', 'regions.py', 'region_store.py', 'region_store.npy',
+               'grid_carbon.py', 'grid_carbon.npy', 'hourly.py', 'dispatch.py', 'depgraph.py', 'results.py',
+               'reference_tables.json', 'sensitivity.py', 'uncertainty.py', 'retrofit.py', 'lifecycle.py',
+               'catalog.py', 'heat_pump_catalog.csv', 'helper.py', 'streamlit_app.py')
+SHARED_CACHE_DIR = os.environ.get('HP_CACHE_DIR')
+
+
+def normalize_key(value):
+    """
+    Turn inputs into a hashable key where equal values give equal keys: numpy scalars
+    become python scalars, floats are rounded to drop noise and dicts are sorted.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((k, normalize_key(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize_key(v) for v in value)
+    #numpy scalars can only turn up once numpy is loaded - not importing it keeps app start-up light
+    np = sys.modules.get('numpy')
+    if np is not None and isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        return round(value, 9)
+    return value
+
+
+def is_plain(key):
+    """
+    True if a normalize_key result holds only python scalars, strings and tuples, so its repr
+    is a complete and stable description of it (arrays and objects are not shared between processes)
+    """
+    if isinstance(key, tuple):
+        return all(is_plain(k) for k in key)
+    return key is None or isinstance(key, (str, bytes, bool, int, float))
+
+
+def model_version(files=MODEL_FILES, directory=PACKAGE_DIR):
+    """
+    short hash of the model files' contents, changing whenever results could change
+    """
+    digest = hashlib.sha256()
+    for name in files:
+        digest.update(name.encode())
+        try:
+            with open(os.path.join(directory, name), 'rb') as f:
+                digest.update(f.read())
+        except FileNotFoundError:
+            digest.update(b'missing')
+    return digest.hexdigest()[:16]
+
+
+class SharedCache:
+    """
+    Result cache in a SQLite file, shared by every process that opens it.
+    Values are pickled, so only point it at a directory the server alone can write to.
+    path - SQLite file, created if missing
+    max_bytes - total size of the pickled values kept, least recently used are evicted first
+    max_entry_bytes - larger values are not stored
+    ttl - seconds an entry stays valid, None to keep until evicted
+    version - entries of any other version are ignored and deleted, default model_version()
+    """
+    #seconds between updates of an entry's last used time, so hits are mostly read-only
+    TOUCH_INTERVAL = 60
+
+    def __init__(self, path, max_bytes=256*2**20, max_entry_bytes=4*2**20, ttl=None, version=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """
+        this thread's connection - sqlite3 connections cannot be shared between threads
+        """
+        con = getattr(self._local, 'con', None)
+        if con is not None:
+            return con
+        import sqlite3
+
+        if self.version is None:
+            self.version = model_version()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        #autocommit, waiting up to 10 s for another process's write to finish
+        con = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        #write-ahead logging lets readers carry on while one process writes
+        con.execute('PRAGMA journal_mode=WAL')
+        con.execute('PRAGMA synchronous=NORMAL')
+        con.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, version TEXT, value BLOB, '
+                    'size INTEGER, created REAL, used REAL)')
+        con.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+        con.execute('DELETE FROM results WHERE version != ?', (self.version,))
+        self._local.con = con
+        return con
+
+    @staticmethod
+    def digest(key):
+        """
+        fixed length text key of a normalize_key result
+        """
+        return hashlib.sha256(repr(key).encode()).hexdigest()
+
+    def get(self, key):
+        """
+        key - a normalize_key result
+        returns (True, value) on a hit and (False, None) on a miss
+        """
+        digest = self.digest(key)
+        now = time.time()
+        try:
+            con = self._connect()
+            row = con.execute('SELECT value, created, used FROM results WHERE key = ? AND version = ?',
+                              (digest, self.version)).fetchone()
+            if row is None or (self.ttl is not None and now - row[1] >= self.ttl):
+                self._count('misses')
+                return False, None
+            value = pickle.loads(row[0])
+            if now - row[2] >= self.TOUCH_INTERVAL:
+                con.execute('UPDATE results SET used = ? WHERE key = ?', (now, digest))
+        except Exception:
+            #a locked, full or damaged cache file is treated as a miss, never as a page error
+            self._count('errors')
+            return False, None
+        self._count('hits')
+        return True, value
+
+    def put(self, key, value):
+        """
+        store value under key (a normalize_key result), unless it is too large or cannot be pickled
+        """
+        try:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return
+        if len(blob) > self.max_entry_bytes:
+            return
+        now = time.time()
+        try:
+            con = self._connect()
+            con.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                        (self.digest(key), self.version, blob, len(blob), now, now))
+            self._evict(con)
+        except Exception:
+            self._count('errors')
+
+    def _evict(self, con):
+        """
+        delete the least recently used entries once the total size is over max_bytes
+        """
+        total = con.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        #free a tenth more than needed, so eviction does not run on every following write
+        excess = total - 0.9*self.max_bytes
+        keys = []
+        for digest, size in con.execute('SELECT key, size FROM results ORDER BY used'):
+            keys.append((digest,))
+            excess -= size
+            if excess <= 0:
+                break
+        con.executemany('DELETE FROM results WHERE key = ?', keys)
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def clear(self):
+        try:
+            self._connect().execute('DELETE FROM results')
+        except Exception:
+            self._count('errors')
+        with self._lock:
+            self.hits = self.misses = self.errors = 0
+
+    def stats(self):
+        try:
+            size, used_bytes = self._connect().execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+        except Exception:
+            size = used_bytes = 0
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'errors': self.errors,
+                    'size': size, 'bytes': used_bytes, 'max_bytes': self.max_bytes}
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache with an optional time-to-live and hit/miss counters.
+    maxsize - number of entries kept, least recently used are evicted first
+    ttl - seconds an entry stays valid, None to keep until evicted
+    shared - SharedCache checked on a miss before computing, and given each computed value
+    """
+    def __init__(self, maxsize=256, ttl=3600, shared=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, func, shared=True):
+        """
+        return the cached value for key, calling func() to make it on a miss
+        shared - False to keep the value out of the shared cache, e.g. for large or per-session values
+        """
+        key = normalize_key(key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (self.ttl is None or now - entry[0] < self.ttl):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        #compute outside the lock so other sessions are not held up
+        shared = self.shared if shared and is_plain(key) else None
+        found, value = shared.get(key) if shared is not None else (False, None)
+        if not found:
+            value = func()
+            if shared is not None:
+                shared.put(key, value)
+        with self._lock:
+            self._data[key] = (now, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            stats = {'hits': self.hits, 'misses': self.misses,
+                     'size': len(self._data), 'maxsize': self.maxsize}
+        if self.shared is not None:
+            stats.update({'shared_' + k: v for k, v in self.shared.stats().items()})
+        return stats
+
+
+#results, tables and charts of the results section, keyed on the submitted inputs - the
+#dependency graph's nodes (depgraph.py) take about 16 entries per submission
+results_cache = ResultCache(maxsize=4096, ttl=3600, shared=SharedCache(
+    os.path.join(SHARED_CACHE_DIR, 'results.sqlite'), ttl=7*24*3600) if SHARED_CACHE_DIR else None)
@@ -0,0 +1,247 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Heat pump product catalog scoring: every household against every model in a catalog,
+# returning each household's best models by running cost, emissions or payback.
+#
+# A heat pump case's costs, emissions and energy are affine in 1/SCOP and 1/COP (the
+# heat pump's electricity for heating and hot water is the heat delivered divided by
+# them), so the engine is run at three SCOP/COP points to get three coefficients per
+# household.  A (households, 3) by (3, models) matrix product then scores every model,
+# and np.argpartition picks the top k without sorting whole rows.  Tiered block tariffs
+# are the exception - their block charges are interpolated between the three points.
+# Models that k others beat on every count are dropped from the catalog first.
+#
+# A model must be able to meet the household's design heat load (heat delivered by the
+# heat pump over FULL_LOAD_HOURS) to be recommended.
+#
+#   python catalog.py households.csv models.csv --by payback --top 3
+
+import argparse
+import csv
+import os
+import time
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from engine import do_current_case, do_heat_pump_case, prepare_inputs, split_demand
+
+
+CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'heat_pump_catalog.csv')
+#columns of a catalog file besides the model name
+CATALOG_COLUMNS = ('heat_scop', 'hw_cop', 'capacity_kW', 'price')
+
+#equivalent full-load hours of space heating in a year: design load (kW) = annual heat (kWh) / hours
+FULL_LOAD_HOURS = 2000
+#SCOP and COP the engine is evaluated at to get each household's coefficients
+EVAL_POINTS = ((3.0, 2.5), (4.0, 2.5), (3.0, 3.0))
+#household x model scores are built in chunks of about this many elements
+CHUNK_ELEMENTS = 20_000_000
+
+#ranking objectives: score column, lower is better
+OBJECTIVES = {'cost': 'annual_cost', 'emissions': 'emissions', 'payback': 'payback_years'}
+
+
+def _catalog(model, heat_scop, hw_cop, capacity_kW, price):
+    catalog = {'model': np.asarray(model, dtype=str)}
+    for name, values in zip(CATALOG_COLUMNS, (heat_scop, hw_cop, capacity_kW, price)):
+        catalog[name] = np.asarray(values, dtype=np.float64)
+    #the model side of the matrix product: constant, 1/SCOP, 1/COP
+    catalog['terms'] = np.stack([np.ones(len(catalog['model'])), 1 / catalog['heat_scop'], 1 / catalog['hw_cop']])
+    for values in catalog.values():
+        values.flags.writeable = False
+    return catalog
+
+
+@lru_cache(maxsize=None)
+def load_catalog(path=CATALOG_PATH):
+    """
+    Catalog as a dict of read-only arrays (model, heat_scop, hw_cop, capacity_kW, price), read
+    once per process.  The file is CSV with those columns, price being the installed cost (£).
+    """
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    missing = {'model', *CATALOG_COLUMNS} - set(rows[0] if rows else ())
+    if missing:
+        raise ValueError(f'{path} is missing catalog columns: ' + ', '.join(sorted(missing)))
+    return _catalog(*([r[name] for r in rows] for name in ('model', *CATALOG_COLUMNS)))
+
+
+def example_catalog(n, seed=0):
+    """
+    n made-up models with plausible ranges, for benchmarks and tests of large catalogs
+    """
+    rng = np.random.default_rng(seed)
+    capacity = rng.choice([4, 5, 6, 7, 8, 9, 10, 12, 14, 16], n)
+    heat_scop = rng.uniform(2.6, 4.6, n)
+    price = 4000 + capacity * rng.uniform(300, 600, n) + (heat_scop - 2.6) * 2000
+    return _catalog([f'Model {i}' for i in range(n)], heat_scop, rng.uniform(2.2, 3.2, n), capacity, price.round(-1))
+
+
+def household_terms(inputs):
+    """
+    Affine coefficients (constant, per 1/SCOP, per 1/COP) of each household's heat pump case.
+    returns dict of current_cost, current_emissions (n,), cost, emissions (n, 3) and design_kW (n,)
+    """
+    inp = prepare_inputs(**inputs)
+    split = split_demand(inp)
+    current = do_current_case(inp, split)
+    n = len(current['costs_total'])
+
+    values = {'cost': [], 'emissions': [], 'heat': []}
+    for heat_scop, hw_cop in EVAL_POINTS:
+        point = dict(inp, hp_heat_scop_typ=np.full(n, heat_scop), hp_hw_cop_typ=np.full(n, hw_cop))
+        res = do_heat_pump_case('Typical', point, split)
+        values['cost'].append(res['costs_total'])
+        values['emissions'].append(res['emissions_total'])
+        #heating energy column: gas left in use plus the heat pump's electricity
+        values['heat'].append(res['energy'][:, 0])
+
+    (s0, c0), (s1, _), (_, c2) = EVAL_POINTS
+    coef = {}
+    for key, (v0, v1, v2) in values.items():
+        per_scop = (v1 - v0) / (1/s1 - 1/s0)
+        per_cop = (v2 - v0) / (1/c2 - 1/c0)
+        coef[key] = np.stack([v0 - per_scop/s0 - per_cop/c0, per_scop, per_cop], axis=1)
+    #heat delivered by the heat pump is its heating electricity times the SCOP: the 1/SCOP coefficient
+    return {'current_cost': current['costs_total'], 'current_emissions': current['emissions_total'],
+            'cost': coef['cost'], 'emissions': coef['emissions'],
+            'design_kW': np.maximum(coef['heat'][:, 1], 0) / FULL_LOAD_HOURS}
+
+
+def undominated(catalog, by='cost', k=3, step=1000):
+    """
+    indices of the models that fewer than k others dominate: as big, as efficient (and for
+    payback as cheap) and better in at least one.  Scores only get worse with lower capacity,
+    SCOP and COP (and higher price), so a model dominated k times is never in a top k.
+    """
+    columns = [catalog['capacity_kW'], -catalog['terms'][1], -catalog['terms'][2]]
+    if by == 'payback':
+        columns.append(-catalog['price'])
+    count = np.zeros(len(columns[0]), dtype=np.int64)
+    for start in range(0, len(count), step):
+        #[i, j]: model j is at least as good as model start + i on every count, and better on one
+        geq = np.ones((min(step, len(count) - start), len(count)), dtype=bool)
+        gt = np.zeros_like(geq)
+        for values in columns:
+            block = values[start:start+step, None]
+            geq &= values >= block
+            gt |= values > block
+        count[start:start+step] = (geq & gt).sum(axis=1)
+    return np.nonzero(count < k)[0]
+
+
+def top_k(score, k):
+    """
+    (n, k) column indices of the k lowest scores in each row, lowest first
+    """
+    if k < score.shape[1]:
+        idx = np.argpartition(score, k - 1, axis=1)[:, :k]
+    else:
+        idx = np.broadcast_to(np.arange(score.shape[1]), score.shape)
+    order = np.argsort(np.take_along_axis(score, idx, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(idx, order, axis=1)
+
+
+def score_chunk(terms, catalog, by='cost', top=3):
+    """
+    terms - household_terms for a chunk of households
+    returns dict of (n, top) arrays: model index and its annual cost, emissions and payback;
+    model -1 where fewer than top models can meet the design load
+    """
+    #only the ranking score is built for every model; the other metrics just for the top k
+    coef = terms['emissions'] if by == 'emissions' else terms['cost']
+    score = coef @ catalog['terms']
+    if by == 'payback':
+        saving = terms['current_cost'][:, None] - score
+        score = np.where(saving > 0, catalog['price'] / np.where(saving > 0, saving, 1), np.inf)
+    fits = catalog['capacity_kW'] >= terms['design_kW'][:, None]
+    score[~fits] = np.inf
+    idx = top_k(score, min(top, score.shape[1]))
+
+    model_terms = catalog['terms'][:, idx]
+    annual_cost = np.einsum('nk,knt->nt', terms['cost'], model_terms)
+    saving = terms['current_cost'][:, None] - annual_cost
+    return {'model': np.where(np.take_along_axis(fits, idx, axis=1), idx, -1),
+            'annual_cost': annual_cost,
+            'emissions': np.einsum('nk,knt->nt', terms['emissions'], model_terms),
+            'payback_years': np.where(saving > 0, catalog['price'][idx] / np.where(saving > 0, saving, 1), np.inf)}
+
+
+def recommend_models(inputs, by='cost', top=3, catalog=None):
+    """
+    inputs - engine inputs, scalars or one array entry per household
+    by - 'cost', 'emissions' or 'payback'
+    catalog - from load_catalog or example_catalog, default the bundled catalog
+    returns DataFrame with up to `top` models per household, best first
+    """
+    if by not in OBJECTIVES:
+        raise ValueError(f'Unknown objective {by!r}, choose from: ' + ', '.join(OBJECTIVES))
+    if catalog is None:
+        catalog = load_catalog()
+    n = max([np.size(v) for v in inputs.values()], default=1)
+    #dominated models are dropped before scoring - valid for households whose scores never fall with SCOP or COP
+    keep = undominated(catalog, by, top)
+    shortlist = {name: values[..., keep] for name, values in catalog.items()}
+    step = max(CHUNK_ELEMENTS // len(catalog['model']), 1)
+
+    parts = []
+    for start in range(0, n, step):
+        chunk = {k: (np.broadcast_to(v, n)[start:start+step] if np.ndim(v) else v) for k, v in inputs.items()}
+        terms = household_terms(chunk)
+        picked = score_chunk(terms, shortlist, by, top)
+        picked['model'] = np.where(picked['model'] >= 0, keep[picked['model']], -1)
+        #households whose costs fall as SCOP or COP worsen (e.g. with more hot water than gas use) score the whole catalog
+        odd = (terms['cost'][:, 1:] < -1e-9).any(axis=1) | (terms['emissions'][:, 1:] < -1e-9).any(axis=1)
+        if odd.any():
+            full = score_chunk({key: values[odd] for key, values in terms.items()}, catalog, by, top)
+            for key, values in full.items():
+                picked[key][odd] = values
+        hh, rank = np.nonzero(picked['model'] >= 0)
+        model = picked['model'][hh, rank]
+        saving = terms['current_cost'][hh] - picked['annual_cost'][hh, rank]
+        parts.append(pd.DataFrame({
+            'household': hh + start,
+            'rank': rank + 1,
+            'model': catalog['model'][model],
+            'heat_scop': catalog['heat_scop'][model],
+            'hw_cop': catalog['hw_cop'][model],
+            'capacity_kW': catalog['capacity_kW'][model],
+            'design_kW': terms['design_kW'][hh],
+            'price': catalog['price'][model],
+            'annual_cost': picked['annual_cost'][hh, rank],
+            'annual_saving': saving,
+            'emissions': picked['emissions'][hh, rank],
+            'payback_years': picked['payback_years'][hh, rank],
+        }))
+    return pd.concat(parts, ignore_index=True)
+
+
+def main(argv=None):
+    from batch import ChunkWriter, input_columns, input_names, read_chunks
+
+    parser = argparse.ArgumentParser(description='Recommend heat pump models from a catalog for a file of households.')
+    parser.add_argument('input', help='CSV or Parquet file of households, columns named as engine inputs')
+    parser.add_argument('output', help='CSV or Parquet file for the recommended models')
+    parser.add_argument('--catalog', default=CATALOG_PATH, help='catalog CSV (default %(default)s)')
+    parser.add_argument('--by', choices=list(OBJECTIVES), default='cost', help='ranking (default %(default)s)')
+    parser.add_argument('--top', type=int, default=3, help='models per household (default %(default)s)')
+    parser.add_argument('--chunksize', type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    catalog = load_catalog(args.catalog)
+    rows = 0
+    start = time.perf_counter()
+    with ChunkWriter(args.output) as writer:
+        for df in read_chunks(args.input, args.chunksize, input_names()):
+            models = recommend_models(input_columns(df), args.by, args.top, catalog)
+            models['household'] += rows
+            writer.write(models)
+            rows += len(df)
+    elapsed = time.perf_counter() - start
+    print(f'{rows:,} households x {len(catalog["model"]):,} models in {elapsed:.2f} s '
+          f'({rows/max(elapsed, 1e-9):,.0f} households/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Default values, result layout and household inputs.  Plain Python only, so the form
+# can be drawn without importing numpy or the engine.
+
+
+#__________ set default values______________
+#efficiencies and performance coefficients - default values
+boiler_heat_eff = 0.88
+boiler_hw_eff = 0.88
+immersion_hw_eff = 1
+#typical heat pump performance:
+hp_heat_scop_typ = 3.2
+hp_hw_cop_typ = 2.7
+#hi heat pump performance
+hp_heat_scop_hi = 3.8
+hp_hw_cop_hi = 2.8
+
+#Raise in temp (degC) from mains water to hot water AS USED
+hw_temp_raise_default = 25
+
+#carbon intensity values taken from SAP 10.2 (dec 2021)
+GAS_kgCO2perkWh = 0.21
+ELEC_RENEW_kgCO2perkWh = 0
+ELEC_AVE_kgCO2perkWh = 0.136
+
+# price cap October 2022 gas and electricity domestic standing and unit charges
+gas_stand = 28.0
+gas_unit = 10.3
+elec_stand = 46.0
+elec_unit = 34.0
+
+#__________ result layout______________
+CASES = ('Current', 'Typical HP Install', 'Hi-performance HP Install')
+INSTALL_TYPES = ('Typical', 'Hi-performance')
+ENERGY_BREAKDOWN = ('Heating', 'Hot water', 'Cooking', 'Other Elec.')
+COST_BREAKDOWN = ('Gas standing', 'Gas unit', 'Elec.  standing', 'Elec.  unit')
+
+#suffixes used for flat column names, following the _typ/_hi naming used in the app
+CASE_SUFFIX = {'Current': '', 'Typical HP Install': '_typ', 'Hi-performance HP Install': '_hi'}
+
+# household inputs and their defaults (the defaults match the form's initial state)
+INPUT_DEFAULTS = {
+    'gas_total_kWh': 12000.0,
+    'elec_total_kWh': 3000.0,
+    'hw_lday': 350.0,
+    'is_hw_gas': True,
+    'is_cook_gas': False,
+    'gas_cook_kWhweek': 8.0,
+    #metered annual gas use that does not follow the weather (hot water and cooking, see meters.py),
+    #nan to estimate hot water and cooking from the inputs above
+    'gas_base_kWh': float('nan'),
+    'is_second_heatsource': False,
+    'second_heatsource_type': 'gas',
+    'is_second_heatsource_remains': True,
+    'second_heatsource_kWh': 0.0,
+    'efficiency_boost': 0.0,
+    'is_disconnect_gas': False,
+    'is_free_summer_hw': False,
+    'is_elec_renewable': False,
+    #carbon intensities (kgCO2/kWh), electricity being the grid average (see regions.py for other regions)
+    'gas_kgCO2perkWh': GAS_kgCO2perkWh,
+    'elec_kgCO2perkWh': ELEC_AVE_kgCO2perkWh,
+    #'annual' for elec_kgCO2perkWh at all hours, or the 'average' or 'marginal' hourly series of
+    #grid_region (see grid_carbon.py) weighted by when each use draws power
+    'grid_carbon': 'annual',
+    'grid_region': '',
+    'is_two_tier_tariff': False,
+    #named time-of-use or tiered tariff from tariffs.TARIFFS, '' for the flat/off-peak rates
+    'elec_tariff': '',
+    'elec_unit2': 18.0,
+    'second_tariff_hours': 7.0,
+    'pc_elec_second_tariff': 0.4,
+    'gas_stand': gas_stand,
+    'gas_unit': gas_unit,
+    'elec_stand': elec_stand,
+    'elec_unit': elec_unit,
+    'boiler_heat_eff': boiler_heat_eff,
+    'boiler_hw_eff': boiler_hw_eff,
+    'immersion_hw_eff': float(immersion_hw_eff),
+    'hp_heat_scop_typ': hp_heat_scop_typ,
+    'hp_hw_cop_typ': hp_hw_cop_typ,
+    'hp_heat_scop_hi': hp_heat_scop_hi,
+    'hp_hw_cop_hi': hp_hw_cop_hi,
+    'hw_temp_raise': float(hw_temp_raise_default),
+}
+
+#efficiency measures: (label, heating demand saving, typical installed cost £)
+MEASURES = [('Draft proofing and/or door insulation', 0.03, 250),
+            ('Increased loft insulation', 0.05, 500),
+            ('Improved window glazing', 0.05, 7000),
+            ('Cavity wall insulation', 0.1, 1500),
+            ('Underfloor insulation', 0.1, 3000),
+            ('Internal or external solid wall insulation', 0.15, 10000)]
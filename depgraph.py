@@ -0,0 +1,127 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Dependency graph of the engine's derived quantities, for interactive edits.  Each node
+# names the household inputs and the other nodes it reads, and its value is memoized in
+# the result cache under the values of every input upstream of it.  So when one input is
+# edited only the nodes downstream of it are recomputed: a new gas price reprices the three
+# cases but serves the energy use, emissions and their charts from the cache.
+#
+# Nodes are keyed on input values, so inputs should be scalars (a form submission) - batch
+# runs of many households go straight through engine.calculate.
+
+from functools import partial
+
+from cache import results_cache
+from defaults import CASES, CASE_SUFFIX, INSTALL_TYPES
+from engine import (prepare_inputs, hw_kWh_per_litre, split_gas, split_elec,
+                    current_energy, current_emissions, current_costs,
+                    heat_pump_energy, heat_pump_emissions, heat_pump_costs)
+from instrument import span
+
+
+class Node:
+    __slots__ = ('func', 'inputs', 'deps', 'upstream')
+
+    def __init__(self, func, inputs, deps, upstream):
+        self.func = func
+        self.inputs = inputs
+        self.deps = deps
+        self.upstream = upstream
+
+
+class Graph:
+    """
+    Memoized nodes computed on demand from household inputs.
+    cache - ResultCache holding node values, shared by all graphs using it
+    prepare - turns the raw inputs into what node functions read, e.g. prepare_inputs
+    """
+    def __init__(self, cache=results_cache, prepare=None):
+        self.nodes = {}
+        self.cache = cache
+        self.prepare = prepare
+        #names of the nodes computed rather than served from the cache, in order
+        self.computed = []
+
+    def add(self, name, func, inputs=(), deps=()):
+        """
+        func(inp, *dep_values) - inp holds only the named inputs, so a function reading any
+        other input fails rather than being served stale values
+        deps - names of nodes already added
+        """
+        unknown = [d for d in deps if d not in self.nodes]
+        if unknown:
+            raise ValueError(f'Unknown node {unknown[0]!r}, choose from: ' + ', '.join(self.nodes))
+        upstream = set(inputs)
+        for d in deps:
+            upstream.update(self.nodes[d].upstream)
+        self.nodes[name] = Node(func, tuple(inputs), tuple(deps), tuple(sorted(upstream)))
+
+    def get(self, name, inputs):
+        """
+        value of node name for the inputs (a dict of raw household inputs)
+        """
+        return self._get(name, inputs, {})
+
+    def _get(self, name, inputs, run):
+        node = self.nodes[name]
+        key = ('node', name, tuple(inputs.get(k) for k in node.upstream))
+
+        def compute():
+            args = [self._get(d, inputs, run) for d in node.deps]
+            #inputs are prepared at most once per get, and only if something is computed
+            if 'inp' not in run:
+                run['inp'] = self.prepare(inputs) if self.prepare else inputs
+            inp = {k: run['inp'][k] for k in node.inputs}
+            with span('node_' + name):
+                value = node.func(inp, *args)
+            self.computed.append(name)
+            return value
+
+        return self.cache.get_or_compute(key, compute)
+
+
+def case_nodes(key):
+    """
+    names of a quantity's nodes in CASES order, e.g. costs, costs_typ, costs_hi
+    """
+    return [key + CASE_SUFFIX[case_name] for case_name in CASES]
+
+
+HW_INPUTS = ('hw_temp_raise', 'boiler_hw_eff', 'immersion_hw_eff')
+GAS_SPLIT_INPUTS = ('is_hw_gas', 'hw_lday', 'is_cook_gas', 'gas_cook_kWhweek', 'gas_base_kWh', 'gas_total_kWh')
+ELEC_SPLIT_INPUTS = ('is_hw_gas', 'hw_lday', 'is_second_heatsource', 'second_heatsource_type',
+                     'second_heatsource_kWh', 'elec_total_kWh')
+CARBON_INPUTS = ('is_elec_renewable', 'elec_kgCO2perkWh', 'gas_kgCO2perkWh', 'grid_carbon', 'grid_region')
+#grid_region and elec_tariff also pick the default prices (see engine.regional_prices)
+ELEC_PRICE_INPUTS = ('elec_stand', 'elec_unit', 'elec_unit2', 'elec_tariff', 'is_two_tier_tariff',
+                     'pc_elec_second_tariff', 'second_tariff_hours', 'grid_region')
+HP_ENERGY_INPUTS = ('efficiency_boost', 'boiler_heat_eff', 'immersion_hw_eff', 'is_hw_gas', 'is_disconnect_gas',
+                    'is_second_heatsource', 'is_second_heatsource_remains', 'second_heatsource_type',
+                    'second_heatsource_kWh')
+HP_PERFORMANCE_INPUTS = {'Typical': ('hp_heat_scop_typ', 'hp_hw_cop_typ'),
+                         'Hi-performance': ('hp_heat_scop_hi', 'hp_hw_cop_hi')}
+
+
+def engine_graph(cache=results_cache):
+    """
+    Graph of the engine's nodes: hw_kWhperL, gas_split, elec_split and split, then energy,
+    emissions and costs of each case (see case_nodes), laid out as in calculate() results
+    """
+    graph = Graph(cache, lambda inputs: prepare_inputs(**inputs))
+    graph.add('hw_kWhperL', hw_kWh_per_litre, HW_INPUTS)
+    graph.add('gas_split', split_gas, GAS_SPLIT_INPUTS, ['hw_kWhperL'])
+    graph.add('elec_split', split_elec, ELEC_SPLIT_INPUTS, ['hw_kWhperL'])
+    graph.add('split', lambda inp, gas, elec: {**gas, **elec}, deps=['gas_split', 'elec_split'])
+
+    graph.add('energy', current_energy, ('gas_total_kWh', 'elec_total_kWh'), ['split'])
+    graph.add('emissions', current_emissions, CARBON_INPUTS + ('elec_total_kWh',), ['split'])
+    graph.add('costs', current_costs, ELEC_PRICE_INPUTS + ('elec_total_kWh', 'gas_stand', 'gas_unit', 'gas_total_kWh'),
+              ['split'])
+
+    for install_type, case_name in zip(INSTALL_TYPES, CASES[1:]):
+        suffix = CASE_SUFFIX[case_name]
+        graph.add('energy' + suffix, partial(heat_pump_energy, install_type),
+                  HP_ENERGY_INPUTS + HP_PERFORMANCE_INPUTS[install_type], ['split'])
+        graph.add('emissions' + suffix, heat_pump_emissions, CARBON_INPUTS, ['energy' + suffix])
+        graph.add('costs' + suffix, heat_pump_costs,
+                  ELEC_PRICE_INPUTS + ('is_disconnect_gas', 'is_free_summer_hw', 'gas_stand', 'gas_unit'), ['energy' + suffix])
+    return graph
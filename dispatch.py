@@ -0,0 +1,400 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Hourly dispatch of rooftop solar PV, a home battery and the heat pump's hot water cylinder.
+# Each hour the PV output meets the household's baseload and heat pump space heating first;
+# the cylinder, which loses heat all the time, is reheated by the heat pump and the battery
+# charges and discharges, by one of two strategies:
+#   self_consumption - surplus PV heats the cylinder and then charges the battery, the battery
+#       covers any shortfall, and the cylinder is only reheated from the grid when it runs low
+#   tariff - as self_consumption, but in each day's cheapest hours (a time-of-use tariff's
+#       off-peak, or the off-peak hours of a two tier tariff) the cylinder is reheated and the
+#       battery charged from the grid, leaving room for the next 24 hours of PV output (a
+#       perfect forecast), and the battery is saved for the dearer hours
+#
+# This replaces the engine's is_free_summer_hw flag with the PV actually used, and allows
+# for the cylinder's standing losses.  The state (cylinder heat, battery charge) carries
+# from hour to hour, so the year is a loop over 8760 hours - each step is a handful of array
+# operations across every household at once.  Hourly inputs are held as a few shared rows
+# (a weather series, a region's PV output, a tariff) scaled per household, so nothing of
+# size households x 8760 is built.
+#
+#   python dispatch.py --households 10000 --region Ontario --pv 5 --battery 10
+
+import argparse
+import time
+
+import numpy as np
+
+import tariffs
+from hourly import HOURS, REGION_CLIMATE, series_factors, synthetic_weather
+
+
+STRATEGIES = ('self_consumption', 'tariff')
+
+#latitude (deg) and annual output (kWh per kWp) of a south facing rooftop array
+REGION_SOLAR = {'Ontario': (43.7, 1150.0), 'BC': (49.3, 1050.0), 'Alberta': (51.0, 1250.0), 'Quebec': (46.8, 1100.0)}
+
+#share of each day's hot water drawn in each hour, midnight first
+HW_DRAW_SHAPE = [0, 0, 0, 0, 0, 0.02, 0.08, 0.15, 0.12, 0.06, 0.04, 0.03,
+                 0.03, 0.03, 0.03, 0.03, 0.04, 0.06, 0.07, 0.07, 0.06, 0.04, 0.03, 0.01]
+
+#cold mains temperature (degC)
+COLD_TEMP = 10.0
+#specific heat of water (kWh per litre per degC)
+WATER_kWhperLK = 4.186 / 3600
+
+#PV, battery and cylinder of each household, any of which can be per household arrays
+SYSTEM_DEFAULTS = {
+    'pv_kWp': 0.0,
+    'battery_kWh': 0.0,
+    #battery charge and discharge power limit (kW) and round trip efficiency
+    'battery_kW': 3.0,
+    'battery_eff': 0.9,
+    'tank_litres': 200.0,
+    #the cylinder is heated up to tank_temp and reheated from the grid below tank_reserve of full
+    'tank_temp': 55.0,
+    'tank_reserve': 0.3,
+    #standing loss of the full cylinder (kWh a day), from its label; a stratified cylinder loses
+    #heat in proportion to its hot volume
+    'tank_loss_kWhday': 1.5,
+    #heat pump output available for the cylinder (kW of heat)
+    'hp_hw_kW': 3.0,
+    #payment for exported electricity (p or cents/kWh, in the currency of the electricity prices)
+    'export_unit': 5.0,
+}
+
+
+class Profile:
+    """
+    Hourly values of each household, offset + scale * table[hour, index].
+    table - (8760, n_rows) rows shared by households, e.g. one per weather series or tariff
+    index - row of each household
+    """
+    __slots__ = ('table', 'index', 'scale', 'offset')
+
+    def __init__(self, table, index=0, scale=1.0, offset=0.0, n=1):
+        self.table = np.ascontiguousarray(np.asarray(table, dtype=np.float64).reshape(HOURS, -1))
+        self.index = np.broadcast_to(np.asarray(index, dtype=np.intp), n)
+        self.scale = np.broadcast_to(np.asarray(scale, dtype=np.float64), n)
+        self.offset = np.broadcast_to(np.asarray(offset, dtype=np.float64), n)
+        #a single row needs no gather
+        if self.table.shape[1] == 1:
+            self.table = self.table[:, 0]
+            self.index = None
+
+    def at(self, hour):
+        row = self.table[hour]
+        return self.offset + self.scale * (row if self.index is None else row[self.index])
+
+    def total(self):
+        """
+        annual sum per household
+        """
+        sums = self.table.sum(axis=0)
+        return self.offset * HOURS + self.scale * (sums if self.index is None else sums[self.index])
+
+    def ahead(self, hours=24):
+        """
+        Profile of the sum over each hour and the following hours - 1, wrapping round the year end
+        """
+        table = self.table.reshape(HOURS, -1)
+        cumulative = np.cumsum(np.concatenate([np.zeros((1, table.shape[1])), table, table[:hours]]), axis=0)
+        index = 0 if self.index is None else self.index
+        return Profile(cumulative[hours:hours + HOURS] - cumulative[:HOURS], index, self.scale, self.offset * hours,
+                       len(self.scale))
+
+
+def pv_profile(region, seed=0):
+    """
+    (8760,) output of 1 kWp of PV (kWh) in each hour: clear sky sun elevation with a random
+    cloudiness each day, scaled to the region's annual output
+    """
+    if region not in REGION_SOLAR:
+        raise ValueError(f'Unknown region {region!r}, choose from: ' + ', '.join(REGION_SOLAR))
+    latitude, annual_kWh = REGION_SOLAR[region]
+    hours = np.arange(HOURS)
+    days = hours // 24
+    lat = np.radians(latitude)
+    declination = np.radians(23.45) * np.sin(2*np.pi*(284 + days + 1)/365)
+    hour_angle = np.radians(15 * (hours % 24 + 0.5 - 12))
+    elevation = np.sin(lat)*np.sin(declination) + np.cos(lat)*np.cos(declination)*np.cos(hour_angle)
+    clearness = np.random.default_rng(seed).uniform(0.2, 1.0, 365)[days]
+    output = np.maximum(elevation, 0) * clearness
+    return output * annual_kWh / output.sum()
+
+
+def hw_draw_profile():
+    """
+    (8760,) share of the annual hot water drawn in each hour
+    """
+    daily = np.asarray(HW_DRAW_SHAPE, dtype=float)
+    return np.tile(daily / daily.sum(), 365) / 365
+
+
+def day_cheapest(rates):
+    """
+    rates - (8760, n_rows) hourly rates
+    returns bool array, True in the hours at each day's lowest rate where the day has dearer hours
+    """
+    daily = rates.reshape(365, 24, -1)
+    low, high = daily.min(axis=1, keepdims=True), daily.max(axis=1, keepdims=True)
+    return ((daily == low) & (low < high)).reshape(rates.shape)
+
+
+def price_profiles(elec_unit, elec_tariff='', is_two_tier_tariff=False, elec_unit2=0.0, second_tariff_hours=0.0, n=1):
+    """
+    Hourly electricity rate (p/kWh) of each household and the hours counted as cheap.
+    Named tariffs (tariffs.TARIFFS) use their compiled rates; otherwise the flat rate, with
+    two tier tariffs at elec_unit2 for second_tariff_hours from midnight.
+    returns rate and cheap Profiles
+    """
+    names = np.broadcast_to(np.asarray(elec_tariff, dtype=str), n)
+    two_tier = np.broadcast_to(is_two_tier_tariff, n)
+    elec_unit, elec_unit2 = np.broadcast_to(elec_unit, n), np.broadcast_to(elec_unit2, n)
+    #rows: off-peak indicators for 0 to 24 hours from midnight, then one per named tariff
+    offpeak = (tariffs.HOUR_OF_DAY[:, None] < np.arange(25)).astype(np.float64)
+    rows = [offpeak]
+    index = np.where(two_tier, np.clip(np.round(np.broadcast_to(second_tariff_hours, n)), 0, 24), 0).astype(np.intp)
+    scale = np.where(two_tier, elec_unit2 - elec_unit, 0.0)
+    offset = np.array(elec_unit, dtype=np.float64)
+    #off-peak hours are only cheap if the second tier rate is the lower one
+    cheap_scale = np.where(scale < 0, 1.0, 0.0)
+    for name in np.unique(names[names != '']):
+        idx = np.nonzero(names == name)[0]
+        rows.append(tariffs.compile_tariff(name)['rates'][:, None])
+        index[idx], scale[idx], offset[idx], cheap_scale[idx] = offpeak.shape[1] + len(rows) - 2, 1.0, 0.0, 1.0
+    table = np.hstack(rows)
+    cheap = np.hstack([offpeak, day_cheapest(table[:, offpeak.shape[1]:])])
+    return Profile(table, index, scale, offset, n), Profile(cheap, index, cheap_scale, 0.0, n)
+
+
+def carbon_profile(elec_kgCO2perkWh, is_elec_renewable=False, grid_region='', grid_carbon='annual', n=1):
+    """
+    Hourly carbon intensity (kgCO2e/kWh) of imported electricity: the hourly series of
+    grid_region where grid_carbon selects one, otherwise the annual value
+    """
+    from grid_carbon import series
+
+    regions = np.broadcast_to(np.asarray(grid_region, dtype=str), n)
+    offset = np.where(is_elec_renewable, 0.0, np.broadcast_to(elec_kgCO2perkWh, n)).astype(np.float64)
+    bases = np.where(is_elec_renewable, 'annual', np.broadcast_to(np.asarray(grid_carbon, dtype=str), n))
+    rows, index, scale = [np.zeros(HOURS)], np.zeros(n, dtype=np.intp), np.zeros(n)
+    for basis in np.unique(bases):
+        if basis == 'annual':
+            continue
+        for region in np.unique(regions[bases == basis]):
+            #series checks the basis; regions without a series keep the annual value
+            values = series(region, basis)
+            if values is None:
+                continue
+            idx = np.nonzero((bases == basis) & (regions == region))[0]
+            rows.append(values)
+            index[idx], scale[idx], offset[idx] = len(rows) - 1, 1.0, 0.0
+    return Profile(np.stack(rows, axis=1), index, scale, offset, n)
+
+
+def simulate(loads, hw_draw, pv, rate, cheap, carbon, hp_hw_cop, strategy='self_consumption', system=None, n=1):
+    """
+    loads - Profiles of electricity use other than hot water, e.g. heat pump space heating and baseload (kWh)
+    hw_draw - Profile of hot water drawn from the cylinder (kWh of heat)
+    pv - Profile of PV output (kWh)
+    rate, cheap, carbon - Profiles from price_profiles and carbon_profile
+    hp_hw_cop - heat pump COP when heating the cylinder
+    system - dict of SYSTEM_DEFAULTS entries, scalars or per household
+    returns dict of annual totals per household (kWh, £ or $ in the currency of the prices, kgCO2e)
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f'Unknown strategy {strategy!r}, choose from: ' + ', '.join(STRATEGIES))
+    unknown = set(system or {}) - set(SYSTEM_DEFAULTS)
+    if unknown:
+        raise ValueError('Unknown system inputs: ' + ', '.join(sorted(unknown)))
+    spec = {name: np.broadcast_to(np.asarray((system or {}).get(name, default), dtype=np.float64), n)
+            for name, default in SYSTEM_DEFAULTS.items()}
+    is_tariff = strategy == 'tariff'
+    cop = np.broadcast_to(np.asarray(hp_hw_cop, dtype=np.float64), n)
+
+    #cylinder: heat stored above the cold mains temperature (kWh)
+    heat_capacity = spec['tank_litres'] * WATER_kWhperLK
+    tank_full = heat_capacity * np.maximum(spec['tank_temp'] - COLD_TEMP, 0)
+    tank_reserve = spec['tank_reserve'] * tank_full
+    #share of the stored heat lost each hour
+    loss_rate = np.divide(spec['tank_loss_kWhday'] / 24, tank_full, out=np.zeros(n), where=tank_full > 0)
+    hp_hw_kW = spec['hp_hw_kW']
+    #battery: one way efficiency is the square root of the round trip
+    eta = np.sqrt(spec['battery_eff'])
+    battery_kWh, battery_kW = spec['battery_kWh'], spec['battery_kW']
+
+    pv_ahead = pv.ahead() if is_tariff else None
+    tank, soc = tank_full.copy(), np.zeros(n)
+    names = ('import_kWh', 'export_kWh', 'hw_elec_kWh', 'immersion_kWh', 'tank_loss_kWh', 'battery_out_kWh',
+             'import_cost', 'emissions')
+    totals = {name: np.zeros(n) for name in names}
+    monthly_import = np.zeros((12, n))
+    month = tariffs.MONTH - 1
+
+    for hour in range(HOURS):
+        loss = np.minimum(loss_rate, 1) * tank
+        tank -= loss
+        draw = hw_draw.at(hour)
+        load = sum(profile.at(hour) for profile in loads)
+        solar = pv.at(hour)
+        surplus = np.maximum(solar - load, 0)
+        if is_tariff:
+            is_cheap = cheap.at(hour) > 0
+            solar_ahead = pv_ahead.at(hour)
+        else:
+            is_cheap = False
+
+        #cylinder heat: surplus PV first, then grid heat to keep the reserve, or when cheap to
+        #fill it less the heat expected from PV
+        headroom = tank_full + draw - tank
+        q_pv = np.minimum(np.minimum(surplus * cop, hp_hw_kW), headroom)
+        if is_tariff:
+            target = np.where(is_cheap, np.maximum(tank_full - solar_ahead * cop, tank_reserve), tank_reserve) + draw - tank
+        else:
+            target = tank_reserve + draw - tank
+        q_grid = np.clip(target - q_pv, 0, hp_hw_kW - q_pv)
+        #a draw the stored and heat pump heat can't meet is met by the immersion heater
+        boost = np.maximum(draw - tank - q_pv - q_grid, 0)
+        tank += q_pv + q_grid + boost - draw
+        hw_elec = (q_pv + q_grid) / cop + boost
+        net = load + hw_elec - solar
+
+        #battery: charge from surplus (and the grid when cheap), discharge into a shortfall
+        room = (battery_kWh - soc) / eta
+        charge = np.minimum(np.minimum(np.maximum(-net, 0), battery_kW), room)
+        discharge = np.minimum(np.minimum(np.maximum(net, 0), battery_kW), soc * eta)
+        if is_tariff:
+            grid_charge = np.clip((battery_kWh - solar_ahead - soc) / eta, 0, battery_kW)
+            charge = np.where(is_cheap, np.maximum(charge, grid_charge), charge)
+            discharge = np.where(is_cheap, 0, discharge)
+        soc += charge * eta - discharge / eta
+        net += charge - discharge
+
+        imported = np.maximum(net, 0)
+        exported = np.maximum(-net, 0)
+        totals['import_kWh'] += imported
+        totals['export_kWh'] += exported
+        totals['hw_elec_kWh'] += hw_elec
+        totals['immersion_kWh'] += boost
+        totals['tank_loss_kWh'] += loss
+        totals['battery_out_kWh'] += discharge
+        totals['import_cost'] += imported * rate.at(hour)
+        totals['emissions'] += imported * carbon.at(hour)
+        monthly_import[month[hour]] += imported
+
+    totals['pv_kWh'] = pv.total()
+    totals['pv_used_kWh'] = totals['pv_kWh'] - totals['export_kWh']
+    totals['export_credit'] = totals['export_kWh'] * spec['export_unit'] / 100
+    totals['import_cost'] /= 100
+    totals['monthly_import_kWh'] = monthly_import.T
+    return totals
+
+
+def household_dispatch(install_type, inp, split, region='Ontario', strategy='self_consumption', temps=None,
+                       system=None):
+    """
+    Hourly dispatch of the heat pump case of engine.do_heat_pump_case with PV, battery and cylinder.
+    install type either 'Typical' or 'Hi-performance'
+    inp, split - dicts from engine.prepare_inputs and engine.split_demand
+    region - climate and PV output (REGION_SOLAR), used for the weather unless temps is given
+    system - dict of SYSTEM_DEFAULTS entries, scalars or per household
+    Space heating is as hourly.hourly_heat_pump_case, with the furnace below the bivalent point
+    reported as backup_gas_kWh.  Hot water and cooking move to electricity as in the annual engine.
+    returns dict of simulate's totals plus elec_cost (in the currency of the prices, energy charges less export payments)
+    """
+    n = len(inp['gas_total_kWh'])
+    if install_type == 'Hi-performance':
+        hp_heat_scop, hp_hw_cop = inp['hp_heat_scop_hi'], inp['hp_hw_cop_hi']
+    else:
+        hp_heat_scop, hp_hw_cop = inp['hp_heat_scop_typ'], inp['hp_hw_cop_typ']
+    if temps is None:
+        if region not in REGION_CLIMATE:
+            raise ValueError(f'Unknown region {region!r}, choose from: ' + ', '.join(REGION_CLIMATE))
+        temps = synthetic_weather(*REGION_CLIMATE[region])
+
+    factors = series_factors(temps)
+    annual_heat_kWh = (1 - inp['efficiency_boost']) * split['gas_heat_kWh'] * inp['boiler_heat_eff']
+    heating = Profile(factors['elec'].T, 0, annual_heat_kWh / hp_heat_scop, n=n)
+    #electric cooking and other use, with gas cooking moving over when the gas is disconnected
+    shapes = tariffs.component_shapes(region)
+    loads = [heating, Profile(shapes[3], 0, split['elec_other_kWh'], n=n)]
+    if inp['is_disconnect_gas'].any():
+        loads.append(Profile(shapes[2], 0, np.where(inp['is_disconnect_gas'], split['gas_cook_kWh'], 0), n=n))
+    hw_heat_kWh = np.where(inp['is_hw_gas'], split['gas_hw_kWh'] * inp['boiler_hw_eff'],
+                           split['elec_hw_kWh'] * inp['immersion_hw_eff'])
+    hw_draw = Profile(hw_draw_profile(), 0, hw_heat_kWh, n=n)
+    pv_kWp = (system or {}).get('pv_kWp', SYSTEM_DEFAULTS['pv_kWp'])
+    pv = Profile(pv_profile(region), 0, pv_kWp, n=n)
+    rate, cheap = price_profiles(inp['elec_unit'], inp['elec_tariff'], inp['is_two_tier_tariff'],
+                                 inp['elec_unit2'], inp['second_tariff_hours'], n)
+    carbon = carbon_profile(inp['elec_kgCO2perkWh'], inp['is_elec_renewable'], inp['grid_region'],
+                            inp['grid_carbon'], n)
+
+    results = simulate(loads, hw_draw, pv, rate, cheap, carbon, hp_hw_cop, strategy, system, n)
+    results['backup_gas_kWh'] = annual_heat_kWh / inp['boiler_heat_eff'] * factors['gas'].sum()
+    #block charges of tiered tariffs on the monthly imports
+    results['elec_cost'] = results['import_cost'] - results['export_credit']
+    for name in np.unique(inp['elec_tariff'][inp['elec_tariff'] != '']):
+        tariff = tariffs.compile_tariff(name)
+        if tariff['increments'].any():
+            idx = np.nonzero(inp['elec_tariff'] == name)[0]
+            results['elec_cost'][idx] += tariffs.block_charges(results['monthly_import_kWh'][idx], tariff) / 100
+    return results
+
+
+#annual totals reported per household and install by compare
+SUMMARY_COLUMNS = ('import_kWh', 'export_kWh', 'pv_kWh', 'pv_used_kWh', 'tank_loss_kWh', 'immersion_kWh',
+                   'elec_cost', 'emissions', 'backup_gas_kWh')
+
+
+def compare(inputs, region='Ontario', strategy='self_consumption', system=None):
+    """
+    inputs - engine inputs, scalars or one array entry per household
+    system - dict of SYSTEM_DEFAULTS entries, scalars or per household
+    returns DataFrame with a row per household and heat pump install of the SUMMARY_COLUMNS
+    """
+    import pandas as pd
+    from engine import INSTALL_TYPES, prepare_inputs, split_demand
+
+    #prices not given are the region's, in its currency
+    inp = prepare_inputs(**{'grid_region': region, **inputs})
+    split = split_demand(inp)
+    n = len(inp['gas_total_kWh'])
+    frames = []
+    for install_type in INSTALL_TYPES:
+        results = household_dispatch(install_type, inp, split, region, strategy, system=system)
+        frames.append(pd.DataFrame({'household': np.arange(n), 'install_type': install_type,
+                                    **{name: results[name] for name in SUMMARY_COLUMNS}}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def main(argv=None):
+    from engine import prepare_inputs, split_demand
+
+    parser = argparse.ArgumentParser(description='Run the hourly PV, battery and hot water dispatch for synthetic households.')
+    parser.add_argument('--households', type=int, default=10000)
+    parser.add_argument('--region', choices=sorted(REGION_SOLAR), default='Ontario')
+    parser.add_argument('--pv', type=float, default=5.0, help='PV array size (kWp)')
+    parser.add_argument('--battery', type=float, default=10.0, help='battery capacity (kWh)')
+    parser.add_argument('--tariff', default='Ontario ULO', help="tariff in tariffs.TARIFFS, '' for a flat rate")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    n = args.households
+    inp = prepare_inputs(gas_total_kWh=rng.uniform(8000, 25000, n), hw_lday=rng.uniform(50, 500, n),
+                         elec_tariff=args.tariff, grid_region=args.region, grid_carbon='marginal')
+    split = split_demand(inp)
+    system = {'pv_kWp': args.pv, 'battery_kWh': args.battery}
+    for strategy in STRATEGIES:
+        start = time.perf_counter()
+        res = household_dispatch('Typical', inp, split, args.region, strategy, system=system)
+        elapsed = time.perf_counter() - start
+        print(f'{strategy}: {n:,} households x {HOURS} hours in {elapsed:.2f} s')
+        print(f'  mean import {res["import_kWh"].mean():,.0f} kWh, export {res["export_kWh"].mean():,.0f} kWh, '
+              f'PV used {res["pv_used_kWh"].mean() / max(res["pv_kWh"].mean(), 1e-9):.0%}, '
+              f'cylinder loss {res["tank_loss_kWh"].mean():,.0f} kWh, '
+              f'electricity cost {res["elec_cost"].mean():,.0f}, emissions {res["emissions"].mean():,.0f} kg')
+
+
+if __name__ == '__main__':
+    main()
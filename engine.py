@@ -0,0 +1,410 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Calculation engine. Every household input can be a scalar or a 1-d array with one
+# entry per household, so the same code scores a single form submission or a whole
+# portfolio in one pass.
+
+import numpy as np
+
+import grid_carbon
+import regions
+import tariffs
+from instrument import span
+#default values, result layout and household inputs
+from defaults import (ELEC_RENEW_kgCO2perkWh,
+                      CASES, INSTALL_TYPES, ENERGY_BREAKDOWN, COST_BREAKDOWN, CASE_SUFFIX, INPUT_DEFAULTS)
+
+#prices not given are those of the household's region, so they are in the same currency as a
+#named tariff: the tariff's region, otherwise grid_region, otherwise the defaults (UK price cap)
+REGIONAL_PRICE_INPUTS = ('gas_stand', 'gas_unit', 'elec_stand', 'elec_unit')
+
+
+def prepare_inputs(**kwargs):
+    """
+    kwargs - household inputs named as in INPUT_DEFAULTS, each a scalar or 1-d array
+    returns dict of equal length 1-d arrays, missing inputs filled with their defaults
+    """
+    unknown = set(kwargs) - set(INPUT_DEFAULTS)
+    if unknown:
+        raise ValueError('Unknown household inputs: ' + ', '.join(sorted(unknown)))
+
+    cols = {}
+    for name, default in INPUT_DEFAULTS.items():
+        value = kwargs.get(name, default)
+        if isinstance(default, bool):
+            cols[name] = np.asarray(value, dtype=bool)
+        elif isinstance(default, str):
+            cols[name] = np.asarray(value, dtype=str)
+        else:
+            cols[name] = np.asarray(value, dtype=np.float64)
+
+    missing = [name for name in REGIONAL_PRICE_INPUTS if name not in kwargs]
+    if missing:
+        prices = regional_prices(cols['elec_tariff'], cols['grid_region'])
+        for name in missing:
+            cols[name] = prices.get(name, cols[name])
+
+    arrays = np.broadcast_arrays(*[np.atleast_1d(c) for c in cols.values()])
+    return dict(zip(cols.keys(), arrays))
+
+
+def regional_prices(elec_tariff, grid_region):
+    """
+    elec_tariff, grid_region - household inputs, scalars or 1-d arrays
+    returns dict of REGIONAL_PRICE_INPUTS arrays, the default prices for each household's region,
+            empty if no household has a named tariff or a region
+    """
+    tariff = np.atleast_1d(np.asarray(elec_tariff, dtype=str))
+    region = np.atleast_1d(np.asarray(grid_region, dtype=str))
+    if not (tariff != '').any() and not (region != '').any():
+        return {}
+    tariff, region = np.broadcast_arrays(tariff, region)
+    named = tariff != ''
+    #unknown tariff names are reported when the tariff is compiled
+    for name in np.unique(tariff[named]):
+        if name in tariffs.TARIFFS:
+            region = np.where(tariff == name, tariffs.TARIFFS[name]['region'], region)
+
+    prices = {name: np.full(region.shape, INPUT_DEFAULTS[name], dtype=np.float64) for name in REGIONAL_PRICE_INPUTS}
+    for name in np.unique(region[region != '']):
+        utility = regions.utility(name)
+        at = region == name
+        for price in REGIONAL_PRICE_INPUTS:
+            prices[price][at] = utility[price]
+    return prices
+
+
+def hw_kWh_per_litre(inp):
+    """
+    kWh to raise a litre of hot water by hw_temp_raise with the gas boiler and with an immersion heater
+    """
+    #calculate hot water kWh/L
+    GAS_HW_kWhperL = 4200 * inp['hw_temp_raise']/(3600 * 1000 * inp['boiler_hw_eff'])
+    IMMERSION_HW_kWhperL = 4200 * inp['hw_temp_raise']/(3600 * 1000 * inp['immersion_hw_eff'])
+    return {'GAS_HW_kWhperL': GAS_HW_kWhperL, 'IMMERSION_HW_kWhperL': IMMERSION_HW_kWhperL}
+
+
+def split_gas(inp, kWhperL):
+    """
+    Split the annual gas total into hot water, cooking and the heating remainder.
+    kWhperL - dict from hw_kWh_per_litre, used unless the household's baseload was metered
+    """
+    # hot water energy demand
+    gas_hw_kWh = np.where(inp['is_hw_gas'], inp['hw_lday'] * 365 * kWhperL['GAS_HW_kWhperL'], 0)
+
+    #cooking demand - only done if gas
+    gas_cook_kWh = np.where(inp['is_cook_gas'], inp['gas_cook_kWhweek'] * 52, 0)
+
+    #a metered baseload is all hot water and cooking - cooking is as entered, up to the baseload
+    base = inp['gas_base_kWh']
+    is_metered = ~np.isnan(base)
+    gas_cook_kWh = np.where(is_metered, np.minimum(gas_cook_kWh, np.maximum(base, 0)), gas_cook_kWh)
+    gas_hw_kWh = np.where(is_metered, np.where(inp['is_hw_gas'], np.maximum(base - gas_cook_kWh, 0), 0), gas_hw_kWh)
+
+    #gas heating is remainder after hot water and cooking removed
+    gas_heat_kWh = inp['gas_total_kWh'] - gas_hw_kWh - gas_cook_kWh
+    return {'gas_heat_kWh': gas_heat_kWh, 'gas_hw_kWh': gas_hw_kWh, 'gas_cook_kWh': gas_cook_kWh}
+
+
+def split_elec(inp, kWhperL):
+    """
+    Split the annual electricity total into heating, hot water and other use.
+    kWhperL - dict from hw_kWh_per_litre
+    """
+    elec_hw_kWh = np.where(inp['is_hw_gas'], 0, inp['hw_lday'] * 365 * kWhperL['IMMERSION_HW_kWhperL'])
+
+    #see if there's any electric heating in addition:
+    is_second_elec = inp['is_second_heatsource'] & (inp['second_heatsource_type'] == 'electric')
+    elec_heat_kWh = np.where(is_second_elec, inp['second_heatsource_kWh'], 0)
+
+    #electric other is remainder after heating and hw removed
+    elec_other_kWh = inp['elec_total_kWh'] - elec_heat_kWh - elec_hw_kWh
+
+    #if other electricity is now negative, assume user has overestimated either
+    # their electric hw usage or electric heating - whichever the greater.
+    #reduce to bring other electricity to zero.
+    is_negative = elec_other_kWh < 0
+    is_hw_greater = elec_hw_kWh > elec_heat_kWh
+    elec_hw_kWh = np.where(is_negative & is_hw_greater, elec_hw_kWh + elec_other_kWh, elec_hw_kWh)
+    elec_heat_kWh = np.where(is_negative & ~is_hw_greater, elec_heat_kWh + elec_other_kWh, elec_heat_kWh)
+    elec_other_kWh = np.maximum(elec_other_kWh, 0)
+    return {'elec_heat_kWh': elec_heat_kWh, 'elec_hw_kWh': elec_hw_kWh, 'elec_other_kWh': elec_other_kWh}
+
+
+def split_demand(inp):
+    """
+    Split the annual gas and electricity totals into heating, hot water, cooking and other use.
+    inp - dict from prepare_inputs
+    """
+    kWhperL = hw_kWh_per_litre(inp)
+    return {**split_gas(inp, kWhperL), **split_elec(inp, kWhperL)}
+
+
+def elec_carbon_intensity(inp):
+    """
+    select carbon intensity of electricity per household
+    returns (households x 4) intensity of electricity used for heating, hot water, cooking and other,
+            from the hourly series of grid_region where grid_carbon selects one
+    """
+    annual = np.where(inp['is_elec_renewable'], ELEC_RENEW_kgCO2perkWh, inp['elec_kgCO2perkWh'])
+    is_hourly = (inp['grid_carbon'] != 'annual') & ~inp['is_elec_renewable']
+    if not is_hourly.any():
+        return np.repeat(annual[:, None], len(tariffs.COMPONENTS), axis=1)
+    return grid_carbon.component_intensity(inp['grid_region'], np.where(is_hourly, inp['grid_carbon'], 'annual'), annual)
+
+
+def elec_tariff_costs(inp, unit_cost, standing, heating, hot_water, cooking, other, free_summer_hw=False):
+    """
+    unit_cost, standing - annual electricity unit and standing costs (£) from the entered rates
+    heating, hot_water, cooking, other - annual electricity use (kWh)
+    returns the costs with those of households on a named tariff (elec_tariff) or an entered two
+    tier tariff (is_two_tier_tariff, see tariffs.two_tier_costs) replaced; a named tariff takes precedence
+    """
+    has_tariff = inp['elec_tariff'] != ''
+    is_two_tier = inp['is_two_tier_tariff'] & ~has_tariff
+    if not has_tariff.any() and not is_two_tier.any():
+        return unit_cost, standing
+    unit_cost, standing = unit_cost.copy(), standing.copy()
+    free_summer_hw = np.broadcast_to(free_summer_hw, has_tariff.shape)
+    if is_two_tier.any():
+        idx = np.nonzero(is_two_tier)[0]
+        use = [np.broadcast_to(kWh, has_tariff.shape)[idx] for kWh in (heating, hot_water, cooking, other)]
+        unit_cost[idx] = tariffs.two_tier_costs(inp['elec_unit'][idx], inp['elec_unit2'][idx], inp['second_tariff_hours'][idx],
+                                                inp['pc_elec_second_tariff'][idx], *use, free_summer_hw=free_summer_hw[idx])
+    if has_tariff.any():
+        idx = np.nonzero(has_tariff)[0]
+        use = [np.broadcast_to(kWh, has_tariff.shape)[idx] for kWh in (heating, hot_water, cooking, other)]
+        names = inp['elec_tariff'][idx]
+        unit_cost[idx] = tariffs.component_costs(names, *use, free_summer_hw=free_summer_hw[idx])
+        standing[idx] = tariffs.standing_charges(names, inp['elec_stand'][idx])
+    return unit_cost, standing
+
+
+def current_energy(inp, split):
+    """
+    split - dict from split_demand
+    returns dict of energy (households x breakdown) and energy_total of the current case
+    """
+    energy = np.stack([split['gas_heat_kWh'] + split['elec_heat_kWh'], split['gas_hw_kWh'] + split['elec_hw_kWh'],
+                       split['gas_cook_kWh'], split['elec_other_kWh']], axis=1)
+    return {'energy': energy, 'energy_total': inp['gas_total_kWh'] + inp['elec_total_kWh']}
+
+
+def current_emissions(inp, split):
+    """
+    returns dict of emissions (households x breakdown) and emissions_total of the current case
+    """
+    elec_heat_kgCO2perkWh, elec_hw_kgCO2perkWh, _, elec_other_kgCO2perkWh = elec_carbon_intensity(inp).T
+    gas_kgCO2perkWh = inp['gas_kgCO2perkWh']
+    gas_heat_kWh, elec_heat_kWh = split['gas_heat_kWh'], split['elec_heat_kWh']
+    gas_hw_kWh, elec_hw_kWh = split['gas_hw_kWh'], split['elec_hw_kWh']
+    gas_cook_kWh, elec_other_kWh = split['gas_cook_kWh'], split['elec_other_kWh']
+
+    emissions = np.stack([gas_heat_kWh*gas_kgCO2perkWh + elec_heat_kWh*elec_heat_kgCO2perkWh,
+                          gas_hw_kWh*gas_kgCO2perkWh + elec_hw_kWh*elec_hw_kgCO2perkWh,
+                          gas_cook_kWh*gas_kgCO2perkWh,
+                          elec_other_kWh*elec_other_kgCO2perkWh], axis=1)
+    #the whole electricity bill at the intensity of other use, corrected for heating and hot water
+    elec_emissions = (inp['elec_total_kWh']*elec_other_kgCO2perkWh
+                      + elec_heat_kWh*(elec_heat_kgCO2perkWh - elec_other_kgCO2perkWh)
+                      + elec_hw_kWh*(elec_hw_kgCO2perkWh - elec_other_kgCO2perkWh))
+    return {'emissions': emissions,
+            'emissions_total': (gas_heat_kWh + gas_hw_kWh + gas_cook_kWh)*gas_kgCO2perkWh + elec_emissions}
+
+
+def current_costs(inp, split):
+    """
+    returns dict of costs (households x breakdown) and costs_total of the current case
+    """
+    elec_unit_cost, elec_stand_total = elec_tariff_costs(
+        inp, inp['elec_total_kWh'] * inp['elec_unit']/100, inp['elec_stand']*3.65,
+        split['elec_heat_kWh'], split['elec_hw_kWh'], 0, split['elec_other_kWh'])
+    costs = np.stack([inp['gas_stand']*3.65, inp['gas_total_kWh'] * inp['gas_unit']/100,
+                      elec_stand_total, elec_unit_cost], axis=1)
+    return {'costs': costs, 'costs_total': costs.sum(axis=1)}
+
+
+def do_current_case(inp, split):
+    """
+    inp - dict from prepare_inputs
+    split - dict from split_demand
+    returns dict of arrays: energy, emissions, costs (households x breakdown) and their totals
+    """
+    return {**current_energy(inp, split), **current_emissions(inp, split), **current_costs(inp, split)}
+
+
+def heat_pump_energy(install_type, inp, split):
+    """
+    install type either 'Typical' or 'Hi-performance'
+    split - dict from split_demand (current case energy split)
+    returns dict of the heat pump case's gas and electricity use by purpose (kWh), as read by
+            heat_pump_emissions and heat_pump_costs, with energy (households x breakdown) and energy_total
+    """
+
+    #set heat pump performance coefficients to hi or typical:
+    if install_type == 'Hi-performance':
+        hp_heat_scop = inp['hp_heat_scop_hi']
+        hp_hw_cop = inp['hp_hw_cop_hi']
+    else:
+        hp_heat_scop = inp['hp_heat_scop_typ']
+        hp_hw_cop = inp['hp_hw_cop_typ']
+
+    boost = 1 - inp['efficiency_boost']
+    eff = inp['boiler_heat_eff']
+    gas_heat_kWh, elec_heat_kWh = split['gas_heat_kWh'], split['elec_heat_kWh']
+    second_kWh = inp['second_heatsource_kWh']
+
+    #calculate future heating energy - dependent upon second heat source (if any)
+    is_second = inp['is_second_heatsource']
+    remains = is_second & inp['is_second_heatsource_remains']
+    removed = is_second & ~inp['is_second_heatsource_remains']
+    is_gas2 = inp['second_heatsource_type'] == 'gas'
+    is_elec2 = inp['second_heatsource_type'] == 'electric'
+    is_other2 = ~(is_gas2 | is_elec2)
+
+    #a gas secondary source that is removed is treated as the no second heatsource case,
+    #as we assume same efficiency as boiler.  A remaining 'other' source leaves heating as is.
+    elec_heat_kWh = np.select(
+        [~is_second | (removed & is_gas2), remains & is_gas2, remains & is_elec2,
+         removed & is_elec2, removed & is_other2],
+        [boost * gas_heat_kWh * eff/hp_heat_scop,
+         boost * (gas_heat_kWh - second_kWh) * eff/hp_heat_scop,
+         second_kWh + boost * gas_heat_kWh * eff/hp_heat_scop,
+         boost * (gas_heat_kWh * eff + second_kWh)/hp_heat_scop,
+         #other second heatsource, assume gas boiler efficiency, but not included in gas_heat_kWh
+         boost * (gas_heat_kWh + second_kWh) * eff/hp_heat_scop],
+        default=elec_heat_kWh)
+    gas_heat_kWh = np.where(remains & is_gas2, second_kWh, np.where(remains & is_other2, gas_heat_kWh, 0))
+
+    #hot water
+    elec_hw_kWh = np.where(inp['is_hw_gas'], split['gas_hw_kWh'] * eff/hp_hw_cop,
+                           split['elec_hw_kWh'] * inp['immersion_hw_eff']/hp_hw_cop)
+
+    #gas cooking energy (already zero if not cooking with gas)
+    is_disconnect_gas = inp['is_disconnect_gas']
+    elec_cook_kWh = np.where(is_disconnect_gas, split['gas_cook_kWh'], 0)
+    gas_cook_kWh = np.where(is_disconnect_gas, 0, split['gas_cook_kWh'])
+
+    #new energy consumption table
+    elec_other_kWh = split['elec_other_kWh']
+    energy = np.stack([gas_heat_kWh + elec_heat_kWh, elec_hw_kWh,
+                       gas_cook_kWh + elec_cook_kWh, elec_other_kWh], axis=1)
+    return {'gas_heat_kWh': gas_heat_kWh, 'elec_heat_kWh': elec_heat_kWh, 'elec_hw_kWh': elec_hw_kWh,
+            'gas_cook_kWh': gas_cook_kWh, 'elec_cook_kWh': elec_cook_kWh, 'elec_other_kWh': elec_other_kWh,
+            'energy': energy, 'energy_total': energy.sum(axis=1)}
+
+
+def heat_pump_emissions(inp, use):
+    """
+    use - dict from heat_pump_energy
+    returns dict of emissions (households x breakdown) and emissions_total of the heat pump case
+    """
+    elec_kgCO2perkWh = elec_carbon_intensity(inp)
+    gas_kgCO2perkWh = inp['gas_kgCO2perkWh']
+    emissions_cook = use['elec_cook_kWh']*elec_kgCO2perkWh[:, 2] + use['gas_cook_kWh']*gas_kgCO2perkWh
+    emissions = np.stack([use['gas_heat_kWh']*gas_kgCO2perkWh + use['elec_heat_kWh']*elec_kgCO2perkWh[:, 0],
+                          use['elec_hw_kWh']*elec_kgCO2perkWh[:, 1], emissions_cook,
+                          use['elec_other_kWh']*elec_kgCO2perkWh[:, 3]], axis=1)
+    return {'emissions': emissions, 'emissions_total': emissions.sum(axis=1)}
+
+
+def heat_pump_costs(inp, use):
+    """
+    use - dict from heat_pump_energy
+    returns dict of costs (households x breakdown) and costs_total of the heat pump case
+    """
+    gas_heat_kWh, elec_heat_kWh, elec_hw_kWh = use['gas_heat_kWh'], use['elec_heat_kWh'], use['elec_hw_kWh']
+    gas_cook_kWh, elec_cook_kWh, elec_other_kWh = use['gas_cook_kWh'], use['elec_cook_kWh'], use['elec_other_kWh']
+
+    #totals
+    elec_total_kWh = elec_other_kWh + elec_heat_kWh + elec_hw_kWh + elec_cook_kWh
+    gas_total_kWh = gas_heat_kWh + gas_cook_kWh
+
+    #update costs
+
+    #don't include gas standing charge if disconnecting from gas
+    gas_stand_total = np.where(inp['is_disconnect_gas'], 0, inp['gas_stand']*3.65)
+
+    is_free_summer_hw = inp['is_free_summer_hw']
+    #those with solar panels can get free hot water for 4 months
+    elec_unit_total_cost = (elec_total_kWh - np.where(is_free_summer_hw, elec_hw_kWh/3, 0))*inp['elec_unit']/100
+    #two tier and named tariffs price each use by when it happens
+    elec_unit_total_cost, elec_stand_total = elec_tariff_costs(
+        inp, elec_unit_total_cost, inp['elec_stand']*3.65, elec_heat_kWh, elec_hw_kWh,
+        elec_cook_kWh, elec_other_kWh, is_free_summer_hw)
+
+    costs = np.stack([gas_stand_total, gas_total_kWh*inp['gas_unit']/100,
+                      elec_stand_total, elec_unit_total_cost], axis=1)
+
+    return {'costs': costs, 'costs_total': costs.sum(axis=1)}
+
+
+def do_heat_pump_case(install_type, inp, split):
+    """
+    install type either 'Typical' or 'Hi-performance'
+    inp - dict from prepare_inputs
+    split - dict from split_demand (current case energy split)
+    returns dict of arrays laid out as for do_current_case
+    """
+    use = heat_pump_energy(install_type, inp, split)
+    return {'energy': use['energy'], 'energy_total': use['energy_total'],
+            **heat_pump_emissions(inp, use), **heat_pump_costs(inp, use)}
+
+
+def calculate(**kwargs):
+    """
+    kwargs - household inputs, see prepare_inputs
+    returns dict keyed by case name (see CASES) of the case result dicts
+    """
+    with span('engine_prepare_inputs'):
+        inp = prepare_inputs(**kwargs)
+    with span('engine_split_demand'):
+        split = split_demand(inp)
+    with span('engine_current_case'):
+        results = {CASES[0]: do_current_case(inp, split)}
+    for install_type, case_name in zip(INSTALL_TYPES, CASES[1:]):
+        with span('engine_heat_pump_case' + CASE_SUFFIX[case_name]):
+            results[case_name] = do_heat_pump_case(install_type, inp, split)
+    return results
+
+
+# headline comparisons of each heat pump case with the current case
+SUMMARY_METRICS = {'cost_saving_typ': 'Cost saving, typical install (£)',
+                   'cost_saving_hi': 'Cost saving, hi-performance install (£)',
+                   'emissions_saving_typ': 'Emissions saving, typical install (kg CO2)',
+                   'emissions_saving_hi': 'Emissions saving, hi-performance install (kg CO2)',
+                   'emissions_total_typ': 'Emissions, typical install (kg CO2)',
+                   'emissions_total_hi': 'Emissions, hi-performance install (kg CO2)'}
+
+
+def summary_metrics(results):
+    """
+    per-household values of SUMMARY_METRICS from calculate() results
+    """
+    current, typ, hi = (results[case_name] for case_name in CASES)
+    return {'cost_saving_typ': current['costs_total'] - typ['costs_total'],
+            'cost_saving_hi': current['costs_total'] - hi['costs_total'],
+            'emissions_saving_typ': current['emissions_total'] - typ['emissions_total'],
+            'emissions_saving_hi': current['emissions_total'] - hi['emissions_total'],
+            'emissions_total_typ': typ['emissions_total'],
+            'emissions_total_hi': hi['emissions_total']}
+
+
+def _slug(label):
+    return '_'.join(label.lower().replace('.', '').split())
+
+
+def to_columns(results):
+    """
+    Flatten calculate() results into a dict of 1-d arrays with names such as
+    'costs_total', 'costs_total_typ' or 'emissions_hot_water_hi'.
+    """
+    cols = {}
+    for case_name, res in results.items():
+        suffix = CASE_SUFFIX[case_name]
+        for key, breakdown in (('energy', ENERGY_BREAKDOWN), ('emissions', ENERGY_BREAKDOWN), ('costs', COST_BREAKDOWN)):
+            for j, label in enumerate(breakdown):
+                cols[key + '_' + _slug(label) + suffix] = res[key][:, j]
+        for key in ('energy_total', 'emissions_total', 'costs_total'):
+            cols[key + suffix] = res[key]
+    return cols
+
@@ -0,0 +1,178 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Hourly carbon intensity of grid electricity.  A heat pump's load is concentrated in the
+# coldest hours, which are also the grid's peaks - in Ontario those are met by gas-fired
+# generation, so an annual average intensity understates the heat pump's emissions.
+#
+# Each region can have two 8760 hour series (kgCO2e/kWh):
+#   average - the mix of generation running in each hour
+#   marginal - the generation that follows an extra kWh of load in each hour
+# The series are held in one record array (region, basis, hourly values as float32), saved
+# as a .npy file next to this module and memory-mapped when loaded.  Rebuild it after
+# changing the definitions below with
+#
+#   python grid_carbon.py
+#
+# or save measured series with compile_series.  The bundled series are built from each
+# region's annual average (regions.py) and a system demand shape, with illustrative
+# off-peak and peak marginal intensities - replace them with operator data where available.
+#
+# The annual engine spreads each electricity use over the year with the tariff shapes
+# (tariffs.component_shapes), so a use's intensity is its shape-weighted mean of the series:
+# one (households x uses) product per series.  Hourly loads (hourly.simulate, meter data)
+# are multiplied with the series directly.  Regions without a series keep the annual value.
+
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from regions import REGIONS
+import tariffs
+
+HOURS = 8760
+SERIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'grid_carbon.npy')
+
+#'annual' uses the household's elec_kgCO2perkWh; the others the hourly series of its grid_region
+BASES = ('annual', 'average', 'marginal')
+RECORD = np.dtype([('region', 'U16'), ('basis', 'U8'), ('kgCO2perkWh', 'f4', (HOURS,))])
+
+#(off-peak, peak) marginal intensity (kgCO2e/kWh): nuclear and hydro surplus overnight and
+#gas-fired peaks in Ontario, imports in BC and Quebec peaks, gas plant at all hours in Alberta
+MARGINAL_RANGE = {'Ontario': (0.05, 0.45), 'BC': (0.0, 0.35), 'Alberta': (0.37, 0.6), 'Quebec': (0.0, 0.3)}
+#the average intensity of the top demand hour is this much above the annual average, and
+#of the bottom hour as much below it
+AVERAGE_SWING = 0.5
+#share of system demand that follows the weather, the rest the daily shape of other use
+WEATHER_SHARE = 0.5
+
+
+def demand_rank(region):
+    """
+    (8760,) rank of each hour's system demand, 0 the lowest and 1 the highest hour
+    """
+    shapes = tariffs.component_shapes(region)
+    heating, other = shapes[0], shapes[3]
+    demand = WEATHER_SHARE * heating / heating.max() + (1 - WEATHER_SHARE) * other / other.max()
+    rank = np.empty(HOURS)
+    rank[np.argsort(demand, kind='stable')] = np.arange(HOURS) / (HOURS - 1)
+    return rank
+
+
+def build():
+    """
+    record array of the average and marginal series of every region in MARGINAL_RANGE
+    """
+    records = []
+    for region, (low, high) in MARGINAL_RANGE.items():
+        annual = next(iter(REGIONS[region].values()))['elec_kgCO2perkWh']
+        rank = demand_rank(region)
+        #the rank is uniform on [0, 1], so the average series keeps the annual mean
+        records.append((region, 'average', annual * (1 - AVERAGE_SWING + 2*AVERAGE_SWING*rank)))
+        #only the highest demand hours reach the peak plant
+        records.append((region, 'marginal', low + (high - low) * rank**2))
+    return np.array(records, dtype=RECORD)
+
+
+def compile_series(path=SERIES_PATH, series=None):
+    """
+    series - dict of (region, basis): (8760,) hourly kgCO2e/kWh, default the bundled series
+    """
+    if series is None:
+        records = build()
+    else:
+        records = np.array([(region, basis, values) for (region, basis), values in series.items()], dtype=RECORD)
+    np.save(path, records)
+
+
+@lru_cache(maxsize=None)
+def load(path=SERIES_PATH):
+    """
+    series record array, memory-mapped from the compiled file (built here if it is missing)
+    """
+    try:
+        return np.load(path, mmap_mode='r')
+    except FileNotFoundError:
+        return build()
+
+
+def series(region, basis):
+    """
+    (8760,) hourly intensity of a region's grid, None if there is no such series
+    """
+    if basis not in BASES:
+        raise ValueError(f'Unknown grid carbon basis {basis!r}, choose from: ' + ', '.join(BASES))
+    records = load()
+    match = np.nonzero((records['region'] == region) & (records['basis'] == basis))[0]
+    return records['kgCO2perkWh'][match[0]] if len(match) else None
+
+
+@lru_cache(maxsize=None)
+def _component_factors(region, basis):
+    """
+    intensity (kgCO2e/kWh) of the heating, hot water, cooking and other use shapes, None without a series
+    """
+    #imported here as hourly imports the engine, which imports this module
+    from hourly import REGION_CLIMATE
+
+    values = series(region, basis)
+    #the use shapes follow the region's climate
+    if values is None or region not in REGION_CLIMATE:
+        return None
+    factors = tariffs.component_shapes(region)[:len(tariffs.COMPONENTS)] @ values.astype(np.float64)
+    factors.flags.writeable = False
+    return factors
+
+
+def _groups(regions, bases):
+    """
+    ((region, basis), index array) of the households on each hourly series
+    """
+    bases = np.asarray(bases, dtype=str)
+    unknown = ~np.isin(bases, BASES)
+    if unknown.any():
+        raise ValueError(f'Unknown grid carbon basis {bases[unknown][0]!r}, choose from: ' + ', '.join(BASES))
+    groups = []
+    for basis in BASES[1:]:
+        is_basis = bases == basis
+        if not is_basis.any():
+            continue
+        for region in np.unique(load()['region']):
+            idx = np.nonzero(is_basis & (regions == region))[0]
+            if len(idx):
+                groups.append(((region, basis), idx))
+    return groups
+
+
+def component_intensity(regions, bases, annual):
+    """
+    regions, bases - grid_region and grid_carbon per household
+    annual - (n,) intensity used where there is no hourly series
+    returns (n, 4) intensity (kgCO2e/kWh) of electricity used for heating, hot water, cooking and other
+    """
+    annual = np.asarray(annual, dtype=np.float64)
+    intensity = np.repeat(annual[:, None], len(tariffs.COMPONENTS), axis=1)
+    for key, idx in _groups(np.asarray(regions, dtype=str), bases):
+        factors = _component_factors(*key)
+        if factors is not None:
+            intensity[idx] = factors
+    return intensity
+
+
+def hourly_emissions(load_kWh, region, basis='marginal', annual=None):
+    """
+    load_kWh - (8760,) or (n, 8760) hourly electricity use, e.g. hourly.simulate's hourly_elec_kWh
+    returns annual emissions (kgCO2e), from the annual intensity if the region has no series
+    """
+    values = series(region, basis) if basis != 'annual' else None
+    if values is None:
+        if annual is None:
+            annual = next(iter(REGIONS[region].values()))['elec_kgCO2perkWh']
+        return np.asarray(load_kWh, dtype=np.float64).sum(axis=-1) * annual
+    #float32 loads stay float32, rather than doubling a large batch in memory
+    load_kWh = np.asarray(load_kWh)
+    return load_kWh @ np.asarray(values, dtype=load_kWh.dtype)
+
+
+if __name__ == '__main__':
+    compile_series()
+    print(f'wrote {SERIES_PATH}')
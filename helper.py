@@ -1,50 +1,55 @@
 # HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
 
-import pandas as pd
+import copy
+from functools import lru_cache
+
 import numpy as np
 import altair as alt
 
+from instrument import traced
+
 
-def generate_df(data_list, data_list_new, value_names):
+@traced()
+def generate_df(table):
     """
-    data_list, data_list_new : old and new list of lists of data,
-            columns: old/new label, category, data values
-            data_list_new can be list of such list of lists of data
-    value_names: column names of data values    
+    table : results.ResultTable of the cases and breakdowns to chart
+    returns DataFrame with categorical Case and Breakdown columns and a column per value,
+            zero values blanked so they are left out of the charts
     """
-    cols = ["Case", "Breakdown"]
-    cols.extend(value_names)
-    
-    df1 = pd.DataFrame(data_list, columns=cols)
-    concat_list = [df1]
-    if type(data_list_new) is list:
-        for data in data_list_new:
-            concat_list.append(pd.DataFrame(data, columns=cols))
-    else:
-        concat_list.append(pd.DataFrame(data_list_new, columns=cols))
-
-    df = pd.concat(concat_list)
-    df.round(0)
-    df[df == 0] = np.NaN
-    
+    df = table.to_pandas()
+    for name in table.values:
+        values = table.column(name)
+        df[name] = np.where(values == 0, np.nan, values)
+
     return df
 
-    
-def make_stacked_bar_narrow(source, value_name, col_scheme=2):
+
+def _col_scheme_name(col_scheme):
+    if col_scheme == 1:
+        return 'paired'
+    return 'category10'
+
+
+def _with_data(template, source, value_name):
     """
-    source - dataframe
-    value_name - what to plot
-    col_scheme - 1 if costs, otherwise 2
+    shallow copy of a chart template with the data swapped in
     """
-    source = source.astype({value_name: 'float'})
+    if source[value_name].dtype != float:
+        source = source.astype({value_name: 'float'})
+    chart = template.copy(deep=False)
+    chart.data = source
+    return chart
 
-    if col_scheme == 1:
-        col_scheme = 'paired'
-    else:
-        col_scheme = 'category10'
+    
+@lru_cache(maxsize=None)
+def _stacked_bar_narrow_template(value_name, col_scheme):
+    """
+    chart without data, built once for each value name and colour scheme
+    """
+    col_scheme = _col_scheme_name(col_scheme)
 
     x_str = value_name #'Total Annual ' + 
-    bars = alt.Chart(source).mark_bar().encode(
+    bars = alt.Chart().mark_bar().encode(
     y=alt.Y('sum(' + value_name + '):Q', stack='zero', title=x_str),
     x=alt.X('Case:N'),
     color=alt.Color('Breakdown:N', legend=alt.Legend(
@@ -66,21 +71,26 @@ def make_stacked_bar_narrow(source, value_name, col_scheme=2):
     # chart = bars + text
     return bars
 
-def make_stacked_bar_horiz(source, value_name, col_scheme=2):
+
+@traced()
+def make_stacked_bar_narrow(source, value_name, col_scheme=2):
     """
     source - dataframe
     value_name - what to plot
     col_scheme - 1 if costs, otherwise 2
     """
-    source = source.astype({value_name: 'float'})
+    return _with_data(_stacked_bar_narrow_template(value_name, col_scheme), source, value_name)
 
-    if col_scheme == 1:
-        col_scheme = 'paired'
-    else:
-        col_scheme = 'category10'
+
+@lru_cache(maxsize=None)
+def _stacked_bar_horiz_template(value_name, col_scheme):
+    """
+    chart without data, built once for each value name and colour scheme
+    """
+    col_scheme = _col_scheme_name(col_scheme)
 
     x_str = value_name #'Total Annual ' + 
-    bars = alt.Chart(source).mark_bar().encode(
+    bars = alt.Chart().mark_bar().encode(
     x=alt.X('sum(' + value_name + '):Q', stack='zero', title=x_str),
     y=alt.Y('Case:N', sort=['Current', 'Typical HP Install', 'Hi-performance HP Install']),
     color=alt.Color('Breakdown:N', legend=alt.Legend(
@@ -100,4 +110,141 @@ def make_stacked_bar_horiz(source, value_name, col_scheme=2):
     #     text=alt.Text('sum(' + value_name + '):Q', format='d')
     # )
     # chart = bars + text
-    return bars
\ No newline at end of file
+    return bars
+
+
+@traced()
+def make_stacked_bar_horiz(source, value_name, col_scheme=2):
+    """
+    source - dataframe
+    value_name - what to plot
+    col_scheme - 1 if costs, otherwise 2
+    """
+    return _with_data(_stacked_bar_horiz_template(value_name, col_scheme), source, value_name)
+
+
+@lru_cache(maxsize=None)
+def _stacked_bar_horiz_spec(value_name, col_scheme):
+    spec = _stacked_bar_horiz_template(value_name, col_scheme).to_dict()
+    #drop the placeholder dataset altair adds for a chart without data
+    spec.pop('data', None)
+    spec.pop('datasets', None)
+    return spec
+
+
+@traced()
+def stacked_bar_horiz_spec(value_name, col_scheme=2):
+    """
+    Vega-Lite spec (without data) of make_stacked_bar_horiz, for st.vega_lite_chart.
+    The spec is validated and serialized once, so only the data changes between reruns.
+    value_name - what to plot
+    col_scheme - 1 if costs, otherwise 2
+    """
+    return copy.deepcopy(_stacked_bar_horiz_spec(value_name, col_scheme))
+
+
+@traced()
+def make_tornado(source, metric_label):
+    """
+    source - dataframe from sensitivity.one_at_a_time
+    metric_label - axis title for the metric
+    """
+    base = float(source['base'].iloc[0])
+    bars = source.melt(id_vars=['label'], value_vars=['metric_low', 'metric_high'],
+                       var_name='Input value', value_name=metric_label)
+    bars['Input value'] = bars['Input value'].map({'metric_low': 'Low', 'metric_high': 'High'})
+    bars['base'] = base
+
+    chart = alt.Chart(bars).mark_bar().encode(
+        x=alt.X(metric_label + ':Q', title=metric_label, scale=alt.Scale(zero=False)),
+        x2='base:Q',
+        y=alt.Y('label:N', sort=list(source['label']), title=None),
+        color=alt.Color('Input value:N', legend=alt.Legend(orient='top', direction='horizontal'),
+                        scale=alt.Scale(domain=['Low', 'High'], scheme='category10'))
+    ).properties(width='container', height=40*len(source)
+    ).configure_axis(titleFontSize=16, labelFontSize=14
+    ).configure_legend(titleFontSize=16, labelFontSize=14)
+    return chart
+
+
+@traced()
+def make_heatmap(source, x_name, y_name, value_name, x_title, y_title):
+    """
+    source - long-form dataframe from sensitivity.grid_frame
+    x_name, y_name - grid axis columns
+    value_name - metric column, used as colour
+    """
+    chart = alt.Chart(source).mark_rect().encode(
+        x=alt.X(x_name + ':O', title=x_title, axis=alt.Axis(format='.1f', labelOverlap=True)),
+        y=alt.Y(y_name + ':O', title=y_title, sort='descending', axis=alt.Axis(format='.1f', labelOverlap=True)),
+        color=alt.Color(value_name + ':Q', title=None, scale=alt.Scale(scheme='redblue', domainMid=0)),
+        tooltip=[alt.Tooltip(x_name + ':Q', format='.1f'), alt.Tooltip(y_name + ':Q', format='.1f'),
+                 alt.Tooltip(value_name + ':Q', format=',.0f')]
+    ).properties(width='container', height=400
+    ).configure_axis(titleFontSize=16, labelFontSize=14)
+    return chart
+
+
+@traced()
+def make_histogram(source, value_title):
+    """
+    source - dataframe of pre-binned counts from portfolio.histogram_frame
+    value_title - axis title for the binned metric
+    """
+    chart = alt.Chart(source).mark_bar(opacity=0.6).encode(
+        x=alt.X('bin_start:Q', bin='binned', title=value_title),
+        x2='bin_end:Q',
+        y=alt.Y('households:Q', stack=None, title='Households'),
+        color=alt.Color('Case:N', legend=alt.Legend(orient='top', direction='horizontal'),
+                        scale=alt.Scale(scheme='category10')),
+        tooltip=[alt.Tooltip('Case:N'), alt.Tooltip('bin_start:Q', format=',.0f'),
+                 alt.Tooltip('bin_end:Q', format=',.0f'), alt.Tooltip('households:Q', format=',.0f')]
+    ).properties(width='container', height=300
+    ).configure_axis(titleFontSize=16, labelFontSize=14
+    ).configure_legend(titleFontSize=16, labelFontSize=14)
+    return chart
+
+
+@traced()
+def make_quantile_bands(source, value_title):
+    """
+    source - dataframe from portfolio.quantile_frame
+    value_title - axis title for the metric
+    Lines span the 10th to 90th percentile, bars the 25th to 75th and ticks mark the median.
+    """
+    source = source.assign(row=source['group'].astype(str) + ', ' + source['Case'].astype(str))
+    base = alt.Chart(source).encode(
+        y=alt.Y('row:N', sort=list(source['row']), title=None),
+        color=alt.Color('Case:N', legend=alt.Legend(orient='top', direction='horizontal'),
+                        scale=alt.Scale(scheme='category10')))
+    lines = base.mark_rule().encode(x=alt.X('p10:Q', title=value_title), x2='p90:Q')
+    bars = base.mark_bar(size=14).encode(x='p25:Q', x2='p75:Q',
+                                          tooltip=[alt.Tooltip('row:N', title='Group'),
+                                                   alt.Tooltip('households:Q', format=',.0f'),
+                                                   alt.Tooltip('p10:Q', format=',.0f'), alt.Tooltip('p50:Q', format=',.0f'),
+                                                   alt.Tooltip('p90:Q', format=',.0f')])
+    ticks = base.mark_tick(color='black', thickness=2, size=14).encode(x='p50:Q')
+    chart = (lines + bars + ticks).properties(width='container', height=30*len(source) + 40
+    ).configure_axis(titleFontSize=16, labelFontSize=14
+    ).configure_legend(titleFontSize=16, labelFontSize=14)
+    return chart
+
+
+@traced()
+def make_group_bars(source, value_title, col_scheme=2):
+    """
+    source - dataframe from portfolio.totals_frame
+    value_title - axis title for the totals
+    col_scheme - 1 if costs, otherwise 2
+    """
+    chart = alt.Chart(source).mark_bar().encode(
+        x=alt.X('total:Q', stack='zero', title=value_title),
+        y=alt.Y('group:N', title=None),
+        color=alt.Color('Breakdown:N', legend=alt.Legend(orient='top', direction='horizontal'),
+                        scale=alt.Scale(scheme=_col_scheme_name(col_scheme))),
+        tooltip=[alt.Tooltip('group:N'), alt.Tooltip('Breakdown:N'), alt.Tooltip('total:Q', format=',.0f'),
+                 alt.Tooltip('households:Q', format=',.0f')]
+    ).properties(width='container', height=40*source['group'].nunique() + 40
+    ).configure_axis(titleFontSize=16, labelFontSize=14
+    ).configure_legend(titleFontSize=16, labelFontSize=14)
+    return chart
@@ -0,0 +1,188 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Hourly (8760 step) space heating simulation.  Annual heating demand is spread over the
+# year with a heating-degree-hour profile, the heat pump COP follows outdoor temperature,
+# and below the bivalent point the gas furnace takes over.
+#
+# The COP curve is scaled so that, without a bivalent changeover, the demand-weighted
+# seasonal COP equals the SCOP entered for the install - the hourly and annual models
+# then agree and the difference between them is the effect of the furnace changeover.
+#
+# Everything per hour that depends only on the weather is computed once per weather
+# series; household results are an outer product of per-household annual factors with
+# those rows, so a year for thousands of homes is a single broadcast multiply.
+#
+#   python hourly.py --households 10000 --region Ontario
+#   python hourly.py --households 10000 --weather toronto.npy
+
+import argparse
+import time
+
+import numpy as np
+
+from engine import prepare_inputs, split_demand
+
+
+HOURS = 8760
+
+#heating degree hours are counted below this outdoor temperature (degC)
+HDH_BASE_TEMP = 15.5
+#heat pump COP changes by about 3% per degC of outdoor temperature around 7 degC
+COP_SLOPE = 0.03
+COP_REF_TEMP = 7.0
+#COP never drops below this fraction of its 7 degC value
+COP_MIN_FRACTION = 0.3
+#below the bivalent point the gas furnace supplies all of the heat (degC)
+BIVALENT_TEMP = -10.0
+
+#annual mean and seasonal swing of outdoor temperature (degC) for synthetic weather
+REGION_CLIMATE = {'Ontario': (8.5, 13.5), 'BC': (10.5, 7.0), 'Alberta': (4.5, 12.0), 'Quebec': (6.5, 15.5),
+                  'UK': (10.0, 6.5)}
+
+
+def synthetic_weather(mean_temp, seasonal_amp, daily_amp=4.0, noise=2.5, seed=0):
+    """
+    A plausible year of hourly outdoor temperatures, coldest in mid January and at 5am.
+    Used when no weather file is available.
+    """
+    hours = np.arange(HOURS)
+    days = hours / 24
+    rng = np.random.default_rng(seed)
+    #weather systems: smoothed noise lasting a few days
+    weather = np.convolve(rng.normal(0, 1, HOURS + 71), np.ones(72)/72, mode='valid')
+    weather *= noise / weather.std()
+    temps = (mean_temp - seasonal_amp*np.cos(2*np.pi*(days - 20)/365)
+             - daily_amp*np.cos(2*np.pi*(hours % 24 - 5)/24) + weather)
+    return temps.astype(np.float32)
+
+
+def save_weather(path, temps):
+    """
+    temps - (8760,) or (n_series, 8760) hourly outdoor temperatures, saved as float32 .npy
+    """
+    np.save(path, np.atleast_2d(np.asarray(temps, dtype=np.float32)))
+
+
+def load_weather(path):
+    """
+    Memory-map a weather file: a .npy array, or raw float32 values for any other extension.
+    returns (n_series, 8760) array of hourly outdoor temperatures, read from disk on demand
+    """
+    if str(path).lower().endswith('.npy'):
+        temps = np.load(path, mmap_mode='r')
+    else:
+        temps = np.memmap(path, dtype=np.float32, mode='r')
+    return temps.reshape(-1, HOURS)
+
+
+def heating_profile(temps, base_temp=HDH_BASE_TEMP):
+    """
+    fraction of the annual heating demand in each hour, from heating degree hours
+    """
+    hdh = np.maximum(base_temp - np.asarray(temps, dtype=np.float64), 0)
+    total = hdh.sum(axis=-1, keepdims=True)
+    return np.where(total > 0, hdh / np.where(total > 0, total, 1), 1/HOURS)
+
+
+def cop_shape(temps, slope=COP_SLOPE, ref_temp=COP_REF_TEMP):
+    """
+    COP relative to its value at ref_temp
+    """
+    return np.maximum(1 + slope*(np.asarray(temps, dtype=np.float64) - ref_temp), COP_MIN_FRACTION)
+
+
+def series_factors(temps, bivalent_temp=BIVALENT_TEMP, base_temp=HDH_BASE_TEMP, slope=COP_SLOPE):
+    """
+    Hourly factors for each weather series (rows of temps):
+        profile - fraction of annual heat demand in the hour
+        cop - COP per unit of SCOP, i.e. multiply by the install SCOP
+        elec - heat pump electricity per kWh of annual heat per unit of 1/SCOP
+        gas - fraction of annual heat supplied by the furnace in the hour
+    """
+    temps = np.atleast_2d(temps)
+    profile = heating_profile(temps, base_temp)
+    shape = cop_shape(temps, slope)
+    #scale so the demand-weighted seasonal COP equals the SCOP
+    cop = shape * (profile/shape).sum(axis=-1, keepdims=True)
+    is_hp = temps >= bivalent_temp
+    return {'profile': profile, 'cop': cop,
+            'elec': np.where(is_hp, profile/cop, 0), 'gas': np.where(is_hp, 0, profile)}
+
+
+def simulate(annual_heat_kWh, hp_heat_scop, boiler_heat_eff, temps, series=0,
+             bivalent_temp=BIVALENT_TEMP, hourly=True):
+    """
+    annual_heat_kWh - useful space heat needed per household (1-d array)
+    hp_heat_scop - heat pump SCOP per household
+    boiler_heat_eff - furnace efficiency per household, used below the bivalent point
+    temps - (n_series, 8760) outdoor temperatures, e.g. from load_weather
+    series - weather series index per household
+    hourly - also return the (households x 8760) float32 electricity and gas profiles
+    returns dict of annual elec_kWh and gas_kWh totals, the furnace share of the heat and
+    the effective seasonal COP, plus hourly_elec_kWh and hourly_gas_kWh when hourly is set
+    """
+    annual_heat_kWh, hp_heat_scop, boiler_heat_eff, series = np.broadcast_arrays(
+        np.atleast_1d(np.asarray(annual_heat_kWh, dtype=np.float64)), hp_heat_scop, boiler_heat_eff, series)
+    factors = series_factors(temps, bivalent_temp)
+
+    elec_scale = annual_heat_kWh / hp_heat_scop
+    gas_scale = annual_heat_kWh / boiler_heat_eff
+    backup_fraction = factors['gas'].sum(axis=-1)[series]
+    results = {'elec_kWh': elec_scale * factors['elec'].sum(axis=-1)[series],
+               'gas_kWh': gas_scale * backup_fraction,
+               'backup_fraction': backup_fraction}
+    hp_heat = annual_heat_kWh * (1 - backup_fraction)
+    results['seasonal_cop'] = np.divide(hp_heat, results['elec_kWh'],
+                                        out=np.zeros_like(hp_heat), where=results['elec_kWh'] > 0)
+
+    if hourly:
+        results['hourly_elec_kWh'] = elec_scale.astype(np.float32)[:, None] * factors['elec'].astype(np.float32)[series]
+        results['hourly_gas_kWh'] = gas_scale.astype(np.float32)[:, None] * factors['gas'].astype(np.float32)[series]
+    return results
+
+
+def hourly_heat_pump_case(install_type, inp, split, temps, series=0, bivalent_temp=BIVALENT_TEMP, hourly=True):
+    """
+    Hourly version of the space heating part of engine.do_heat_pump_case.
+    install type either 'Typical' or 'Hi-performance'
+    inp, split - dicts from engine.prepare_inputs and engine.split_demand
+    Secondary heat sources are not simulated; only the gas central heating moves to the heat pump.
+    """
+    if install_type == 'Hi-performance':
+        hp_heat_scop = inp['hp_heat_scop_hi']
+    else:
+        hp_heat_scop = inp['hp_heat_scop_typ']
+    annual_heat_kWh = (1 - inp['efficiency_boost']) * split['gas_heat_kWh'] * inp['boiler_heat_eff']
+    return simulate(annual_heat_kWh, hp_heat_scop, inp['boiler_heat_eff'], temps, series, bivalent_temp, hourly)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the hourly heating simulation for synthetic households.')
+    parser.add_argument('--households', type=int, default=10000)
+    parser.add_argument('--weather', help='.npy or raw float32 file of hourly outdoor temperatures')
+    parser.add_argument('--region', choices=sorted(REGION_CLIMATE), default='Ontario',
+                        help='synthetic weather to use when no weather file is given')
+    parser.add_argument('--bivalent', type=float, default=BIVALENT_TEMP, help='bivalent temperature (degC)')
+    args = parser.parse_args(argv)
+
+    temps = load_weather(args.weather) if args.weather else synthetic_weather(*REGION_CLIMATE[args.region])[None]
+    rng = np.random.default_rng(0)
+    n = args.households
+    inp = prepare_inputs(gas_total_kWh=rng.uniform(8000, 25000, n), hw_lday=rng.uniform(50, 500, n))
+
+    start = time.perf_counter()
+    res = hourly_heat_pump_case('Typical', inp, split_demand(inp), temps,
+                                series=rng.integers(0, len(temps), n), bivalent_temp=args.bivalent)
+    elapsed = time.perf_counter() - start
+    print(f'{n:,} households x {HOURS} hours in {elapsed:.2f} s')
+    print(f'mean heat pump electricity {res["elec_kWh"].mean():,.0f} kWh, '
+          f'furnace gas {res["gas_kWh"].mean():,.0f} kWh, '
+          f'furnace share of heat {res["backup_fraction"].mean():.1%}, '
+          f'effective SCOP {res["seasonal_cop"].mean():.2f}')
+    if not args.weather:
+        from grid_carbon import BASES, hourly_emissions
+        print('mean heat pump emissions ' + ', '.join(
+            f'{basis} {hourly_emissions(res["hourly_elec_kWh"], args.region, basis).mean():,.0f} kg' for basis in BASES))
+
+
+if __name__ == '__main__':
+    main()
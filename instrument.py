@@ -0,0 +1,232 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Timing spans, optional cProfile capture and a Prometheus metrics endpoint.
+#
+# Tracing is off unless HP_TRACE is set in the environment (or ?trace=1 is added to the
+# page url for a single run); when off, spans and traced functions only check a flag.
+# When on, each span's duration is added to a per-stage histogram, served in Prometheus
+# text format on http://127.0.0.1:HP_METRICS_PORT/metrics (default 9464).
+#
+# cProfile runs for every page run with HP_PROFILE set, or one run with ?profile=1.  The
+# stats are saved to HP_PROFILE_DIR (default the temp directory) for snakeviz/pstats, and
+# a summary is shown at the foot of the page.
+
+import functools
+import os
+import tempfile
+import threading
+import time
+
+TRACE_ENABLED = bool(os.environ.get('HP_TRACE'))
+PROFILE_ENABLED = bool(os.environ.get('HP_PROFILE'))
+PROFILE_DIR = os.environ.get('HP_PROFILE_DIR', tempfile.gettempdir())
+METRICS_PORT = int(os.environ.get('HP_METRICS_PORT', 9464))
+
+#histogram bucket upper bounds (s)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+#per thread: tracing forced on for the current page run by the query parameter
+_local = threading.local()
+
+
+def tracing():
+    return TRACE_ENABLED or getattr(_local, 'forced', False)
+
+
+class Registry:
+    """
+    Thread-safe per-stage duration histograms, plus gauge sources read at export time.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._gauges = {}
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                entry = self._stages[stage] = [[0] * len(BUCKETS), 0, 0.0]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += 1
+            entry[2] += seconds
+
+    def register_gauges(self, prefix, func):
+        """
+        func() returns a dict of name -> number, exported as prefix_name
+        """
+        self._gauges[prefix] = func
+
+    def snapshot(self):
+        """
+        dict of stage -> (count, total seconds)
+        """
+        with self._lock:
+            return {stage: (entry[1], entry[2]) for stage, entry in self._stages.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+    def prometheus(self):
+        """
+        metrics in Prometheus text exposition format
+        """
+        lines = ['# HELP hp_stage_seconds Time spent in each stage of the app and engine.',
+                 '# TYPE hp_stage_seconds histogram']
+        with self._lock:
+            stages = {stage: (list(e[0]), e[1], e[2]) for stage, e in self._stages.items()}
+        for stage, (counts, count, total) in sorted(stages.items()):
+            cumulative = 0
+            for bound, n in zip(BUCKETS, counts):
+                cumulative += n
+                lines.append(f'hp_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'hp_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'hp_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'hp_stage_seconds_count{{stage="{stage}"}} {count}')
+        for prefix, func in sorted(self._gauges.items()):
+            for name, value in func().items():
+                if isinstance(value, (int, float)):
+                    lines.append(f'# TYPE {prefix}_{name} gauge')
+                    lines.append(f'{prefix}_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        registry.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name):
+    """
+    with span('stage'): ... - time the block when tracing is on
+    """
+    return _Span(name) if tracing() else _NO_SPAN
+
+
+def traced(name=None):
+    """
+    decorator timing every call of a function when tracing is on
+    """
+    def wrap(func):
+        stage = name or func.__name__
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            if not tracing():
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.observe(stage, time.perf_counter() - start)
+        return inner
+    return wrap
+
+
+class PageTrace:
+    """
+    Times consecutive stages of one script run: lap(name) records the time since the
+    previous lap, so stages can be marked without re-indenting the script.  Also runs
+    cProfile over the script when profiling is requested.
+    """
+    def __init__(self, trace=False, profile=False):
+        self.enabled = TRACE_ENABLED or trace
+        _local.forced = trace
+        self.profiler = None
+        self.profile_path = None
+        self.profile_summary = None
+        if profile or PROFILE_ENABLED:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.start = self.last = time.perf_counter()
+
+    def lap(self, name):
+        if self.enabled:
+            now = time.perf_counter()
+            registry.observe('page_' + name, now - self.last)
+            self.last = now
+
+    def finish(self, top=25):
+        """
+        record the whole run and stop profiling, returning the profile summary text if any
+        """
+        if self.enabled:
+            registry.observe('page_total', time.perf_counter() - self.start)
+        _local.forced = False
+        if self.profiler is not None:
+            import io
+            import pstats
+            self.profiler.disable()
+            self.profile_path = os.path.join(PROFILE_DIR, f'hp_profile_{time.strftime("%Y%m%d-%H%M%S")}_{os.getpid()}.prof')
+            self.profiler.dump_stats(self.profile_path)
+            out = io.StringIO()
+            pstats.Stats(self.profiler, stream=out).sort_stats('cumulative').print_stats(top)
+            self.profile_summary = out.getvalue()
+            self.profiler = None
+        return self.profile_summary
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=METRICS_PORT, host='127.0.0.1'):
+    """
+    serve /metrics from a background thread, once per process; returns the server or None
+    if the port is taken (e.g. by another app process)
+    """
+    global _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), MetricsHandler)
+            except OSError:
+                return None
+            threading.Thread(target=_server.serve_forever, daemon=True, name='hp-metrics').start()
+        return _server
@@ -0,0 +1,223 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Lifecycle projection of a heat pump install: net present value, internal rate of return
+# and payback year over a number of years, under several price and performance scenarios.
+#
+# Each household's first-year saving is split into its gas part, its electricity part and
+# the extra electricity the heat pump uses, which grows as the heat pump degrades.  Every
+# year's saving in every scenario is then one matrix product of those three parts with
+# the scenarios' escalation curves, giving a (households, years, scenarios) array of cash
+# flows.  Replacement events (the heat pump at the end of its life, and the boiler
+# replacement avoided by households that disconnect from gas) are added to it.
+# Households are projected in chunks so only one chunk's cash flows are held at a time.
+#
+#   python lifecycle.py households.csv lifecycle.csv --install-type Typical --years 20
+
+import argparse
+import time
+
+import numpy as np
+
+from engine import CASES, INSTALL_TYPES, calculate
+from retrofit import HP_INSTALL_COST
+
+
+YEARS = 20
+DEFAULT_CHUNKSIZE = 100000
+
+#annual real-terms escalation of gas and electricity prices, discount rate and the yearly
+#increase in the heat pump's electricity use as its performance degrades
+SCENARIOS = {
+    'central': {'gas_escalation': 0.02, 'elec_escalation': 0.01, 'discount_rate': 0.035, 'degradation': 0.005},
+    'high_gas': {'gas_escalation': 0.05, 'elec_escalation': 0.02, 'discount_rate': 0.035, 'degradation': 0.005},
+    'low_gas': {'gas_escalation': 0.0, 'elec_escalation': 0.02, 'discount_rate': 0.035, 'degradation': 0.005},
+    'high_discount': {'gas_escalation': 0.02, 'elec_escalation': 0.01, 'discount_rate': 0.07, 'degradation': 0.005},
+    'fast_degradation': {'gas_escalation': 0.02, 'elec_escalation': 0.01, 'discount_rate': 0.035, 'degradation': 0.015},
+}
+
+#replacement events: heat pump life (years) and replacement cost as a share of the install
+#(emitters and pipework are kept); boiler cost (£) and life, for households disconnecting from gas
+HP_LIFETIME = 15
+HP_REPLACEMENT_FRACTION = 0.6
+BOILER_COST = 3000
+BOILER_LIFETIME = 15
+#year the existing boiler would need replacing, unless given per household
+BOILER_REPLACEMENT_YEAR = 8
+
+#IRR is found by bisection between these rates, to within 2**-IRR_ITERATIONS of their range
+IRR_BOUNDS = (-0.99, 1.0)
+IRR_ITERATIONS = 34
+
+
+def scenario_curves(scenarios=SCENARIOS, years=YEARS):
+    """
+    (3, years, n_scenarios) multipliers of the gas saving, electricity saving and the heat pump's
+    extra electricity use in each year, and the (years, n_scenarios) discount factors
+    """
+    t = np.arange(years)[:, None]
+    spec = {key: np.array([s[key] for s in scenarios.values()], dtype=float)
+            for key in ('gas_escalation', 'elec_escalation', 'discount_rate', 'degradation')}
+    gas = (1 + spec['gas_escalation'])**t
+    elec = (1 + spec['elec_escalation'])**t
+    #degradation adds to the heat pump's use from the second year on
+    degraded = elec * ((1 + spec['degradation'])**t - 1)
+    discount = (1 + spec['discount_rate'])**-(t + 1.0)
+    return np.stack([gas, elec, degraded]), discount
+
+
+def annual_parts(results, install_type='Typical'):
+    """
+    (n, 3) first-year saving in gas costs, saving in electricity costs and minus the
+    electricity cost the heat pump adds, from calculate() results
+    """
+    current = results[CASES[0]]['costs']
+    hp = results[CASES[1 + INSTALL_TYPES.index(install_type)]]['costs']
+    #columns of costs: gas standing, gas unit, elec standing, elec unit
+    gas = current[:, :2].sum(axis=1) - hp[:, :2].sum(axis=1)
+    elec = current[:, 2:].sum(axis=1) - hp[:, 2:].sum(axis=1)
+    hp_extra = np.maximum(hp[:, 3] - current[:, 3], 0)
+    return np.stack([gas, elec, -hp_extra], axis=1)
+
+
+def event_flows(years, install_cost, disconnect_gas, boiler_year):
+    """
+    (n, years) cash flows of replacement events: heat pump replacements (negative) and
+    avoided boiler replacements (positive)
+    """
+    t = np.arange(1, years + 1)
+    flows = np.where(t % HP_LIFETIME == 0, -HP_REPLACEMENT_FRACTION, 0.0) * install_cost[:, None]
+    due = t >= boiler_year[:, None]
+    boiler = due & ((t - boiler_year[:, None]) % BOILER_LIFETIME == 0)
+    flows += np.where(boiler & disconnect_gas[:, None], BOILER_COST, 0.0)
+    return flows
+
+
+def cash_flows(parts, events, curves):
+    """
+    parts - (n, 3) from annual_parts, events - (n, years) from event_flows, curves - from scenario_curves
+    returns (n, years, n_scenarios) cash flow of each year after the install
+    """
+    n_parts, years, n_scenarios = curves.shape
+    flows = (parts @ curves.reshape(n_parts, -1)).reshape(len(parts), years, n_scenarios)
+    flows += events[:, :, None]
+    return flows
+
+
+def npv(flows, install_cost, discount):
+    return np.einsum('nys,ys->ns', flows, discount) - install_cost[:, None]
+
+
+def payback_year(flows, install_cost):
+    """
+    (n, n_scenarios) first year the undiscounted cumulative cash flow covers the install, nan if none
+    """
+    paid = np.cumsum(flows, axis=1) >= install_cost[:, None, None]
+    year = np.argmax(paid, axis=1) + 1.0
+    year[~paid.any(axis=1)] = np.nan
+    return year
+
+
+def irr(flows, install_cost, bounds=IRR_BOUNDS, iterations=IRR_ITERATIONS):
+    """
+    (n, n_scenarios) rate at which the NPV is zero, by bisection; nan where the NPV does not
+    change sign between bounds
+    """
+    #years first, so each step of Horner's rule reads one contiguous (n, n_scenarios) block
+    by_year = np.ascontiguousarray(flows.transpose(1, 0, 2))
+    cost = install_cost[:, None]
+
+    def value(rate):
+        #Horner's rule in 1/(1 + rate), from the last year back
+        x = 1 / (1 + rate)
+        total = np.zeros(rate.shape)
+        for year in by_year[::-1]:
+            total += year
+            total *= x
+        return total - cost
+
+    shape = flows.shape[::2]
+    low, high = np.full(shape, bounds[0]), np.full(shape, bounds[1])
+    value_low = value(low)
+    found = np.sign(value_low) != np.sign(value(high))
+    for _ in range(iterations):
+        mid = (low + high) / 2
+        value_mid = value(mid)
+        same = np.sign(value_mid) == np.sign(value_low)
+        low = np.where(same, mid, low)
+        value_low = np.where(same, value_mid, value_low)
+        high = np.where(same, high, mid)
+    return np.where(found, (low + high) / 2, np.nan)
+
+
+def project(inputs, install_type='Typical', install_cost=None, boiler_year=BOILER_REPLACEMENT_YEAR,
+            years=YEARS, scenarios=SCENARIOS, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    inputs - engine inputs, each a scalar or 1-d array
+    install_cost - install cost (£) per household, default HP_INSTALL_COST of the install type
+    boiler_year - year the existing boiler would need replacing, per household
+    returns dict of npv (£), irr and payback_year, each (n, n_scenarios) in SCENARIOS order
+    """
+    if install_cost is None:
+        install_cost = HP_INSTALL_COST[install_type]
+    curves, discount = scenario_curves(scenarios, years)
+    sizes = [np.size(v) for v in inputs.values() if np.ndim(v)]
+    n = max(sizes, default=1)
+
+    out = {key: np.empty((n, len(scenarios))) for key in ('npv', 'irr', 'payback_year')}
+    for start in range(0, n, chunksize):
+        stop = min(start + chunksize, n)
+        chunk = {k: (v[start:stop] if np.ndim(v) else v) for k, v in inputs.items()}
+        size = stop - start
+        cost = np.broadcast_to(np.asarray(install_cost, dtype=float), n)[start:stop]
+        disconnect = np.broadcast_to(chunk.get('is_disconnect_gas', False), size)
+        boiler = np.broadcast_to(np.asarray(boiler_year, dtype=float), n)[start:stop]
+
+        parts = annual_parts(calculate(**chunk), install_type)
+        parts = np.broadcast_to(parts, (size, parts.shape[1]))
+        flows = cash_flows(parts, event_flows(years, cost, disconnect, boiler), curves)
+        out['npv'][start:stop] = npv(flows, cost, discount)
+        out['irr'][start:stop] = irr(flows, cost)
+        out['payback_year'][start:stop] = payback_year(flows, cost)
+    return out
+
+
+def to_columns(projection, scenarios=SCENARIOS):
+    """
+    flat columns such as npv_central or payback_year_high_gas
+    """
+    return {f'{key}_{name}': values[:, j] for key, values in projection.items()
+            for j, name in enumerate(scenarios)}
+
+
+def main(argv=None):
+    from batch import ChunkWriter, input_columns, input_names, read_chunks
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description='Project heat pump NPV, IRR and payback for a file of households.')
+    parser.add_argument('input', help='CSV or Parquet file of households, columns named as engine inputs')
+    parser.add_argument('output', help='CSV or Parquet file for the projections')
+    parser.add_argument('--install-type', choices=INSTALL_TYPES, default='Typical')
+    parser.add_argument('--years', type=int, default=YEARS)
+    parser.add_argument('--keep', nargs='*', default=[], help='input columns copied to the output, e.g. an id column')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    args = parser.parse_args(argv)
+
+    #install_cost and boiler_year columns are used when present
+    extra = {'install_cost', 'boiler_year'}
+    rows = 0
+    start = time.perf_counter()
+    with ChunkWriter(args.output) as writer:
+        for df in read_chunks(args.input, args.chunksize, input_names(args.keep) | extra):
+            kwargs = {name: df[name].to_numpy(dtype=float) for name in extra if name in df.columns}
+            projection = project(input_columns(df), args.install_type, years=args.years,
+                                 chunksize=args.chunksize, **kwargs)
+            out = pd.DataFrame(to_columns(projection), index=df.index)
+            if args.keep:
+                out = pd.concat([df[list(args.keep)], out], axis=1)
+            writer.write(out)
+            rows += len(df)
+    elapsed = time.perf_counter() - start
+    print(f'{rows:,} households in {elapsed:.2f} s ({rows/max(elapsed, 1e-9):,.0f} households/s)')
+
+
+if __name__ == '__main__':
+    main()
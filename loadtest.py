@@ -0,0 +1,419 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Load test of the Streamlit app: many users at once against one server process.
+# Each simulated user is a websocket session speaking Streamlit's own protocol, as a browser
+# tab does.  It opens the page, changes inputs on both tabs (province, consumption, hot water,
+# cooking, secondary heat source, efficiency measures, prices and the off-peak tariff) with a
+# pause between changes, and presses Update results.  Every change reruns the whole script on
+# the server; a rerun's latency is the time from sending it to the server's script finished
+# message.
+#
+# For each number of concurrent sessions the report has rerun latency percentiles (input
+# changes and Update results separately), reruns per second, errors, and the server's CPU
+# use and memory (read from /proc, so Linux only).  Each report is appended to a JSON-lines
+# history and compared with the previous report from the same machine; the run fails (exit
+# code 1) if a session count got slower than benchmarks.TIME_THRESHOLD allows.
+#
+#   python loadtest.py --sessions 1 4 16 32 --duration 30
+#   python loadtest.py --url ws://localhost:8501 --pid 1234 --sessions 8 --no-save
+#
+# Without --url a fresh server is started for each session count, so every count starts
+# with an empty results cache.
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime, timezone
+
+import numpy as np
+
+from benchmarks import HERE, TIME_THRESHOLD, _git_commit, load_history
+
+DEFAULT_HISTORY = os.path.join(HERE, 'loadtest_history.jsonl')
+DEFAULT_PORT = 8599
+DEFAULT_SESSIONS = (1, 2, 4, 8, 16)
+#a session count is within capacity while the 95th percentile of its reruns is below this (s)
+DEFAULT_SLO = 1.0
+#mean pause between a user's actions (s), drawn from an exponential distribution
+DEFAULT_THINK = 1.0
+#a slower 95th percentile is only a regression if it is also this much slower (s)
+LATENCY_SLACK = 0.05
+QUANTILES = (50, 90, 95, 99)
+#seconds between samples of the server's memory
+SAMPLE_INTERVAL = 0.5
+
+SUBMIT = 'Update results'
+#widget types a session can set, and the WidgetState field each one's value is sent in
+WIDGET_TYPES = ('checkbox', 'number_input', 'radio', 'selectbox', 'slider', 'button')
+
+
+class Session:
+    """
+    One browser tab's websocket session with the app.
+    Widgets are found by the start of their label, as the app has no keys on most of them.
+    """
+    def __init__(self, ws):
+        self.ws = ws
+        self.widgets = {}
+        self.states = {}
+        self.page_script_hash = ''
+
+    @classmethod
+    async def open(cls, url):
+        try:
+            from websockets.asyncio.client import connect
+        except ImportError:
+            raise ImportError('websockets is required for the load test: pip install websockets')
+        ws = await connect(url.rstrip('/') + '/_stcore/stream', subprotocols=['streamlit'], max_size=None)
+        return cls(ws)
+
+    async def close(self):
+        await self.ws.close()
+
+    def widget(self, label):
+        """
+        (type, proto) of the first widget on the page whose label starts with label, None if not shown
+        """
+        return next(((kind, proto) for text, (kind, proto) in self.widgets.items() if text.startswith(label)), None)
+
+    def set(self, label, value):
+        """
+        give a widget a new value, sent with the next rerun - False if the widget is not shown
+        """
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        found = self.widget(label)
+        if found is None:
+            return False
+        kind, proto = found
+        state = WidgetState(id=proto.id)
+        if kind == 'checkbox':
+            state.bool_value = bool(value)
+        elif kind == 'number_input':
+            state.double_value = value
+        elif kind in ('radio', 'selectbox'):
+            state.string_value = value
+        elif kind == 'slider':
+            state.double_array_value.data[:] = [value]
+        self.states[proto.id] = state
+        return True
+
+    async def rerun(self, trigger=None):
+        """
+        run the script with the widget values set so far, plus a button press if trigger is a label
+        returns (seconds until the run finished, True if the page showed an exception)
+        """
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        msg = BackMsg()
+        msg.rerun_script.query_string = ''
+        msg.rerun_script.page_script_hash = self.page_script_hash
+        msg.rerun_script.widget_states.widgets.extend(self.states.values())
+        if trigger is not None:
+            msg.rerun_script.widget_states.widgets.append(WidgetState(id=self.widget(trigger)[1].id, trigger_value=True))
+
+        start = time.perf_counter()
+        await self.ws.send(msg.SerializeToString())
+        widgets, is_exception = {}, False
+        while True:
+            fwd = ForwardMsg()
+            fwd.ParseFromString(await self.ws.recv())
+            kind = fwd.WhichOneof('type')
+            if kind == 'new_session':
+                self.page_script_hash = fwd.new_session.page_script_hash
+            elif kind == 'delta' and fwd.delta.WhichOneof('type') == 'new_element':
+                element = fwd.delta.new_element
+                element_type = element.WhichOneof('type')
+                if element_type == 'exception':
+                    is_exception = True
+                elif element_type in WIDGET_TYPES:
+                    proto = getattr(element, element_type)
+                    widgets.setdefault(proto.label, (element_type, proto))
+            elif kind == 'script_finished' and fwd.script_finished != fwd.FINISHED_EARLY_FOR_RERUN:
+                break
+        #widgets hidden by this run are no longer sent, as the browser would drop them
+        self.widgets = widgets
+        ids = {proto.id for kind, proto in widgets.values()}
+        self.states = {k: v for k, v in self.states.items() if k in ids}
+        return time.perf_counter() - start, is_exception
+
+
+def _options(session, label):
+    found = session.widget(label)
+    return list(found[1].options) if found is not None else []
+
+
+def _default(session, label):
+    found = session.widget(label)
+    return found[1].default if found is not None else None
+
+
+def user_actions(session, rng):
+    """
+    One visit to the page: a generator of (label, value) input changes and SUBMIT presses.
+    It reads the session's widgets as it goes, so options only shown after an earlier
+    change can be used.
+    """
+    #basic settings
+    yield 'Province:', str(rng.choice(_options(session, 'Province:')))
+    yield 'Annual electricity consumption', float(np.clip(round(rng.lognormal(np.log(3000), 0.4), -2), 500, 20000))
+    gas_typical = _default(session, 'Annual gas consumption')
+    yield 'Annual gas consumption', float(round(gas_typical * rng.uniform(0.5, 1.8)))
+    if rng.random() < 0.2:
+        yield 'Hot water heat source:', _options(session, 'Hot water heat source:')[1]
+    yield 'The UK average is 140 litres', float(rng.choice([140, 210, 280, 350, 420, 560]))
+    if rng.random() < 0.3:
+        yield 'I cook with mains gas', True
+        yield 'A typical household uses', float(rng.integers(5, 13))
+    if rng.random() < 0.3:
+        yield 'I have a secondary heating source', True
+        yield 'My secondary heat source is:', str(rng.choice(_options(session, 'My secondary heat source is:')[:2]))
+        yield 'In the heat pump scenario, I would', str(rng.choice(_options(session, 'In the heat pump scenario, I would')))
+    measures = [label for label in session.widgets if label.endswith('%)')]
+    for label in rng.choice(measures, rng.integers(0, 3), replace=False):
+        yield str(label), True
+    yield SUBMIT, None
+
+    #advanced settings
+    prices = _options(session, 'Prices to use:')
+    choice = rng.random()
+    if choice < 0.3:
+        yield 'Prices to use:', prices[1]
+        yield 'Electricity unit cost', float(round(rng.uniform(20, 40), 2))
+        yield 'Add off-peak electricity tariff', True
+        yield 'Off-peak electricity unit cost', float(round(rng.uniform(8, 20), 2))
+        yield 'Number of hours of off-peak tariff', int(rng.integers(5, 10))
+        yield 'Percentage of electricity consumption', int(rng.integers(20, 60))
+    elif choice < 0.5:
+        yield 'Prices to use:', prices[2]
+        yield 'Electricity tariff:', str(rng.choice(_options(session, 'Electricity tariff:')))
+    elif choice < 0.7:
+        yield 'Prices to use:', prices[3]
+    if rng.random() < 0.1:
+        yield 'Show ranges of likely savings', True
+    if rng.random() < 0.1:
+        yield 'Show sensitivity of the cost saving', True
+    yield SUBMIT, None
+
+    #what if: a few more edits, each followed by Update results
+    for _ in range(rng.integers(1, 4)):
+        yield 'Annual electricity consumption', float(np.clip(round(rng.lognormal(np.log(3000), 0.4), -2), 500, 20000))
+        yield SUBMIT, None
+
+
+async def run_user(url, seed, stop_at, think, records):
+    """
+    repeat visits to the page until stop_at (perf_counter time), appending (kind, seconds,
+    is_error) for every rerun to records
+    """
+    rng = np.random.default_rng(seed)
+    await asyncio.sleep(rng.uniform(0, think))
+    while time.perf_counter() < stop_at:
+        session = None
+        try:
+            session = await Session.open(url)
+            seconds, is_error = await session.rerun()
+            records.append(('open', seconds, is_error))
+            for label, value in user_actions(session, rng):
+                await asyncio.sleep(rng.exponential(think))
+                if time.perf_counter() >= stop_at:
+                    return
+                if label == SUBMIT:
+                    seconds, is_error = await session.rerun(trigger=SUBMIT)
+                    records.append(('submit', seconds, is_error))
+                elif session.set(label, value):
+                    seconds, is_error = await session.rerun()
+                    records.append(('change', seconds, is_error))
+        except Exception:
+            #a refused or dropped connection counts as an error, then the user comes back
+            records.append(('error', 0.0, True))
+            await asyncio.sleep(think)
+        finally:
+            if session is not None:
+                await session.close()
+
+
+def process_usage(pid):
+    """
+    (cpu seconds, resident MB) of a process so far, None on systems without /proc
+    """
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/statm') as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return None
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    return cpu, pages * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+
+async def _sample_memory(pid, peaks, stop_at):
+    while time.perf_counter() < stop_at:
+        usage = process_usage(pid)
+        if usage is not None:
+            peaks.append(usage[1])
+        await asyncio.sleep(SAMPLE_INTERVAL)
+
+
+def summarize(records, seconds):
+    """
+    latency percentiles (s) of each kind of rerun and of all reruns after the page opens
+    """
+    summary = {'reruns': len(records), 'reruns_per_s': round(len(records) / seconds, 2),
+               'errors': sum(is_error for kind, value, is_error in records)}
+    for kind in ('open', 'change', 'submit', 'all'):
+        values = [value for k, value, is_error in records
+                  if not is_error and (k == kind or (kind == 'all' and k != 'open'))]
+        if values:
+            summary[kind] = {f'p{q}_s': round(float(np.percentile(values, q)), 4) for q in QUANTILES}
+            summary[kind]['max_s'] = round(max(values), 4)
+            summary[kind]['count'] = len(values)
+    return summary
+
+
+async def run_level(url, n_sessions, duration, think, seed, pid=None):
+    """
+    n_sessions users for duration seconds: returns the summary of their reruns with the
+    server's CPU use (% of one core) and peak memory
+    """
+    records, peaks = [], []
+    start = time.perf_counter()
+    stop_at = start + duration
+    usage = process_usage(pid) if pid else None
+    tasks = [run_user(url, seed + i, stop_at, think, records) for i in range(n_sessions)]
+    if usage is not None:
+        tasks.append(_sample_memory(pid, peaks, stop_at))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    summary = summarize(records, elapsed)
+    end_usage = process_usage(pid) if usage is not None else None
+    if end_usage is not None:
+        summary['cpu_percent'] = round(100 * (end_usage[0] - usage[0]) / elapsed, 1)
+        summary['rss_mb'] = round(end_usage[1], 1)
+        summary['peak_rss_mb'] = round(max(peaks + [end_usage[1]]), 1)
+    return summary
+
+
+def start_server(port, env=None, timeout=60):
+    """
+    streamlit run streamlit_app.py on port: returns the server process once it answers health checks
+    """
+    command = [sys.executable, '-m', 'streamlit', 'run', os.path.join(HERE, 'streamlit_app.py'),
+               '--server.headless', 'true', '--server.port', str(port), '--server.fileWatcherType', 'none',
+               '--browser.gatherUsageStats', 'false']
+    server = subprocess.Popen(command, cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'streamlit exited with code {server.returncode}')
+        try:
+            with urllib.request.urlopen(f'http://localhost:{port}/_stcore/health', timeout=1) as response:
+                if response.status == 200:
+                    return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f'streamlit did not start on port {port} within {timeout} s')
+
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(10)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+def capacity(levels, slo=DEFAULT_SLO):
+    """
+    largest session count whose reruns all had a 95th percentile below slo, without errors
+    """
+    ok = [int(n) for n, level in levels.items()
+          if 'all' in level and level['all']['p95_s'] <= slo and not level['errors']]
+    return max(ok) if ok else 0
+
+
+def regressions(levels, previous, threshold=TIME_THRESHOLD):
+    """
+    list of messages for session counts with a slower 95th percentile than the previous report
+    """
+    found = []
+    for n, level in levels.items():
+        before = previous.get(n, {}).get('all')
+        if before is None or 'all' not in level:
+            continue
+        if level['all']['p95_s'] > before['p95_s'] * threshold + LATENCY_SLACK:
+            found.append(f"{n} sessions: p95 {level['all']['p95_s']*1000:.0f} ms vs {before['p95_s']*1000:.0f} ms")
+    return found
+
+
+def _print_level(n, level, before=None):
+    line = f"{n:>4} sessions  {level['reruns_per_s']:7.2f} reruns/s  errors {level['errors']:3d}"
+    for kind in ('change', 'submit', 'all'):
+        if kind in level:
+            line += f"  {kind} p50 {level[kind]['p50_s']*1000:6.0f} p95 {level[kind]['p95_s']*1000:6.0f} ms"
+    if 'cpu_percent' in level:
+        line += f"  cpu {level['cpu_percent']:5.0f}%  peak {level['peak_rss_mb']:6.0f} MB"
+    if before is not None and 'all' in before and 'all' in level:
+        line += f"  (p95 was {before['all']['p95_s']*1000:.0f} ms)"
+    print(line, flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the Streamlit app with concurrent simulated users.')
+    parser.add_argument('--sessions', type=int, nargs='+', default=list(DEFAULT_SESSIONS),
+                        help='numbers of concurrent sessions to run, one after another')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run each session count')
+    parser.add_argument('--think', type=float, default=DEFAULT_THINK, help='mean pause between actions (s)')
+    parser.add_argument('--slo', type=float, default=DEFAULT_SLO, help='95th percentile rerun time within capacity (s)')
+    parser.add_argument('--url', help='server to test, e.g. ws://localhost:8501 (default: start one per session count)')
+    parser.add_argument('--pid', type=int, help='process id of the --url server, for CPU and memory')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port for the servers started here')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--history', default=DEFAULT_HISTORY, help='JSON-lines history file (default %(default)s)')
+    parser.add_argument('--no-save', action='store_true', help="don't add this report to the history")
+    args = parser.parse_args(argv)
+
+    machine = f'{platform.node()} {platform.machine()} {os.cpu_count()} cpu'
+    history = [r for r in load_history(args.history) if r.get('machine') == machine]
+    previous = history[-1]['levels'] if history else {}
+
+    levels = {}
+    for n in args.sessions:
+        server = None if args.url else start_server(args.port)
+        try:
+            url = args.url or f'ws://localhost:{args.port}'
+            pid = args.pid if args.url else server.pid
+            levels[str(n)] = asyncio.run(run_level(url, n, args.duration, args.think, args.seed, pid))
+        finally:
+            if server is not None:
+                stop_server(server)
+        _print_level(n, levels[str(n)], previous.get(str(n)))
+
+    report = {'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+              'commit': _git_commit(), 'machine': machine, 'python': platform.python_version(),
+              'duration_s': args.duration, 'think_s': args.think, 'slo_s': args.slo,
+              'capacity': capacity(levels, args.slo), 'levels': levels}
+    print(f"capacity: {report['capacity']} concurrent sessions with 95% of reruns under {args.slo:.2f} s"
+          + (f" (previously {history[-1]['capacity']})" if history else ''))
+    if not args.no_save:
+        with open(args.history, 'a') as f:
+            f.write(json.dumps(report) + '\n')
+
+    found = regressions(levels, previous)
+    if found:
+        print('REGRESSIONS:\n  ' + '\n  '.join(found))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,321 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Smart meter interval data: streams hourly or half-hourly meter exports and fits each
+# meter's daily gas and electricity use against heating degree days,
+#
+#   daily use = baseload + slope * degree days
+#
+# so a year (or several) of readings gives the meter's weather-normalised annual use split
+# into space heating (slope * the degree days of a typical year) and baseload (365 *
+# baseload: hot water, cooking and other use).  The split is written as engine inputs -
+# the gas baseload replaces the hot water and cooking estimates (gas_base_kWh) and any
+# heating on the electricity meter becomes an electric secondary heat source - ready for
+# batch.py.
+#
+# The fit only needs five running sums per meter and fuel (days of data, degree days,
+# degree days squared, use, use times degree days), and every reading adds to them on its
+# own, so readings can come in any order and memory does not grow with the file.  A day
+# with some readings missing counts as the fraction of the day covered.
+#
+# Readings files are CSV or Parquet with columns meter_id, timestamp, and gas and/or elec:
+# the use in the interval ending at timestamp, electricity in kWh and gas in --gas-units.
+#
+#   python meters.py readings.csv households.csv --region Ontario --gas-units m^3
+#   python batch.py households.csv results.csv --keep meter_id
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from hourly import HDH_BASE_TEMP, HOURS, REGION_CLIMATE, load_weather, synthetic_weather
+from regions import GAS_UNITS
+
+
+READING_COLUMNS = ('meter_id', 'timestamp', 'gas', 'elec')
+FUELS = ('gas', 'elec')
+#arrow reads CSV in blocks of about this many bytes, pandas in chunks of this many rows
+BLOCK_BYTES = 64 << 20
+DEFAULT_CHUNKSIZE = 2000000
+
+#meters with fewer days of data than this, or without both cold and mild days, are not fitted
+MIN_DAYS = 60
+#weather-sensitive electricity below this (kWh a year) is not taken as electric heating
+ELEC_HEAT_MIN_kWh = 500
+#minutes per reading of a meter seen only once so far
+DEFAULT_INTERVAL = 60
+
+
+def degree_days(temps, base_temp=HDH_BASE_TEMP):
+    """
+    temps - (8760,) hourly outdoor temperatures of a typical year
+    returns (365,) heating degree days of each day of the year
+    """
+    temps = np.asarray(temps, dtype=np.float64).reshape(HOURS // 24, 24)
+    return np.maximum(base_temp - temps, 0).mean(axis=1)
+
+
+class MeterAccumulator:
+    """
+    Running degree-day regression sums of every meter seen, added to reading by reading.
+    hdd - (365,) degree days of each day of the year (see degree_days); readings in any
+          year are matched to the typical year's weather by day of year
+    interval_minutes - length of a reading; if not given, each meter's is the shortest step
+                       between its consecutive readings, as meters can be read at different offsets
+    """
+    def __init__(self, hdd, interval_minutes=None):
+        self.hdd = np.asarray(hdd, dtype=np.float64)
+        self.interval_minutes = interval_minutes
+        self.meter_ids = pd.Index([])
+        #minutes per reading of each meter, 0 until it has two readings in a chunk
+        self.intervals = np.zeros(0, dtype=np.int64)
+        #(n_meters, 5) sums of each fuel: days, days x hdd, days x hdd^2, use, use x hdd
+        self.sums = {fuel: np.zeros((0, 5)) for fuel in FUELS}
+        self.readings = 0
+
+    def _codes(self, meter_ids):
+        """
+        meter index of each reading, adding meters not seen before
+        meter_ids - array, or a pandas Categorical as read from a dictionary-encoded column
+        """
+        if isinstance(meter_ids, pd.Categorical):
+            codes, uniques = meter_ids.codes, meter_ids.categories.to_numpy()
+        else:
+            codes, uniques = pd.factorize(meter_ids)
+        idx = self.meter_ids.get_indexer(uniques)
+        new = idx < 0
+        if new.any():
+            idx[new] = len(self.meter_ids) + np.arange(new.sum())
+            self.meter_ids = self.meter_ids.append(pd.Index(uniques[new]))
+            for fuel in FUELS:
+                self.sums[fuel] = np.concatenate([self.sums[fuel], np.zeros((new.sum(), 5))])
+            self.intervals = np.concatenate([self.intervals, np.zeros(new.sum(), dtype=np.int64)])
+        return idx[codes]
+
+    def _reading_intervals(self, codes, minutes):
+        """
+        minutes per reading of each reading's meter, learning the interval of meters new to this chunk
+        """
+        unknown = self.intervals[codes] == 0
+        if unknown.any():
+            c, m = codes[unknown], minutes[unknown]
+            #exports are usually in meter then time order already
+            if not np.all((c[1:] > c[:-1]) | ((c[1:] == c[:-1]) & (m[1:] >= m[:-1]))):
+                order = np.lexsort((m, c))
+                c, m = c[order], m[order]
+            #steps between consecutive readings of the same meter
+            steps = np.diff(m)
+            steps = np.where((c[1:] == c[:-1]) & (steps > 0), steps, np.iinfo(np.int64).max)
+            if len(steps):
+                starts = np.flatnonzero(np.r_[True, c[2:] != c[1:-1]])
+                gaps = np.minimum.reduceat(steps, starts)
+                found = gaps < np.iinfo(np.int64).max
+                self.intervals[c[1:][starts][found]] = gaps[found]
+        intervals = self.intervals[codes]
+        return np.where(intervals > 0, intervals, DEFAULT_INTERVAL)
+
+    def add(self, meter_ids, timestamps, gas=None, elec=None):
+        """
+        meter_ids - (n,) meter of each reading
+        timestamps - (n,) datetime64 end of each reading's interval
+        gas, elec - (n,) kWh used in the interval, nan where missing
+        """
+        minutes = np.asarray(timestamps, dtype='datetime64[m]').view(np.int64)
+        codes = self._codes(meter_ids)
+        n = len(self.meter_ids)
+        if self.interval_minutes is None:
+            interval = self._reading_intervals(codes, minutes)
+        else:
+            interval = self.interval_minutes
+        #a reading ending at midnight belongs to the day before
+        days = (minutes - interval) // 1440
+        #degree days of each day in the chunk's range, looked up by the day's offset into it
+        first = days.min()
+        span_days = np.arange(first, days.max() + 1).astype('datetime64[D]')
+        day_of_year = np.minimum((span_days - span_days.astype('datetime64[Y]')).astype(np.int64), len(self.hdd) - 1)
+        x = self.hdd[day_of_year][days - first]
+        fraction = np.broadcast_to(interval / 1440, codes.shape)
+
+        for fuel, use in zip(FUELS, (gas, elec)):
+            if use is None:
+                continue
+            use = np.asarray(use, dtype=np.float64)
+            ok = ~np.isnan(use)
+            c, xs, use, f = codes[ok], x[ok], use[ok], fraction[ok]
+            sums = self.sums[fuel]
+            sums[:, 0] += np.bincount(c, f, minlength=n)
+            sums[:, 1] += np.bincount(c, xs * f, minlength=n)
+            sums[:, 2] += np.bincount(c, xs * xs * f, minlength=n)
+            sums[:, 3] += np.bincount(c, use, minlength=n)
+            sums[:, 4] += np.bincount(c, use * xs, minlength=n)
+        self.readings += len(codes)
+
+    def fit(self, annual_hdd=None):
+        """
+        returns dict of (n_meters,) arrays: meter_id, and for each fuel its weather-normalised
+        annual <fuel>_total_kWh, <fuel>_heating_kWh and <fuel>_base_kWh and the <fuel>_days of
+        data; nan for meters and fuels that could not be fitted
+        """
+        if annual_hdd is None:
+            annual_hdd = self.hdd.sum()
+        out = {'meter_id': self.meter_ids.to_numpy()}
+        for fuel in FUELS:
+            w, wx, wxx, y, xy = self.sums[fuel].T
+            with np.errstate(divide='ignore', invalid='ignore'):
+                var = w*wxx - wx*wx
+                slope = (w*xy - wx*y) / var
+                base = (y - slope*wx) / w
+                #use falling as it gets colder: no heating, all baseload
+                flat = slope < 0
+                slope = np.where(flat, 0, slope)
+                base = np.where(flat, y / w, base)
+                #more than all of the use follows the weather: no baseload
+                no_base = base < 0
+                slope = np.where(no_base, xy / wxx, slope)
+                base = np.where(no_base, 0, base)
+            #too little data, or no spread of degree days to fit a slope to
+            ok = (w >= MIN_DAYS) & (var > 1e-9 * np.maximum(w*wxx, 1e-300))
+            heating = np.where(ok, slope * annual_hdd, np.nan)
+            base = np.where(ok, base * 365, np.nan)
+            out[fuel + '_total_kWh'] = heating + base
+            out[fuel + '_heating_kWh'] = heating
+            out[fuel + '_base_kWh'] = base
+            out[fuel + '_days'] = w
+        return out
+
+
+def to_inputs(fit):
+    """
+    engine inputs of each meter from MeterAccumulator.fit, plus the meter_id and fit columns
+    """
+    out = dict(fit)
+    is_elec_heat = fit['elec_heating_kWh'] >= ELEC_HEAT_MIN_kWh
+    out['is_second_heatsource'] = is_elec_heat
+    out['second_heatsource_type'] = np.where(is_elec_heat, 'electric', 'gas')
+    out['second_heatsource_kWh'] = np.where(is_elec_heat, fit['elec_heating_kWh'], 0)
+    return out
+
+
+def read_readings(path, gas_units='kWh', chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Yield (meter_ids, timestamps, gas, elec) arrays of at most about chunksize readings from a
+    CSV or Parquet file; gas converted to kWh, None for a fuel the file has no column for.
+    pyarrow (installed with streamlit) parses CSV on several threads, pandas is the fallback.
+    """
+    to_kWh = GAS_UNITS[gas_units]
+    try:
+        import pyarrow  # noqa: F401
+        batches = _arrow_batches(path, chunksize)
+    except ImportError:
+        batches = _pandas_batches(path, chunksize)
+    for df in batches:
+        gas = df['gas'].to_numpy(dtype=np.float64) * to_kWh if 'gas' in df else None
+        elec = df['elec'].to_numpy(dtype=np.float64) if 'elec' in df else None
+        #meter ids stay categorical, so each chunk only looks up its distinct meters
+        yield df['meter_id'].array, df['timestamp'].to_numpy(dtype='datetime64[ns]'), gas, elec
+
+
+def _arrow_batches(path, chunksize):
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+
+    if str(path).lower().endswith(('.parquet', '.pq')):
+        pf = pq.ParquetFile(path)
+        columns = [c for c in pf.schema_arrow.names if c in READING_COLUMNS]
+        for batch in pf.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+        return
+
+    with open(path) as f:
+        header = f.readline().strip().split(',')
+    columns = [c for c in header if c in READING_COLUMNS]
+    reader = pa_csv.open_csv(
+        path, read_options=pa_csv.ReadOptions(block_size=BLOCK_BYTES),
+        convert_options=pa_csv.ConvertOptions(include_columns=columns,
+                                              column_types={'timestamp': pa.timestamp('s'),
+                                                            'meter_id': pa.dictionary(pa.int32(), pa.string())}))
+    for batch in reader:
+        yield batch.to_pandas()
+
+
+def _pandas_batches(path, chunksize):
+    for df in pd.read_csv(path, chunksize=chunksize, usecols=lambda c: c in READING_COLUMNS,
+                          dtype={'meter_id': 'category'}):
+        #timestamps repeat across meters, so parse each distinct one once
+        codes, uniques = pd.factorize(df['timestamp'])
+        df['timestamp'] = pd.to_datetime(uniques).to_numpy()[codes]
+        yield df
+
+
+def disaggregate(path, temps, gas_units='kWh', interval_minutes=None, chunksize=DEFAULT_CHUNKSIZE, verbose=False):
+    """
+    Fit every meter in a readings file.
+    temps - (8760,) hourly outdoor temperatures of a typical year at the meters
+    returns dict of to_inputs columns, one entry per meter
+    """
+    acc = MeterAccumulator(degree_days(temps), interval_minutes)
+    start = time.perf_counter()
+    for meter_ids, timestamps, gas, elec in read_readings(path, gas_units, chunksize):
+        acc.add(meter_ids, timestamps, gas, elec)
+        if verbose:
+            elapsed = time.perf_counter() - start
+            print(f'{acc.readings:,} readings, {len(acc.meter_ids):,} meters, {acc.readings/elapsed:,.0f} readings/s')
+    return to_inputs(acc.fit())
+
+
+def example_readings(path, n_meters=100, days=365, interval_minutes=60, start='2023-01-01', region='Ontario', seed=0,
+                     offset_minutes=0):
+    """
+    write a CSV of made-up readings for n_meters meters with known heating and baseload, for
+    benchmarks and trying out the pipeline; returns the (n_meters,) true annual gas heating kWh
+    offset_minutes - readings of every other meter are this much later, as meters read at different times
+    """
+    rng = np.random.default_rng(seed)
+    hdd = degree_days(synthetic_weather(*REGION_CLIMATE[region]))
+    per_day = 1440 // interval_minutes
+    gas_slope = rng.uniform(0.5, 3.0, n_meters)
+    gas_base, elec_base = rng.uniform(5, 15, n_meters), rng.uniform(5, 15, n_meters)
+    stamps = np.datetime64(start, 'm') + interval_minutes * np.arange(1, days*per_day + 1)
+    day = (stamps - np.timedelta64(interval_minutes, 'm')).astype('datetime64[D]')
+    x = hdd[np.minimum((day - day.astype('datetime64[Y]')).astype(np.int64), 364)]
+    text = np.datetime_as_string(stamps).astype(object)
+    first = True
+    shifted = np.datetime_as_string(stamps + np.timedelta64(offset_minutes, 'm')).astype(object)
+    for m in range(n_meters):
+        noise = rng.normal(1, 0.2, len(stamps))
+        df = pd.DataFrame({'meter_id': f'M{m:06d}', 'timestamp': shifted if m % 2 else text,
+                           'gas': ((gas_base[m] + gas_slope[m]*x) / per_day * noise).round(3),
+                           'elec': (elec_base[m] / per_day * noise).round(3)})
+        df.to_csv(path, mode='w' if first else 'a', header=first, index=False)
+        first = False
+    return gas_slope * hdd.sum()
+
+
+def main(argv=None):
+    from batch import ChunkWriter
+
+    parser = argparse.ArgumentParser(description='Split smart meter readings into heating and baseload, as engine inputs.')
+    parser.add_argument('input', help='CSV or Parquet readings: meter_id, timestamp and gas and/or elec columns')
+    parser.add_argument('output', help='CSV or Parquet file of households for batch.py, one row per meter')
+    parser.add_argument('--weather', help='.npy or raw float32 file of a typical year of hourly outdoor temperatures')
+    parser.add_argument('--region', choices=sorted(REGION_CLIMATE), default='Ontario',
+                        help='synthetic weather to use when no weather file is given')
+    parser.add_argument('--gas-units', choices=list(GAS_UNITS), default='kWh', help='units of the gas readings')
+    parser.add_argument('--interval', type=int, help='minutes per reading of every meter (default found per meter from its readings)')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument('--verbose', action='store_true', help='report progress after each chunk')
+    args = parser.parse_args(argv)
+
+    temps = load_weather(args.weather)[0] if args.weather else synthetic_weather(*REGION_CLIMATE[args.region])
+    start = time.perf_counter()
+    households = disaggregate(args.input, temps, args.gas_units, args.interval, args.chunksize, args.verbose)
+    with ChunkWriter(args.output) as writer:
+        writer.write(pd.DataFrame(households))
+    fitted = np.isfinite(households['gas_total_kWh']).mean()
+    print(f'{len(households["meter_id"]):,} meters in {time.perf_counter() - start:.2f} s, '
+          f'{fitted:.0%} with a gas fit')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Multi-core execution for batch runs.  Each chunk of household inputs is copied once
+# into a shared memory block, the row range is split into shards that a process pool
+# scores in place, and each worker writes its rows straight into a shared output block.
+# Only block names and row offsets are pickled, and since every shard owns a fixed slice
+# of the output the merged result is in input order whatever order the shards finish in.
+#
+# Measure scaling on this machine with:
+#   python parallel.py --rows 2000000 --workers 1 2 4 8
+
+import argparse
+import multiprocessing as mp
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from engine import INPUT_DEFAULTS, calculate, to_columns
+from grid_carbon import BASES
+from regions import REGIONS
+from tariffs import TARIFFS
+
+
+#secondary heat source types, tariff names and grid series are passed through shared memory as integer codes
+SECOND_HEATSOURCE_TYPES = ('gas', 'electric', 'other')
+ELEC_TARIFFS = ('',) + tuple(TARIFFS)
+#regions without an hourly series use the annual intensity, so any unknown region is sent as ''
+GRID_REGIONS = ('',) + tuple(REGIONS)
+
+INPUT_NAMES = tuple(INPUT_DEFAULTS)
+OUTPUT_NAMES = tuple(to_columns(calculate()))
+
+#shards per worker for each chunk - a few per worker evens out the load
+SHARDS_PER_WORKER = 4
+
+
+def encode_column(name, values):
+    """
+    convert an engine input column to float64 for the shared input block
+    """
+    if name == 'second_heatsource_type':
+        values = np.asarray(values, dtype=str)
+        codes = np.full(values.shape, SECOND_HEATSOURCE_TYPES.index('other'), dtype=np.float64)
+        codes[values == 'gas'] = 0
+        codes[values == 'electric'] = 1
+        return codes
+    if name == 'elec_tariff':
+        values = np.asarray(values, dtype=str)
+        codes = np.full(values.shape, -1, dtype=np.float64)
+        for i, tariff in enumerate(ELEC_TARIFFS):
+            codes[values == tariff] = i
+        if (codes < 0).any():
+            raise ValueError(f'Unknown tariff {values[codes < 0][0]!r}, choose from: ' + ', '.join(TARIFFS))
+        return codes
+    if name == 'grid_region':
+        values = np.asarray(values, dtype=str)
+        codes = np.zeros(values.shape, dtype=np.float64)
+        for i, region in enumerate(GRID_REGIONS[1:], 1):
+            codes[values == region] = i
+        return codes
+    if name == 'grid_carbon':
+        values = np.asarray(values, dtype=str)
+        codes = np.full(values.shape, -1, dtype=np.float64)
+        for i, basis in enumerate(BASES):
+            codes[values == basis] = i
+        if (codes < 0).any():
+            raise ValueError(f'Unknown grid carbon basis {values[codes < 0][0]!r}, choose from: ' + ', '.join(BASES))
+        return codes
+    return np.asarray(values, dtype=np.float64)
+
+
+def decode_columns(names, block):
+    """
+    names - input names held in the first rows of block
+    block - 2-d float64 array, one row per input column
+    returns dict of engine inputs
+    """
+    inputs = {}
+    for name, values in zip(names, block):
+        default = INPUT_DEFAULTS[name]
+        if name == 'second_heatsource_type':
+            inputs[name] = np.asarray(SECOND_HEATSOURCE_TYPES)[values.astype(np.intp)]
+        elif name == 'elec_tariff':
+            inputs[name] = np.asarray(ELEC_TARIFFS)[values.astype(np.intp)]
+        elif name == 'grid_region':
+            inputs[name] = np.asarray(GRID_REGIONS)[values.astype(np.intp)]
+        elif name == 'grid_carbon':
+            inputs[name] = np.asarray(BASES)[values.astype(np.intp)]
+        elif isinstance(default, bool):
+            inputs[name] = values.astype(bool)
+        else:
+            inputs[name] = values
+    return inputs
+
+
+#worker side: shared memory blocks attached once per process and reused for every shard
+_attached = {}
+
+
+def _attach(name, shape):
+    if name not in _attached:
+        _attached[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=np.float64, buffer=_attached[name].buf)
+
+
+def _score_shard(task):
+    in_name, out_name, capacity, names, start, stop = task
+    block_in = _attach(in_name, (len(INPUT_NAMES), capacity))
+    block_out = _attach(out_name, (len(OUTPUT_NAMES), capacity))
+
+    cols = to_columns(calculate(**decode_columns(names, block_in[:len(names), start:stop])))
+    for j, name in enumerate(OUTPUT_NAMES):
+        block_out[j, start:stop] = cols[name]
+    return start
+
+
+class ParallelScorer:
+    """
+    Score chunks of up to capacity households across a pool of worker processes.
+    Use as a context manager so the pool and shared memory are always released.
+    """
+    def __init__(self, workers=None, capacity=100000):
+        self.workers = workers or os.cpu_count()
+        self.capacity = capacity
+        self._shm_in = shared_memory.SharedMemory(create=True, size=8 * len(INPUT_NAMES) * capacity)
+        self._shm_out = shared_memory.SharedMemory(create=True, size=8 * len(OUTPUT_NAMES) * capacity)
+        self._block_in = np.ndarray((len(INPUT_NAMES), capacity), dtype=np.float64, buffer=self._shm_in.buf)
+        self._block_out = np.ndarray((len(OUTPUT_NAMES), capacity), dtype=np.float64, buffer=self._shm_out.buf)
+        self._pool = mp.Pool(self.workers)
+
+    def score(self, inputs, n_rows):
+        """
+        inputs - dict of engine input columns of length n_rows (<= capacity)
+        returns dict of output columns, as engine.to_columns
+        """
+        if n_rows > self.capacity:
+            raise ValueError(f'{n_rows} rows is more than the scorer capacity of {self.capacity}')
+        names = tuple(inputs)
+        for j, name in enumerate(names):
+            self._block_in[j, :n_rows] = encode_column(name, inputs[name])
+
+        bounds = np.linspace(0, n_rows, self.workers * SHARDS_PER_WORKER + 1).astype(int)
+        tasks = [(self._shm_in.name, self._shm_out.name, self.capacity, names, start, stop)
+                 for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+        for _ in self._pool.imap_unordered(_score_shard, tasks):
+            pass
+
+        return {name: self._block_out[j, :n_rows].copy() for j, name in enumerate(OUTPUT_NAMES)}
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        del self._block_in, self._block_out
+        for shm in (self._shm_in, self._shm_out):
+            shm.close()
+            shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def random_households(n_rows, seed=0):
+    """
+    synthetic household inputs for scaling measurements
+    """
+    rng = np.random.default_rng(seed)
+    return {'gas_total_kWh': rng.uniform(5000, 25000, n_rows),
+            'elec_total_kWh': rng.uniform(1000, 8000, n_rows),
+            'hw_lday': rng.uniform(50, 500, n_rows),
+            'is_cook_gas': rng.random(n_rows) < 0.3,
+            'is_second_heatsource': rng.random(n_rows) < 0.2,
+            'second_heatsource_type': rng.choice(SECOND_HEATSOURCE_TYPES, n_rows),
+            'second_heatsource_kWh': rng.uniform(0, 2000, n_rows),
+            'efficiency_boost': rng.uniform(0, 0.3, n_rows),
+            'is_two_tier_tariff': rng.random(n_rows) < 0.5}
+
+
+def measure_scaling(n_rows, worker_counts, chunksize=250000):
+    """
+    returns list of (workers, rows per second) scoring n_rows synthetic households
+    """
+    inputs = random_households(n_rows)
+    timings = []
+    for workers in worker_counts:
+        with ParallelScorer(workers, chunksize) as scorer:
+            start = time.perf_counter()
+            for lo in range(0, n_rows, chunksize):
+                hi = min(lo + chunksize, n_rows)
+                scorer.score({k: v[lo:hi] for k, v in inputs.items()}, hi - lo)
+            timings.append((workers, n_rows / (time.perf_counter() - start)))
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure batch scoring throughput against worker count.')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count()])
+    parser.add_argument('--chunksize', type=int, default=250000)
+    args = parser.parse_args(argv)
+
+    timings = measure_scaling(args.rows, args.workers, args.chunksize)
+    base = timings[0][1] / timings[0][0]
+    print(f'{"workers":>8} {"rows/s":>14} {"speedup":>8} {"efficiency":>10}')
+    for workers, rate in timings:
+        print(f'{workers:>8} {rate:>14,.0f} {rate/base:>8.2f} {rate/base/workers:>10.0%}')
+
+
+if __name__ == '__main__':
+    main()
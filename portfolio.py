@@ -0,0 +1,405 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Portfolio views of batch results (the output of batch.py) for the app's portfolio mode.
+# A results file of a million households is loaded once into column arrays: numbers as
+# float64 and text columns kept with --keep (province, tariff, retrofit package ...) as
+# integer codes into their labels.  Every view is reduced here, in numpy, to a few dozen
+# rows - histogram bins, quantile bands and totals per group - and only those rows go into
+# the chart, so the page sent to the browser is the same size whatever the portfolio size.
+#
+# Filters are boolean masks over the households: a category filter looks up each
+# household's code in a table of the selected codes, and the views count, sum and bin with
+# the mask as weights, so an interaction is a few passes over the columns it uses.
+#
+# The app only opens results files on the server from the directory named by HP_RESULTS_DIR
+# (anything else has to be uploaded), so a shared link cannot read other files.
+#
+#   python batch.py households.csv results.parquet --keep region elec_tariff
+#   python portfolio.py results.parquet --by region --metric cost_saving
+#   HP_RESULTS_DIR=/srv/heatpump/results streamlit run streamlit_app.py
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from defaults import CASES, CASE_SUFFIX, ENERGY_BREAKDOWN, COST_BREAKDOWN
+
+
+#metrics of each case, from the batch results' totals; savings are against the Current case
+METRICS = {'cost_saving': 'Annual cost saving (£)',
+           'emissions_saving': 'Annual emissions saving (kg CO2)',
+           'costs_total': 'Annual running cost (£)',
+           'emissions_total': 'Annual emissions (kg CO2)',
+           'energy_total': 'Annual energy use (kWh)'}
+SAVINGS = {'cost_saving': 'costs_total', 'emissions_saving': 'emissions_total'}
+#breakdown columns summed by group_totals, as in engine.to_columns
+BREAKDOWNS = {'energy': ENERGY_BREAKDOWN, 'emissions': ENERGY_BREAKDOWN, 'costs': COST_BREAKDOWN}
+
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+BINS = 40
+#text columns with more distinct values than this (household ids) are not offered as groups
+MAX_CATEGORIES = 1000
+RESULTS_DIR = os.environ.get('HP_RESULTS_DIR')
+RESULTS_EXTENSIONS = ('.csv', '.parquet', '.pq')
+
+
+def _slug(label):
+    return '_'.join(label.lower().replace('.', ' ').split())
+
+
+class Portfolio:
+    """
+    Columns of a batch results file.
+    numbers - dict of column name -> (n,) float64 array
+    codes, labels - dict of text column name -> (n,) int32 codes and the tuple of labels
+    """
+    __slots__ = ('n', 'numbers', 'codes', 'labels', '_derived', '_orders')
+
+    def __init__(self, numbers, codes=None, labels=None):
+        self.numbers = numbers
+        self.codes = codes or {}
+        self.labels = labels or {}
+        self.n = len(next(iter(numbers.values()))) if numbers else 0
+        self._derived = {}
+        self._orders = {}
+
+    @property
+    def groups(self):
+        """
+        names of the columns households can be grouped and filtered by
+        """
+        return tuple(self.codes)
+
+    def cases(self, metric):
+        """
+        cases the results have the metric for
+        """
+        return tuple(c for c in CASES if self._source(metric, c) is not None)
+
+    def _source(self, metric, case_name):
+        total = SAVINGS.get(metric, metric)
+        if metric in SAVINGS and case_name == CASES[0]:
+            return None
+        names = [total + CASE_SUFFIX[case_name]] + ([total] if metric in SAVINGS else [])
+        return names if all(name in self.numbers for name in names) else None
+
+    def metric(self, metric, case_name):
+        """
+        (n,) values of a metric (a key of METRICS) for one case
+        """
+        if metric not in METRICS:
+            raise ValueError(f'Unknown metric {metric!r}, choose from: ' + ', '.join(METRICS))
+        names = self._source(metric, case_name)
+        if names is None:
+            raise ValueError(f'No {metric} for {case_name!r} in the results, choose from: ' + ', '.join(self.cases(metric)))
+        if metric not in SAVINGS:
+            return self.numbers[names[0]]
+        key = (metric, case_name)
+        if key not in self._derived:
+            self._derived[key] = self.numbers[names[1]] - self.numbers[names[0]]
+        return self._derived[key]
+
+    def order(self, by):
+        """
+        households sorted by their code in a group column, and where each code's run starts
+        """
+        if by not in self._orders:
+            codes = self.codes[by]
+            order = np.argsort(codes, kind='stable')
+            self._orders[by] = order, np.searchsorted(codes[order], np.arange(len(self.labels[by]) + 1))
+        return self._orders[by]
+
+    def mask(self, filters=None, value_range=None):
+        """
+        filters - dict of group column -> selected labels, all households of a column if missing
+        value_range - optional (values, low, high) to also keep only low <= values <= high
+        returns (n,) bool array of the households selected, None for all of them
+        """
+        mask = None
+        for name, selected in (filters or {}).items():
+            if selected is None or len(selected) == len(self.labels[name]):
+                continue
+            allowed = np.isin(np.asarray(self.labels[name], dtype=object), list(selected))
+            keep = allowed[self.codes[name]]
+            mask = keep if mask is None else mask & keep
+        if value_range is not None:
+            values, low, high = value_range
+            keep = (values >= low) & (values <= high)
+            mask = keep if mask is None else mask & keep
+        return mask
+
+
+def _weights(mask, n):
+    return np.ones(n) if mask is None else mask.astype(np.float64)
+
+
+def bin_edges(values, bins=BINS):
+    """
+    bins + 1 edges over the 0.5 to 99.5 percentiles of values, so a few outliers don't squash
+    the rest into one bin; values outside the edges are counted in the end bins
+    """
+    low, high = np.nanpercentile(values, [0.5, 99.5]) if len(values) else (0.0, 1.0)
+    if high <= low:
+        high = low + 1
+    return np.linspace(low, high, bins + 1)
+
+
+def histogram(values, edges, mask=None, codes=None, n_groups=1):
+    """
+    edges - equally spaced, from bin_edges
+    returns (n_groups, bins) number of selected households in each bin (and group, for codes)
+    """
+    bins = len(edges) - 1
+    idx = np.clip((values - edges[0]) * (bins / (edges[-1] - edges[0])), 0, bins - 1).astype(np.intp)
+    if codes is not None:
+        idx = codes.astype(np.intp) * bins + idx
+    counts = np.bincount(idx, weights=_weights(mask, len(values)), minlength=n_groups * bins)
+    return counts.reshape(n_groups, bins)
+
+
+def quantile_bands(values, order, starts, mask=None, q=QUANTILES):
+    """
+    order, starts - households sorted by group and where each group starts, see Portfolio.order
+    returns (n_groups, len(q)) quantiles of the selected households of each group, nan for an empty group
+    """
+    n_groups = len(starts) - 1
+    bands = np.full((n_groups, len(q)), np.nan)
+    for g in range(n_groups):
+        idx = order[starts[g]:starts[g + 1]]
+        if mask is not None:
+            idx = idx[mask[idx]]
+        if len(idx):
+            bands[g] = np.quantile(values[idx], q)
+    return bands
+
+
+def group_sums(columns, codes, n_groups, mask=None):
+    """
+    columns - list of (n,) arrays
+    returns (n_groups,) number of selected households and (n_groups, len(columns)) their sums
+    """
+    weights = _weights(mask, len(codes))
+    counts = np.bincount(codes, weights=weights, minlength=n_groups)
+    sums = np.stack([np.bincount(codes, weights=col * weights, minlength=n_groups) for col in columns], axis=1)
+    return counts, sums
+
+
+def _group(portfolio, by):
+    """
+    codes, labels and (order, starts) of a group column, or of all households as one group
+    """
+    if by is None:
+        return np.zeros(portfolio.n, dtype=np.int32), ('All households',), (np.arange(portfolio.n), [0, portfolio.n])
+    if by not in portfolio.codes:
+        raise ValueError(f'Unknown group {by!r}, choose from: ' + ', '.join(portfolio.groups))
+    return portfolio.codes[by], portfolio.labels[by], portfolio.order(by)
+
+
+def histogram_frame(portfolio, metric, cases, mask=None, bins=BINS):
+    """
+    DataFrame of households per bin of a metric: Case, bin_start, bin_end, households
+    """
+    import pandas as pd
+
+    columns = [portfolio.metric(metric, case_name) for case_name in cases]
+    #the same bins for every case, so they can be compared
+    edges = bin_edges(np.concatenate(columns), bins) if columns else bin_edges(np.zeros(0), bins)
+    frames = [pd.DataFrame({'Case': case_name, 'bin_start': edges[:-1], 'bin_end': edges[1:],
+                            'households': histogram(values, edges, mask)[0]})
+              for case_name, values in zip(cases, columns)]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
+        columns=['Case', 'bin_start', 'bin_end', 'households'])
+
+
+def quantile_frame(portfolio, metric, cases, by=None, mask=None, q=QUANTILES):
+    """
+    DataFrame of a metric's quantiles in each group: group, Case, households, mean and a
+    column per quantile (p10, p25 ...)
+    """
+    import pandas as pd
+
+    codes, labels, (order, starts) = _group(portfolio, by)
+    names = [f'p{round(100*v)}' for v in q]
+    frames = []
+    for case_name in cases:
+        values = portfolio.metric(metric, case_name)
+        counts, sums = group_sums([values], codes, len(labels), mask)
+        df = pd.DataFrame(quantile_bands(values, order, starts, mask, q), columns=names)
+        df.insert(0, 'group', labels)
+        df.insert(1, 'Case', case_name)
+        df.insert(2, 'households', counts)
+        df.insert(3, 'mean', np.divide(sums[:, 0], counts, out=np.full(len(labels), np.nan), where=counts > 0))
+        frames.append(df[df['households'] > 0])
+    return pd.concat(frames, ignore_index=True)
+
+
+def totals_frame(portfolio, quantity, case_name, by=None, mask=None):
+    """
+    DataFrame of the summed breakdown of energy, emissions or costs in each group:
+    group, Breakdown, households and the total
+    """
+    import pandas as pd
+
+    if quantity not in BREAKDOWNS:
+        raise ValueError(f'Unknown quantity {quantity!r}, choose from: ' + ', '.join(BREAKDOWNS))
+    codes, labels, _ = _group(portfolio, by)
+    breakdown = BREAKDOWNS[quantity]
+    names = [f'{quantity}_{_slug(label)}{CASE_SUFFIX[case_name]}' for label in breakdown]
+    missing = [name for name in names if name not in portfolio.numbers]
+    if missing:
+        raise ValueError(f'The results have no {missing[0]} column')
+    counts, sums = group_sums([portfolio.numbers[name] for name in names], codes, len(labels), mask)
+    has = counts > 0
+    return pd.DataFrame({'group': np.repeat(np.asarray(labels, dtype=object)[has], len(breakdown)),
+                         'Breakdown': np.tile(breakdown, has.sum()),
+                         'households': np.repeat(counts[has], len(breakdown)),
+                         'total': sums[has].ravel()})
+
+
+def results_files(directory=RESULTS_DIR):
+    """
+    sorted names of the CSV and Parquet files in directory, empty if it is not set or missing
+    """
+    if not directory or not os.path.isdir(directory):
+        return []
+    root = os.path.realpath(directory)
+    #symbolic links out of the directory are left out, as resolve_results rejects them
+    return sorted(entry.name for entry in os.scandir(root) if entry.name.lower().endswith(RESULTS_EXTENSIONS)
+                  and entry.is_file() and os.path.dirname(os.path.realpath(entry.path)) == root)
+
+
+def resolve_results(name, directory=RESULTS_DIR):
+    """
+    full path of a results file named inside directory; ValueError for any name that is not
+    a CSV or Parquet file in it, including ../ and symbolic links leading out of it
+    """
+    if not directory:
+        raise ValueError('no results directory is configured (set HP_RESULTS_DIR)')
+    root = os.path.realpath(directory)
+    path = os.path.realpath(os.path.join(root, name))
+    if (os.path.dirname(path) != root or not path.lower().endswith(RESULTS_EXTENSIONS)
+            or not os.path.isfile(path)):
+        raise ValueError(f'{name!r} is not a results file in the results directory')
+    return path
+
+
+def load(path, max_categories=MAX_CATEGORIES):
+    """
+    Portfolio of a CSV or Parquet batch results file.  pyarrow (installed with streamlit)
+    reads it on several threads and dictionary-encodes the text columns; pandas is the fallback.
+    """
+    #an uploaded file is read from memory, its name giving the format
+    name = str(getattr(path, 'name', path)).lower()
+    try:
+        import pyarrow  # noqa: F401
+        return _load_arrow(path, name, max_categories)
+    except ImportError:
+        return _load_pandas(path, name, max_categories)
+
+
+def _load_arrow(path, name, max_categories):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+
+    if name.endswith(('.parquet', '.pq')):
+        table = pq.read_table(path)
+    else:
+        table = pa_csv.read_csv(path, convert_options=pa_csv.ConvertOptions(
+            auto_dict_encode=True, auto_dict_max_cardinality=max_categories))
+    numbers, codes, labels = {}, {}, {}
+    for column, col in zip(table.column_names, table.columns):
+        if pa.types.is_integer(col.type) or pa.types.is_floating(col.type):
+            numbers[column] = col.to_numpy().astype(np.float64)
+            continue
+        if pa.types.is_boolean(col.type) or pa.types.is_string(col.type) or pa.types.is_large_string(col.type):
+            col = pc.cast(col, pa.string()) if pa.types.is_boolean(col.type) else col
+            #an id column already has too many values in its first chunk, so is not encoded in full
+            if col.num_chunks and len(col.chunk(0).dictionary_encode().dictionary) > max_categories:
+                continue
+            col = col.dictionary_encode()
+        if not pa.types.is_dictionary(col.type):
+            continue
+        col = col.unify_dictionaries().combine_chunks()
+        if len(col.dictionary) > max_categories:
+            continue
+        dictionary = col.dictionary.to_pylist()
+        #missing values get their own '' label
+        idx = col.indices.fill_null(len(dictionary)).to_numpy().astype(np.int32)
+        if (idx == len(dictionary)).any():
+            dictionary.append('')
+        codes[column], labels[column] = idx, tuple(str(v) for v in dictionary)
+    return Portfolio(numbers, codes, labels)
+
+
+def _load_pandas(path, name, max_categories):
+    import pandas as pd
+
+    if name.endswith(('.parquet', '.pq')):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path)
+    return from_frame(df, max_categories)
+
+
+def from_frame(df, max_categories=MAX_CATEGORIES):
+    """
+    Portfolio of a results DataFrame already in memory, e.g. from batch.score_chunk
+    """
+    import pandas as pd
+
+    numbers, codes, labels = {}, {}, {}
+    for column in df.columns:
+        col = df[column]
+        if pd.api.types.is_numeric_dtype(col) and not pd.api.types.is_bool_dtype(col):
+            numbers[column] = col.to_numpy(dtype=np.float64)
+            continue
+        idx, uniques = pd.factorize(col.astype(str).where(col.notna(), ''))
+        if len(uniques) <= max_categories:
+            codes[column], labels[column] = idx.astype(np.int32), tuple(uniques)
+    return Portfolio(numbers, codes, labels)
+
+
+def example_results(n=100000, seed=0):
+    """
+    DataFrame of batch results for n made-up households in the Canadian regions, with region
+    and elec_tariff columns, for benchmarks and trying out the portfolio mode
+    """
+    import pandas as pd
+    from batch import input_columns
+    from engine import calculate, to_columns
+    from regions import REGIONS
+
+    rng = np.random.default_rng(seed)
+    region = rng.choice([r for r in REGIONS if r != 'UK'], n)
+    households = pd.DataFrame({'region': region,
+                               'elec_tariff': np.where((region == 'Ontario') & (rng.random(n) < 0.3), 'Ontario ULO', ''),
+                               'gas_total_kWh': rng.lognormal(np.log(15000), 0.35, n),
+                               'elec_total_kWh': rng.lognormal(np.log(3500), 0.3, n),
+                               'hw_lday': rng.uniform(50, 400, n),
+                               'efficiency_boost': rng.choice([0.0, 0.05, 0.15], n)})
+    results = pd.DataFrame(to_columns(calculate(**input_columns(households))))
+    return pd.concat([households[['region', 'elec_tariff']], results], axis=1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Summarise a batch results file by group.')
+    parser.add_argument('results', help='CSV or Parquet file written by batch.py')
+    parser.add_argument('--by', help='text column to group households by')
+    parser.add_argument('--metric', choices=sorted(METRICS), default='cost_saving')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    portfolio = load(args.results)
+    print(f'{portfolio.n:,} households loaded in {time.perf_counter() - start:.2f} s, '
+          f'groups: {", ".join(portfolio.groups) or "none"}')
+    start = time.perf_counter()
+    df = quantile_frame(portfolio, args.metric, portfolio.cases(args.metric), args.by)
+    print(f'{METRICS[args.metric]} in {time.perf_counter() - start:.3f} s')
+    print(df.to_string(index=False, float_format=lambda v: f'{v:,.0f}'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Static reference tables shown in the sidebar and Further Information tab.  They are
+# prebuilt into reference_tables.json as ready-to-render Markdown, so drawing them needs
+# neither pandas nor pyarrow.  Rebuild the file after changing a table:
+#
+#   python reference_tables.py
+
+import json
+import os
+from functools import lru_cache
+
+from defaults import GAS_kgCO2perkWh, ELEC_AVE_kgCO2perkWh, ELEC_RENEW_kgCO2perkWh
+
+PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reference_tables.json')
+
+#name: (column headings, rows, value format)
+TABLES = {
+    'household_totals': (['House size', 'Electricity (kWh)', 'Gas (kWh)'],
+                         [['1', 2100, 7000], ['2', 2750, 9500], ['3', 3000, 12000],
+                          ['4', 3500, 15000], ['5', 4300, 17000]], '{:,d}'),
+    'hot_water': (['Use', 'Hot water used (L)'],
+                  [['Washing up', 15], ['5 min water-saving shower', 30], ['10 min power shower', 150], ['Bath', 100]],
+                  '{:d}'),
+    'cooking': (['Use', 'Gas consumption per use (kWh)'],
+                [['Gas hob', 0.8], ['Gas grill', 1], ['Gas oven', 1.5]], '{:.1f}'),
+    'carbon_intensity': (['Energy Source', 'CO2 Equivalent Emissions (kgCO2/kWh)'],
+                         [['Mains Gas', GAS_kgCO2perkWh], ['Electricity (grid average)', ELEC_AVE_kgCO2perkWh],
+                          ['Electricity (renewable only)', ELEC_RENEW_kgCO2perkWh]], '{:.3f}'),
+}
+
+
+def to_markdown(columns, rows, fmt):
+    """
+    Markdown table, first column as row labels and the others right-aligned
+    """
+    lines = ['| ' + ' | '.join(columns) + ' |',
+             '|:--' + '|--:' * (len(columns) - 1) + '|']
+    for label, *values in rows:
+        lines.append('| ' + ' | '.join([str(label)] + [fmt.format(v) for v in values]) + ' |')
+    return '\n'.join(lines)
+
+
+def build():
+    return {name: to_markdown(*table) for name, table in TABLES.items()}
+
+
+@lru_cache(maxsize=None)
+def load(path=PATH):
+    """
+    dict of table name -> Markdown, from the prebuilt file (built here if it is missing)
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return build()
+
+
+if __name__ == '__main__':
+    with open(PATH, 'w') as f:
+        json.dump(build(), f, indent=1)
+    print(f'wrote {PATH}')
@@ -0,0 +1,151 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# The regional reference data (regions.py) compiled into fixed-width record arrays, so a
+# batch of households in mixed regions gets its prices, gas units and carbon intensities
+# by array lookups rather than a Python branch per row.  One record per region and
+# utility, and a sorted table of postal code prefixes pointing at the records.
+#
+# The arrays are saved as .npy files next to this module and memory-mapped when loaded,
+# so worker processes share one copy.  Rebuild them after changing regions.py:
+#
+#   python region_store.py
+
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from regions import GAS_UNITS, POSTAL_PREFIXES, REGIONS
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RECORDS_PATH = os.path.join(HERE, 'region_store.npy')
+PREFIXES_PATH = os.path.join(HERE, 'region_prefixes.npy')
+
+FIELDS = ('gas_kWh_per_unit', 'gas_typical', 'gas_stand', 'gas_unit', 'elec_stand', 'elec_unit',
+          'gas_kgCO2perkWh', 'elec_kgCO2perkWh')
+#fields that are engine inputs (see defaults.INPUT_DEFAULTS)
+ENGINE_INPUTS = FIELDS[2:]
+
+RECORD = np.dtype([('region', 'U16'), ('utility', 'U24'), ('gas_units', 'U4'), ('region_code', 'u2')]
+                  + [(name, 'f8') for name in FIELDS])
+PREFIX = np.dtype([('prefix', 'U3'), ('row', 'u2')])
+
+
+def build():
+    """
+    (records, prefixes) arrays from regions.py; record 0 is the first region's default utility,
+    used for households with no region or postal code
+    """
+    records = []
+    for code, (region, utilities) in enumerate(REGIONS.items()):
+        for name, spec in utilities.items():
+            values = [GAS_UNITS[spec['gas_units']]] + [spec[field] for field in FIELDS[1:]]
+            records.append((region, name, spec['gas_units'], code, *values))
+    records = np.array(records, dtype=RECORD)
+
+    prefixes = []
+    for prefix, target in POSTAL_PREFIXES.items():
+        region, name = (target, None) if isinstance(target, str) else target
+        prefixes.append((prefix.upper(), _record(records, region, name)))
+    prefixes = np.sort(np.array(prefixes, dtype=PREFIX), order='prefix')
+    return records, prefixes
+
+
+def _record(records, region, name=None):
+    match = records['region'] == region
+    if name is not None:
+        match &= records['utility'] == name
+    if not match.any():
+        raise ValueError(f'Unknown region/utility {region!r}/{name!r}, choose from: '
+                         + ', '.join(sorted(set(records['region']))))
+    return int(np.argmax(match))
+
+
+def compile_store(records_path=RECORDS_PATH, prefixes_path=PREFIXES_PATH):
+    records, prefixes = build()
+    np.save(records_path, records)
+    np.save(prefixes_path, prefixes)
+
+
+@lru_cache(maxsize=None)
+def load(records_path=RECORDS_PATH, prefixes_path=PREFIXES_PATH):
+    """
+    (records, prefixes), memory-mapped from the compiled files (built here if they are missing)
+    """
+    try:
+        return np.load(records_path, mmap_mode='r'), np.load(prefixes_path, mmap_mode='r')
+    except FileNotFoundError:
+        return build()
+
+
+def rows(region=None, utility=None, postal_code=None, n=None):
+    """
+    Record index of each household.  Each argument is a scalar or 1-d array, '' where unknown:
+    the postal code is looked up first (longest matching prefix), then an entered region
+    overrides it, then an entered utility picks one of the region's utilities.
+    returns (n,) int array
+    """
+    records, prefixes = load()
+    given = [np.atleast_1d(np.asarray(a, dtype=str)) for a in (region, utility, postal_code) if a is not None]
+    if n is None:
+        n = max([len(a) for a in given], default=1)
+    out = np.zeros(n, dtype=np.intp)
+
+    if postal_code is not None:
+        #upper case on the UTF-32 code points of the first 3 characters - np.char.upper calls
+        #str.upper once per household
+        codes = np.ascontiguousarray(np.broadcast_to(np.asarray(postal_code, dtype=str), n).astype('U3'))
+        chars = codes.view(np.uint32)
+        codes = np.where((chars >= 97) & (chars <= 122), chars - 32, chars).astype(np.uint32).view('U3')
+        lengths = np.char.str_len(prefixes['prefix'])
+        for length in range(1, 4):
+            table = prefixes[lengths == length]
+            if not len(table):
+                continue
+            keys = codes.astype(f'U{length}')
+            pos = np.minimum(np.searchsorted(table['prefix'], keys), len(table) - 1)
+            hit = table['prefix'][pos] == keys
+            out[hit] = table['row'][pos[hit]]
+
+    #a few comparisons against the known names are much cheaper than sorting a large batch's names
+    if region is not None:
+        names = np.broadcast_to(np.asarray(region, dtype=str), n)
+        matched = names == ''
+        region_codes = records['region_code'][out]
+        for code in np.unique(records['region_code']):
+            row = int(np.argmax(records['region_code'] == code))
+            is_region = names == records['region'][row]
+            #keep a utility found from the postal code if it is in the entered region
+            out[is_region & (region_codes != code)] = row
+            matched |= is_region
+        if not matched.all():
+            _record(records, names[np.argmin(matched)])
+
+    if utility is not None:
+        names = np.broadcast_to(np.asarray(utility, dtype=str), n)
+        matched = names == ''
+        region_codes = records['region_code'][out]
+        for row, record in enumerate(records):
+            is_utility = (names == record['utility']) & (region_codes == record['region_code'])
+            out[is_utility] = row
+            matched |= is_utility
+        if not matched.all():
+            i = np.argmin(matched)
+            _record(records, records['region'][out[i]], names[i])
+    return out
+
+
+def lookup(region=None, utility=None, postal_code=None, n=None):
+    """
+    dict of FIELDS -> (n,) arrays for each household, plus the region and gas billing units
+    """
+    records = load()[0]
+    idx = rows(region, utility, postal_code, n)
+    out = {name: records[name][idx] for name in FIELDS}
+    out['region'] = records['region'][idx]
+    out['gas_units'] = records['gas_units'][idx]
+    return out
+
+
+if __name__ == '__main__':
+    compile_store()
+    print(f'wrote {RECORDS_PATH} and {PREFIXES_PATH}')
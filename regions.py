@@ -0,0 +1,80 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Regional reference data: the unit gas is billed in, typical energy prices and the
+# carbon intensity of gas and grid electricity for each region and its utilities.
+# Plain Python only, so the form can use it before numpy is imported; region_store.py
+# compiles it into the indexed lookup table used for batch runs.
+#
+# Prices are in the local currency's minor unit (p or cents) per kWh and per day, as for
+# the engine.  Carbon intensities are kgCO2e/kWh: gas is combustion only, electricity the
+# annual average of the provincial grid (Canada National Inventory Report 2023).
+
+#kWh per billing unit of natural gas
+GAS_UNITS = {'kWh': 1.0, 'm^3': 10.55, 'GJ': 277.78}
+
+#region: utilities, the first being the region's default.  Each utility gives
+#   gas_units - key of GAS_UNITS the gas bill is in, gas_typical - typical annual use in those units
+#   gas_stand, gas_unit, elec_stand, elec_unit - standing (per day) and unit (per kWh) charges
+#   gas_kgCO2perkWh, elec_kgCO2perkWh - carbon intensities
+#   currency, minor_unit - symbol of the currency the prices are in and the name of its minor unit
+REGIONS = {
+    #the app's original figures: October 2022 price cap and SAP 10.2 carbon intensities
+    'UK': {
+        'Price cap': {'gas_units': 'kWh', 'gas_typical': 12000, 'gas_stand': 28.0, 'gas_unit': 10.3,
+                      'elec_stand': 46.0, 'elec_unit': 34.0, 'gas_kgCO2perkWh': 0.21, 'elec_kgCO2perkWh': 0.136,
+                      'currency': '£', 'minor_unit': 'p'},
+    },
+    'Ontario': {
+        'Enbridge Gas': {'gas_units': 'm^3', 'gas_typical': 2400, 'gas_stand': 82.0, 'gas_unit': 4.3,
+                         'elec_stand': 100.0, 'elec_unit': 13.0, 'gas_kgCO2perkWh': 0.179, 'elec_kgCO2perkWh': 0.03,
+                         'currency': '$', 'minor_unit': 'cents'},
+        'EPCOR Southern Bruce': {'gas_units': 'm^3', 'gas_typical': 2400, 'gas_stand': 90.0, 'gas_unit': 5.1,
+                                 'elec_stand': 100.0, 'elec_unit': 13.0, 'gas_kgCO2perkWh': 0.179, 'elec_kgCO2perkWh': 0.03,
+                                 'currency': '$', 'minor_unit': 'cents'},
+    },
+    'BC': {
+        'FortisBC': {'gas_units': 'GJ', 'gas_typical': 90, 'gas_stand': 46.0, 'gas_unit': 5.0,
+                     'elec_stand': 21.0, 'elec_unit': 10.5, 'gas_kgCO2perkWh': 0.179, 'elec_kgCO2perkWh': 0.011,
+                     'currency': '$', 'minor_unit': 'cents'},
+        'Pacific Northern Gas': {'gas_units': 'GJ', 'gas_typical': 110, 'gas_stand': 38.0, 'gas_unit': 7.2,
+                                 'elec_stand': 21.0, 'elec_unit': 10.5, 'gas_kgCO2perkWh': 0.179, 'elec_kgCO2perkWh': 0.011,
+                                 'currency': '$', 'minor_unit': 'cents'},
+    },
+    'Alberta': {
+        'ATCO Gas': {'gas_units': 'GJ', 'gas_typical': 120, 'gas_stand': 95.0, 'gas_unit': 3.2,
+                     'elec_stand': 120.0, 'elec_unit': 17.0, 'gas_kgCO2perkWh': 0.179, 'elec_kgCO2perkWh': 0.54,
+                     'currency': '$', 'minor_unit': 'cents'},
+    },
+    'Quebec': {
+        'Energir': {'gas_units': 'm^3', 'gas_typical': 2000, 'gas_stand': 60.0, 'gas_unit': 5.5,
+                    'elec_stand': 42.0, 'elec_unit': 7.6, 'gas_kgCO2perkWh': 0.179, 'elec_kgCO2perkWh': 0.0017,
+                    'currency': '$', 'minor_unit': 'cents'},
+    },
+}
+
+#postal code prefix: region or (region, utility).  Canadian postal codes start with a letter
+#for the province; longer prefixes (forward sortation areas) pick out utility service areas
+POSTAL_PREFIXES = {
+    'K': 'Ontario', 'L': 'Ontario', 'M': 'Ontario', 'N': 'Ontario', 'P': 'Ontario',
+    'V': 'BC', 'T': 'Alberta', 'G': 'Quebec', 'H': 'Quebec', 'J': 'Quebec',
+    'N0G': ('Ontario', 'EPCOR Southern Bruce'), 'N0H': ('Ontario', 'EPCOR Southern Bruce'),
+    'V0J': ('BC', 'Pacific Northern Gas'), 'V8G': ('BC', 'Pacific Northern Gas'),
+    'V8J': ('BC', 'Pacific Northern Gas'),
+}
+
+
+def utility(region, name=None):
+    """
+    reference data of a region's utility, its default utility if name is not given
+    """
+    if region not in REGIONS:
+        raise ValueError(f'Unknown region {region!r}, choose from: ' + ', '.join(REGIONS))
+    utilities = REGIONS[region]
+    if name is None:
+        return next(iter(utilities.values()))
+    if name not in utilities:
+        raise ValueError(f'Unknown utility {name!r} in {region}, choose from: ' + ', '.join(utilities))
+    return utilities[name]
+
+
+def gas_kWh_per_unit(region, name=None):
+    return GAS_UNITS[utility(region, name)['gas_units']]
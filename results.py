@@ -0,0 +1,107 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Compact columnar form of the engine's per-case breakdowns (energy, emissions and costs
+# of heating, hot water etc. for each case).  Every household has the same rows - each
+# case by each breakdown label - so only the values are stored, one float64 array of
+# shape (households, cases, breakdowns) per value column.  Case and breakdown are
+# categorical: small integer codes into CASES and the breakdown labels, made when the
+# table is exported.  Exporting to Arrow hands over the value arrays without copying.
+
+import numpy as np
+
+from defaults import CASES
+
+
+class ResultTable:
+    """
+    Long-format breakdown results: one row per household, case and breakdown label.
+    values - dict of value name -> (n_households, n_cases, n_breakdown) float64 array
+    cases, breakdown - labels of the case and breakdown axes
+    """
+    __slots__ = ('values', 'cases', 'breakdown')
+
+    def __init__(self, values, cases, breakdown):
+        self.values = {name: np.ascontiguousarray(v, dtype=np.float64) for name, v in values.items()}
+        self.cases = tuple(cases)
+        self.breakdown = tuple(breakdown)
+        for name, v in self.values.items():
+            if v.shape[1:] != (len(self.cases), len(self.breakdown)):
+                raise ValueError(f'{name} has shape {v.shape}, expected (n, {len(self.cases)}, {len(self.breakdown)})')
+
+    @classmethod
+    def from_results(cls, results, keys, breakdown, value_names=None, skip=()):
+        """
+        results - calculate() output
+        keys - result entries to take values from, e.g. ['energy', 'emissions']
+        breakdown - labels of those entries' columns, e.g. ENERGY_BREAKDOWN
+        value_names - column names of the values in the table, default the keys
+        skip - breakdown labels to leave out
+        """
+        cases = [case_name for case_name in CASES if case_name in results]
+        keep = [j for j, label in enumerate(breakdown) if label not in skip]
+        values = {}
+        for key, name in zip(keys, value_names or keys):
+            #(n, n_cases, n_breakdown) in one allocation, rather than a stack then a column selection
+            out = np.empty((len(results[cases[0]][key]), len(cases), len(keep)))
+            for c, case_name in enumerate(cases):
+                out[:, c, :] = results[case_name][key][:, keep]
+            values[name] = out
+        return cls(values, cases, [breakdown[j] for j in keep])
+
+    @property
+    def n_households(self):
+        return len(next(iter(self.values.values()))) if self.values else 0
+
+    def __len__(self):
+        return self.n_households * len(self.cases) * len(self.breakdown)
+
+    @property
+    def nbytes(self):
+        return sum(v.nbytes for v in self.values.values())
+
+    def household(self, i):
+        """
+        table of household i alone, sharing this table's memory
+        """
+        return ResultTable({name: v[i:i+1] for name, v in self.values.items()}, self.cases, self.breakdown)
+
+    def column(self, name):
+        """
+        1-d view of a value column in row order
+        """
+        return self.values[name].reshape(-1)
+
+    def codes(self):
+        """
+        (household index, case code, breakdown code) of every row
+        """
+        n, n_cases, n_breakdown = self.n_households, len(self.cases), len(self.breakdown)
+        per_household = n_cases * n_breakdown
+        household = np.repeat(np.arange(n, dtype=np.uint32), per_household)
+        case = np.tile(np.repeat(np.arange(n_cases, dtype=np.uint8), n_breakdown), n)
+        breakdown = np.tile(np.arange(n_breakdown, dtype=np.uint8), n * n_cases)
+        return household, case, breakdown
+
+    def to_arrow(self, household=None):
+        """
+        pyarrow Table with dictionary-encoded Case and Breakdown columns and the value columns,
+        which share memory with this table
+        household - column name for the household index, default no such column
+        """
+        import pyarrow as pa  # only needed for export
+
+        index, case, breakdown = self.codes()
+        columns = {}
+        if household:
+            columns[household] = pa.array(index)
+        columns['Case'] = pa.DictionaryArray.from_arrays(case, pa.array(self.cases))
+        columns['Breakdown'] = pa.DictionaryArray.from_arrays(breakdown, pa.array(self.breakdown))
+        for name in self.values:
+            columns[name] = pa.array(self.column(name))
+        return pa.table(columns)
+
+    def to_pandas(self, household=None):
+        """
+        DataFrame with categorical Case and Breakdown columns; the value columns are
+        read-only views of this table's memory
+        """
+        return self.to_arrow(household).to_pandas(split_blocks=True)
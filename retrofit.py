@@ -0,0 +1,394 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Retrofit package search: the cheapest combinations of efficiency measures, heat pump
+# install type and tariff that meet an annual running cost and/or emissions target.
+#
+# Savings of combined measures add up (as in the app), and the engine's emissions and its
+# costs other than the block charges of tiered tariffs are linear in efficiency_boost, so
+# evaluating each install type and tariff at a saving of 0 and 1 gives them for every
+# package exactly.  Monthly use is linear too, so block charges are exact on a curve with a
+# point wherever a month crosses a block threshold.  Each target then sets the smallest
+# combined saving a household needs, and the search is for the cheapest subsets of
+# measures whose savings reach it.  Up to ENUMERATE_LIMIT measures every subset is
+# enumerated as a bit matrix; larger catalogs use branch and bound.
+#
+# Each household is offered its own tariff and the others open to it: off-peak or not for a
+# flat rate in the UK, and the other named tariffs of its region.
+#
+#   python retrofit.py households.csv packages.csv --max-emissions 1500 --top 3
+
+import argparse
+import heapq
+import time
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+import tariffs
+from defaults import MEASURES
+from engine import (INSTALL_TYPES, do_current_case, heat_pump_costs, heat_pump_emissions, heat_pump_energy,
+                    prepare_inputs, split_demand)
+
+
+#typical installed cost of the heat pump system (£)
+HP_INSTALL_COST = {'Typical': 10000, 'Hi-performance': 14000}
+
+#labels of a flat rate and an entered two tier tariff (is_two_tier_tariff)
+STANDARD = 'Standard'
+OFF_PEAK = 'Off-peak'
+
+#above this many measures, branch and bound instead of enumerating all subsets
+ENUMERATE_LIMIT = 16
+#combined savings are capped here
+MAX_COMBINED_SAVING = 0.9
+#branch and bound shares searches between households whose required savings round to the same step
+SAVING_STEP = 1e-4
+
+
+def subset_table(savings, costs):
+    """
+    Every subset of the measures as a bitmask, with its combined saving and cost,
+    sorted by cost (cheapest first).
+    """
+    n = len(savings)
+    masks = np.arange(2**n, dtype=np.int64)
+    bits = (masks[:, None] >> np.arange(n)) & 1
+    subset_savings = np.minimum(bits @ np.asarray(savings, dtype=float), MAX_COMBINED_SAVING)
+    subset_costs = bits @ np.asarray(costs, dtype=float)
+    order = np.lexsort((-subset_savings, subset_costs))
+    return masks[order], subset_savings[order], subset_costs[order]
+
+
+@lru_cache(maxsize=4096)
+def _branch_and_bound(savings, costs, required, k):
+    """
+    k cheapest subsets with combined saving >= required, as a sorted list of (cost, mask).
+    savings, costs - tuples of the measure catalog; results are cached per required saving.
+    """
+    #most saving per £ first, so the fractional bound is tight and good packages come early
+    order = sorted(range(len(savings)), key=lambda i: costs[i] / max(savings[i], 1e-12))
+    sav = [savings[i] for i in order]
+    cst = [costs[i] for i in order]
+    n = len(order)
+
+    def bound(i, need):
+        #cheapest cost to cover need from items i.. if they could be taken fractionally
+        extra = 0.0
+        for j in range(i, n):
+            if need <= 1e-12:
+                break
+            take = min(1.0, need / sav[j]) if sav[j] > 0 else 0.0
+            extra += take * cst[j]
+            need -= take * sav[j]
+        return extra if need <= 1e-12 else np.inf
+
+    best = []  #max-heap of (-cost, mask) holding the k cheapest found
+    #a node is a subset whose items all come before i; its children add one item from i on
+    stack = [(0, 0.0, 0.0, 0)]
+    while stack:
+        i, saved, cost, mask = stack.pop()
+        kth = -best[0][0] if len(best) == k else np.inf
+        if cost + bound(i, required - saved) >= kth:
+            continue
+        if saved >= required - 1e-12:
+            heapq.heappush(best, (-cost, mask))
+            if len(best) > k:
+                heapq.heappop(best)
+        for j in range(n - 1, i - 1, -1):
+            stack.append((j + 1, min(saved + sav[j], MAX_COMBINED_SAVING), cost + cst[j], mask | (1 << order[j])))
+    return sorted((-c, m) for c, m in best)
+
+
+def _search_each(required, savings, costs, k):
+    """
+    branch and bound for large catalogs, shared between households needing the same saving
+    returns (n, k) arrays as _enumerated
+    """
+    n = len(required)
+    out_mask = np.zeros((n, k), dtype=object)
+    out_sav = np.zeros((n, k))
+    out_cost = np.full((n, k), np.inf)
+    #round requirements up to SAVING_STEP so households with practically the same need share
+    #a search; rounding up means the targets are always met
+    keys = np.ceil(np.minimum(required, 10.0) / SAVING_STEP - 1e-9) * SAVING_STEP
+    for key in np.unique(keys):
+        if key > MAX_COMBINED_SAVING:
+            continue
+        rows = np.nonzero(keys == key)[0]
+        for j, (cost, mask) in enumerate(_branch_and_bound(savings, costs, float(key), k)):
+            out_mask[rows, j] = mask
+            out_sav[rows, j] = min(sum(s for i, s in enumerate(savings) if mask >> i & 1), MAX_COMBINED_SAVING)
+            out_cost[rows, j] = cost
+    return out_mask, out_sav, out_cost
+
+
+def _enumerated(required, table, k):
+    """
+    required - (n,) combined saving each household needs (inf where unreachable)
+    table - from subset_table
+    returns (n, k) arrays of mask, saving and measures cost, with cost inf where fewer than k exist
+    """
+    masks, savings, costs = table
+    n = len(required)
+    out_mask = np.zeros((n, k), dtype=np.int64)
+    out_sav = np.zeros((n, k))
+    out_cost = np.full((n, k), np.inf)
+    #subsets are cost ordered, so the first k feasible ones are the cheapest
+    feasible = savings[None, :] >= required[:, None] - 1e-12
+    rank = np.cumsum(feasible, axis=1)
+    rows, cols = np.nonzero(feasible & (rank <= k))
+    slot = rank[rows, cols] - 1
+    out_mask[rows, slot] = masks[cols]
+    out_sav[rows, slot] = savings[cols]
+    out_cost[rows, slot] = costs[cols]
+    return out_mask, out_sav, out_cost
+
+
+def tariff_options(inp, region=None):
+    """
+    inp - dict from engine.prepare_inputs
+    region - region the prices are in, scalar or per household; by default grid_region, or the UK
+             if not given, and a named tariff's region always
+    returns list of (label per household, households offered, engine inputs that select the tariff),
+            the households' own tariffs first
+    """
+    named = inp['elec_tariff'] != ''
+    own = np.where(named, inp['elec_tariff'], np.where(inp['is_two_tier_tariff'], OFF_PEAK, STANDARD)).astype(object)
+    everyone = np.arange(len(own))
+    options = [(own, everyone, {})]
+
+    if region is None:
+        region = np.where(inp['grid_region'] == '', tariffs.TWO_TIER_REGION, inp['grid_region'])
+    region = np.broadcast_to(np.asarray(region, dtype=str), own.shape)
+    for name in np.unique(inp['elec_tariff'][named]):
+        region = np.where(inp['elec_tariff'] == name, tariffs.TARIFFS[name]['region'], region)
+    flat_uk = ~named & (region == tariffs.TWO_TIER_REGION)
+    for label, is_two_tier in ((OFF_PEAK, True), (STANDARD, False)):
+        idx = np.nonzero(flat_uk & (inp['is_two_tier_tariff'] != is_two_tier))[0]
+        options.append((np.full(len(own), label, dtype=object), idx, {'is_two_tier_tariff': is_two_tier}))
+    for name, spec in tariffs.TARIFFS.items():
+        idx = np.nonzero((region == spec['region']) & (inp['elec_tariff'] != name))[0]
+        options.append((np.full(len(own), name, dtype=object), idx, {'elec_tariff': name}))
+    return [option for option in options if len(option[1])]
+
+
+def _block_curves(inp, use, n):
+    """
+    Annual block charges of tiered tariffs against the combined saving, for households on them.
+    inp - prepared inputs of the households at a saving of 0 then 1, use - heat_pump_energy of them
+    returns (idx, savings, excess): the households, and per household the savings at which a month
+            crosses a block threshold (with 0 and 1) and the block charges (£) less their straight
+            line between 0 and 1 at those savings; None if no household is on a tiered tariff
+    """
+    names = inp['elec_tariff'][:n]
+    blocky = np.zeros(n, dtype=bool)
+    for name in np.unique(names[names != '']):
+        if tariffs.compile_tariff(name)['increments'].any():
+            blocky |= names == name
+    if not blocky.any():
+        return None
+    idx = np.nonzero(blocky)[0]
+    rows = np.concatenate([idx, idx + n])
+    monthly = tariffs.monthly_use(inp['elec_tariff'][rows], *(use[key][rows] for key in (
+        'elec_heat_kWh', 'elec_hw_kWh', 'elec_cook_kWh', 'elec_other_kWh')), inp['is_free_summer_hw'][rows])
+    m0, m1 = monthly[:len(idx)], monthly[len(idx):]
+
+    savings = np.zeros((len(idx), 2))
+    savings[:, 1] = 1.0
+    for name in np.unique(names[idx]):
+        at = np.nonzero(names[idx] == name)[0]
+        thresholds = tariffs.compile_tariff(name)['thresholds']
+        drop = (m0[at] - m1[at])[:, :, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cross = (m0[at][:, :, None] - thresholds) / drop
+        cross = np.where(np.isfinite(cross) & (cross > 0) & (cross < 1), cross, 1.0).reshape(len(at), -1)
+        #the same number of points for every household of the tariff; extra points at 1 are harmless
+        if cross.shape[1] + 2 > savings.shape[1]:
+            savings = np.pad(savings, ((0, 0), (0, cross.shape[1] + 2 - savings.shape[1])), constant_values=1.0)
+        savings[at, 2:2 + cross.shape[1]] = cross
+    savings.sort(axis=1)
+
+    excess = np.zeros_like(savings)
+    for name in np.unique(names[idx]):
+        at = np.nonzero(names[idx] == name)[0]
+        tariff = tariffs.compile_tariff(name)
+        s = savings[at][:, :, None]
+        charges = tariffs.block_charges(m0[at][:, None, :] + (m1[at] - m0[at])[:, None, :] * s, tariff) / 100
+        excess[at] = charges - (charges[:, :1] + (charges[:, -1:] - charges[:, :1]) * savings[at])
+    return idx, savings, excess
+
+
+def _linear_need(m0, m1, target):
+    """
+    smallest saving at which a metric going from m0 to m1 as the saving goes from 0 to 1 meets target
+    """
+    slope = m0 - m1
+    need = np.where(slope > 0, (m0 - target) / np.where(slope > 0, slope, 1), np.where(m0 <= target, 0, np.inf))
+    return np.maximum(need, 0)
+
+
+def _curve_at(savings, values, x):
+    """
+    piecewise linear curves through (savings, values) per row, at x (rows, k)
+    """
+    j = np.clip((savings[:, None, :] < x[:, :, None]).sum(axis=2), 1, savings.shape[1] - 1)
+    s0, s1 = np.take_along_axis(savings, j - 1, axis=1), np.take_along_axis(savings, j, axis=1)
+    v0, v1 = np.take_along_axis(values, j - 1, axis=1), np.take_along_axis(values, j, axis=1)
+    width = s1 - s0
+    return v0 + (v1 - v0) * np.where(width > 0, (x - s0) / np.where(width > 0, width, 1), 0)
+
+
+def _curve_reaches(savings, values, target):
+    """
+    smallest saving at which piecewise linear curves through (savings, values) fall to target, inf if none
+    """
+    below = values <= target
+    j = np.argmax(below, axis=1)
+    rows = np.arange(len(j))
+    prev = np.maximum(j - 1, 0)
+    v0, v1 = values[rows, prev], values[rows, j]
+    s0, s1 = savings[rows, prev], savings[rows, j]
+    drop = v0 - v1
+    at = s0 + (s1 - s0) * np.where(drop > 0, (v0 - target) / np.where(drop > 0, drop, 1), 0)
+    return np.where(~below.any(axis=1), np.inf, np.where(j == 0, 0.0, at))
+
+
+def recommend(inputs, max_cost=None, max_emissions=None, top=3, measures=MEASURES,
+              hp_install_cost=HP_INSTALL_COST, region=None):
+    """
+    inputs - engine inputs, scalars or one array entry per household (efficiency_boost is ignored)
+    region - region the prices are in, for the tariffs offered (see tariff_options)
+    max_cost - annual running cost target, max_emissions - annual emissions target (kg CO2)
+    top - number of packages returned per household
+    returns DataFrame with up to `top` packages per household, cheapest capital cost first
+    """
+    labels = [m[0] for m in measures]
+    savings = np.array([m[1] for m in measures], dtype=float)
+    costs = np.array([m[2] for m in measures], dtype=float)
+    enumerate_all = len(measures) <= ENUMERATE_LIMIT
+    table = subset_table(savings, costs) if enumerate_all else None
+
+    base = prepare_inputs(**{k: v for k, v in inputs.items() if k != 'efficiency_boost'})
+    n = len(base['gas_total_kWh'])
+    current_cost = None
+    own_results = {}
+
+    candidates = []
+    for option, (tariff, offered, tariff_inputs) in enumerate(tariff_options(base, region)):
+        #the households offered the tariff at a combined saving of 0 and 1, all cases in one engine pass
+        m = len(offered)
+        rows = {k: np.tile(v[offered], 2) for k, v in base.items()}
+        rows.update({k: np.full(2*m, v) for k, v in tariff_inputs.items()})
+        rows['efficiency_boost'] = np.repeat([0.0, 1.0], m)
+        inp = prepare_inputs(**rows)
+        split = split_demand(inp)
+        if current_cost is None:
+            current_cost = do_current_case(inp, split)['costs_total'][:n]
+
+        for install_type in INSTALL_TYPES:
+            use = heat_pump_energy(install_type, inp, split)
+            cost_total = heat_pump_costs(inp, use)['costs_total']
+            emissions_total = heat_pump_emissions(inp, use)['emissions_total']
+            c0, c1, e0, e1 = (np.zeros(n) for _ in range(4))
+            c0[offered], c1[offered] = cost_total[:m], cost_total[m:]
+            e0[offered], e1[offered] = emissions_total[:m], emissions_total[m:]
+            #an alternative scoring the same as the household's own tariff is left out
+            available = np.zeros(n, dtype=bool)
+            available[offered] = True
+            if option == 0:
+                own_results[install_type] = (c0, c1, e0, e1)
+            else:
+                same = np.ones(n, dtype=bool)
+                for a, b in zip((c0, c1, e0, e1), own_results[install_type]):
+                    same &= np.isclose(a, b, rtol=1e-9, atol=1e-9)
+                available &= ~same
+
+            required = np.zeros(n)
+            for target, m0, m1 in ((max_cost, c0, c1), (max_emissions, e0, e1)):
+                if target is not None:
+                    required = np.maximum(required, _linear_need(m0, m1, target))
+            curves = _block_curves(inp, use, m)
+            if curves is not None:
+                idx, curve_savings, excess = curves
+                hh = offered[idx]
+                cost_curve = c0[hh, None] + (c1 - c0)[hh, None] * curve_savings + excess
+                if max_cost is not None:
+                    need = np.zeros(len(hh)) if max_emissions is None else _linear_need(e0[hh], e1[hh], max_emissions)
+                    required[hh] = np.maximum(need, _curve_reaches(curve_savings, cost_curve, max_cost))
+            required = np.where(available, required, np.inf)
+
+            if enumerate_all:
+                mask, sav, cost = _enumerated(required, table, top)
+            else:
+                mask, sav, cost = _search_each(required, tuple(savings), tuple(costs), top)
+            cost = cost + hp_install_cost[install_type]
+            annual_cost = c0[:, None] + (c1 - c0)[:, None] * sav
+            if curves is not None:
+                annual_cost[hh] = _curve_at(curve_savings, cost_curve, sav[hh])
+            annual_emissions = e0[:, None] + (e1 - e0)[:, None] * sav
+            candidates.append((cost, mask, sav, annual_cost, annual_emissions,
+                               np.broadcast_to(np.full(n, install_type, dtype=object)[:, None], cost.shape),
+                               np.broadcast_to(tariff[:, None], cost.shape)))
+
+    #pick the overall top packages per household across install types and tariffs
+    total_cost = np.concatenate([c[0] for c in candidates], axis=1)
+    annual = np.concatenate([c[3] for c in candidates], axis=1)
+    order = np.lexsort((annual, total_cost), axis=1)[:, :top]
+    pick = lambda j: np.take_along_axis(np.concatenate([c[j] for c in candidates], axis=1), order, axis=1)
+
+    capital, mask, sav = pick(0), pick(1), pick(2)
+    annual_cost, emissions = pick(3), pick(4)
+    install_types, tariff_names = pick(5), pick(6)
+    annual_saving = current_cost[:, None] - annual_cost
+    keep = np.isfinite(capital)
+    hh, rank = np.nonzero(keep)
+    sel = (hh, rank)
+    return pd.DataFrame({
+        'household': hh,
+        'rank': rank + 1,
+        'install_type': install_types[sel],
+        'tariff': tariff_names[sel],
+        'measures': [describe(int(m), labels) for m in mask[sel]],
+        'efficiency_saving': sav[sel],
+        'capital_cost': capital[sel],
+        'annual_cost': annual_cost[sel],
+        'annual_saving': annual_saving[sel],
+        'emissions': emissions[sel],
+        'payback_years': np.where(annual_saving[sel] > 0, capital[sel] / np.where(annual_saving[sel] > 0, annual_saving[sel], 1), np.inf),
+    })
+
+
+def describe(mask, labels):
+    """
+    measure labels of a subset bitmask
+    """
+    chosen = [label for i, label in enumerate(labels) if mask >> i & 1]
+    return '; '.join(chosen) if chosen else 'None'
+
+
+def main(argv=None):
+    from batch import ChunkWriter, input_columns, input_names, read_chunks
+
+    parser = argparse.ArgumentParser(description='Recommend retrofit packages for a file of households.')
+    parser.add_argument('input', help='CSV or Parquet file of households, columns named as engine inputs')
+    parser.add_argument('output', help='CSV or Parquet file for the packages')
+    parser.add_argument('--max-cost', type=float, help='annual running cost target (£)')
+    parser.add_argument('--max-emissions', type=float, help='annual emissions target (kg CO2)')
+    parser.add_argument('--top', type=int, default=3, help='packages per household (default %(default)s)')
+    parser.add_argument('--chunksize', type=int, default=50000)
+    args = parser.parse_args(argv)
+
+    rows = 0
+    start = time.perf_counter()
+    with ChunkWriter(args.output) as writer:
+        for df in read_chunks(args.input, args.chunksize, input_names()):
+            packages = recommend(input_columns(df), args.max_cost, args.max_emissions, args.top)
+            packages['household'] += rows
+            writer.write(packages)
+            rows += len(df)
+    elapsed = time.perf_counter() - start
+    print(f'{rows:,} households in {elapsed:.2f} s ({rows/max(elapsed, 1e-9):,.0f} households/s)')
+
+
+if __name__ == '__main__':
+    main()
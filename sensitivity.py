@@ -0,0 +1,177 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Parameter sweeps and sensitivity analysis around a household's (or a portfolio's) inputs.
+# Every variant of every household is stacked into the rows of one engine call, so a sweep
+# is a batched computation rather than one script rerun per point.  Large grids are cut into
+# blocks of at most MAX_ROWS rows and only the household-averaged metric is kept per point.
+#
+#   python sensitivity.py households.csv --x gas_unit 5 20 --y elec_unit 20 50 --steps 100 --output grid.csv
+#   python sensitivity.py households.csv --tornado --output tornado.csv
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from engine import INPUT_DEFAULTS, SUMMARY_METRICS, calculate, summary_metrics
+
+
+#parameters varied in the one-at-a-time analysis:
+#   name: (label, 'rel' to scale the household value or 'abs' to set it, low, high)
+PARAMETERS = {
+    'gas_unit': ('Gas unit cost', 'rel', 0.75, 1.25),
+    'elec_unit': ('Electricity unit cost', 'rel', 0.75, 1.25),
+    'hp_heat_scop_typ': ('Typical heat pump SCOP', 'rel', 0.8, 1.2),
+    'hp_heat_scop_hi': ('High-performance heat pump SCOP', 'rel', 0.8, 1.2),
+    'boiler_heat_eff': ('Boiler efficiency', 'rel', 0.9, 1.05),
+    'efficiency_boost': ('Efficiency measures saving', 'abs', 0.0, 0.3),
+    'pc_elec_second_tariff': ('Off-peak share of electricity use', 'abs', 0.0, 1.0),
+}
+
+#efficiencies can't go above 1
+UPPER_LIMITS = {'boiler_heat_eff': 1.0, 'boiler_hw_eff': 1.0}
+
+#rows per engine call - bounds memory for large grids
+MAX_ROWS = 500000
+
+
+def parameter_range(name, base):
+    """
+    low and high values of a PARAMETERS entry around the household value(s) base
+    """
+    label, kind, low, high = PARAMETERS[name]
+    if kind == 'rel':
+        low, high = base * low, base * high
+    else:
+        low, high = np.full_like(base, low, dtype=float), np.full_like(base, high, dtype=float)
+    limit = UPPER_LIMITS.get(name, np.inf)
+    return np.minimum(low, limit), np.minimum(high, limit)
+
+
+def _household_inputs(inputs):
+    """
+    inputs with defaults filled in, and the number of households
+    """
+    full = {name: inputs.get(name, default) for name, default in INPUT_DEFAULTS.items()}
+    n = max(np.size(v) for v in full.values())
+    return full, n
+
+
+def one_at_a_time(inputs, params=None, metric='cost_saving_typ'):
+    """
+    Move each parameter to its low and high value with the others held at the household's values.
+    inputs - engine inputs, scalars or one array entry per household
+    params - names from PARAMETERS, default all
+    metric - name from engine.SUMMARY_METRICS, averaged over households
+    returns DataFrame, one row per parameter sorted by swing, with the base, low and high
+    metric values and the (household average) parameter values used
+    """
+    params = list(params or PARAMETERS)
+    full, n = _household_inputs(inputs)
+    n_variants = 1 + 2*len(params)
+
+    #variant 0 is the base case, then low and high for each parameter in turn
+    batched = {}
+    for name in set(params) | {k for k, v in full.items() if np.size(v) > 1}:
+        batched[name] = np.tile(np.broadcast_to(full[name], n), n_variants)
+    ranges = {}
+    for i, name in enumerate(params):
+        base = np.broadcast_to(np.asarray(full[name], dtype=float), n)
+        low, high = ranges[name] = parameter_range(name, base)
+        batched[name] = batched[name].astype(float)
+        batched[name][(2*i + 1)*n:(2*i + 2)*n] = low
+        batched[name][(2*i + 2)*n:(2*i + 3)*n] = high
+    rows = {**{k: v for k, v in full.items() if k not in batched}, **batched}
+
+    values = summary_metrics(calculate(**rows))[metric].reshape(n_variants, n).mean(axis=1)
+    df = pd.DataFrame({'parameter': params,
+                       'label': [PARAMETERS[name][0] for name in params],
+                       'low_value': [ranges[name][0].mean() for name in params],
+                       'high_value': [ranges[name][1].mean() for name in params],
+                       'base': values[0],
+                       'metric_low': values[1::2],
+                       'metric_high': values[2::2]})
+    df['swing'] = (df['metric_high'] - df['metric_low']).abs()
+    return df.sort_values('swing', ascending=False, ignore_index=True)
+
+
+def factorial(inputs, axes, metric='cost_saving_typ', max_rows=MAX_ROWS):
+    """
+    Evaluate every combination of the axis values, averaging the metric over households.
+    inputs - engine inputs, scalars or one array entry per household
+    axes - dict of input name -> 1-d array of values to sweep, e.g. {'gas_unit': np.linspace(5, 20, 100)}
+    metric - name from engine.SUMMARY_METRICS
+    returns array of shape (len(values) for each axis), in the order of axes
+    """
+    full, n = _household_inputs(inputs)
+    names = list(axes)
+    grids = np.meshgrid(*[np.asarray(axes[name], dtype=float) for name in names], indexing='ij')
+    shape = grids[0].shape
+    points = [g.ravel() for g in grids]
+    n_points = points[0].size
+
+    household_cols = {k: np.broadcast_to(v, n) for k, v in full.items() if np.size(v) > 1 and k not in axes}
+    scalars = {k: v for k, v in full.items() if k not in household_cols and k not in axes}
+
+    #households vary fastest within a block: rows are (grid point, household)
+    hh_block = min(n, max_rows)
+    pt_block = max(1, max_rows // hh_block)
+    totals = np.zeros(n_points)
+    for h0 in range(0, n, hh_block):
+        h1 = min(h0 + hh_block, n)
+        for p0 in range(0, n_points, pt_block):
+            p1 = min(p0 + pt_block, n_points)
+            rows = dict(scalars)
+            rows.update({k: np.tile(v[h0:h1], p1 - p0) for k, v in household_cols.items()})
+            rows.update({name: np.repeat(pts[p0:p1], h1 - h0) for name, pts in zip(names, points)})
+            values = summary_metrics(calculate(**rows))[metric]
+            totals[p0:p1] += values.reshape(p1 - p0, h1 - h0).sum(axis=1)
+    return (totals / n).reshape(shape)
+
+
+def grid_frame(grid, x_name, x_values, y_name, y_values, metric):
+    """
+    long-form DataFrame of a 2-d factorial grid, for charts and CSV output
+    """
+    xx, yy = np.meshgrid(x_values, y_values)
+    return pd.DataFrame({x_name: xx.ravel(), y_name: yy.ravel(), metric: grid.T.ravel()})
+
+
+def main(argv=None):
+    from batch import input_columns, input_names, read_chunks
+
+    parser = argparse.ArgumentParser(description='Sensitivity analysis over a file of households.')
+    parser.add_argument('input', help='CSV or Parquet file of households, columns named as engine inputs')
+    parser.add_argument('--metric', choices=list(SUMMARY_METRICS), default='cost_saving_typ')
+    parser.add_argument('--x', nargs=3, metavar=('NAME', 'LOW', 'HIGH'), help='first grid axis')
+    parser.add_argument('--y', nargs=3, metavar=('NAME', 'LOW', 'HIGH'), help='second grid axis')
+    parser.add_argument('--steps', type=int, default=100, help='values per grid axis (default %(default)s)')
+    parser.add_argument('--tornado', action='store_true', help='one-at-a-time analysis instead of a grid')
+    parser.add_argument('--output', required=True, help='CSV file for the results')
+    args = parser.parse_args(argv)
+
+    frames = [pd.DataFrame(input_columns(df)) for df in read_chunks(args.input, columns=input_names())]
+    inputs = {k: v.to_numpy() for k, v in pd.concat(frames, ignore_index=True).items()}
+
+    start = time.perf_counter()
+    if args.tornado:
+        out = one_at_a_time(inputs, metric=args.metric)
+    else:
+        if not (args.x and args.y):
+            parser.error('--x and --y are needed for a grid')
+        (x_name, *x_range), (y_name, *y_range) = args.x, args.y
+        for name in (x_name, y_name):
+            if name not in INPUT_DEFAULTS:
+                parser.error(f'{name} is not an engine input')
+        x_values = np.linspace(*map(float, x_range), args.steps)
+        y_values = np.linspace(*map(float, y_range), args.steps)
+        grid = factorial(inputs, {x_name: x_values, y_name: y_values}, args.metric)
+        out = grid_frame(grid, x_name, x_values, y_name, y_values, args.metric)
+    elapsed = time.perf_counter() - start
+    out.to_csv(args.output, index=False)
+    n = len(next(iter(inputs.values())))
+    print(f'{n:,} households evaluated in {elapsed:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,353 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# HTTP/JSON scoring service for partner sites.  Requests arriving together are coalesced
+# into micro-batches: the first request of a batch waits at most max_delay for others to
+# join (up to max_batch), then the whole batch is scored by the engine in one vectorized
+# call and every request gets its own row back.
+#
+# Only the standard library is used for the server (asyncio streams, HTTP/1.1 keep-alive).
+#
+#   python service.py serve --port 8765 --max-batch 256 --max-delay-ms 2
+#   python service.py load --port 8765 --requests 20000 --concurrency 64
+#
+#   POST /score   body: one household's engine inputs as a JSON object, or a list of them
+#   GET  /health  GET /stats
+
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+
+from engine import INPUT_DEFAULTS, REGIONAL_PRICE_INPUTS, calculate, regional_prices, summary_metrics, to_columns
+from grid_carbon import BASES
+from regions import REGIONS
+from tariffs import TARIFFS
+
+
+DEFAULT_PORT = 8765
+DEFAULT_MAX_BATCH = 256
+DEFAULT_MAX_DELAY = 0.002   #seconds the first request of a batch waits for others
+MAX_BODY = 1 << 20          #bytes
+MAX_HOUSEHOLDS = 1000       #per request
+
+#numeric inputs are 0 or more; efficiencies and heat pump performance divide energy use, so
+#must be above 0, and shares and hours have an upper limit
+POSITIVE_INPUTS = ('boiler_heat_eff', 'boiler_hw_eff', 'immersion_hw_eff',
+                   'hp_heat_scop_typ', 'hp_hw_cop_typ', 'hp_heat_scop_hi', 'hp_hw_cop_hi')
+MAX_INPUTS = {'efficiency_boost': 1, 'pc_elec_second_tariff': 1, 'second_tariff_hours': 24}
+
+
+class RequestError(Exception):
+    """
+    a problem with the request, reported to the client with its HTTP status
+    """
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_household(obj):
+    """
+    check one household's inputs and convert them to the engine's types
+    """
+    if not isinstance(obj, dict):
+        raise RequestError('each household must be a JSON object of engine inputs')
+    household = {}
+    for name, value in obj.items():
+        if name not in INPUT_DEFAULTS:
+            raise RequestError(f'unknown input {name!r}')
+        default = INPUT_DEFAULTS[name]
+        if isinstance(default, bool):
+            if not isinstance(value, bool):
+                raise RequestError(f'{name} must be true or false')
+        elif isinstance(default, str):
+            if not isinstance(value, str):
+                raise RequestError(f'{name} must be a string')
+        elif isinstance(value, bool) or not isinstance(value, (int, float)) or not np.isfinite(value):
+            raise RequestError(f'{name} must be a number')
+        elif name in POSITIVE_INPUTS and value <= 0:
+            raise RequestError(f'{name} must be above 0')
+        elif value < 0:
+            raise RequestError(f'{name} must be 0 or more')
+        elif value > MAX_INPUTS.get(name, np.inf):
+            raise RequestError(f'{name} must be at most {MAX_INPUTS[name]}')
+        household[name] = value
+    #bad tariff, grid carbon basis or region names would otherwise fail the whole batch
+    if household.get('elec_tariff', '') not in ('', *TARIFFS):
+        raise RequestError(f"unknown tariff {household['elec_tariff']!r}")
+    if household.get('grid_carbon', 'annual') not in BASES:
+        raise RequestError(f"unknown grid carbon basis {household['grid_carbon']!r}, choose from: " + ', '.join(BASES))
+    if household.get('grid_region', '') not in ('', *REGIONS):
+        raise RequestError(f"unknown grid region {household['grid_region']!r}")
+    return household
+
+
+def score_households(households):
+    """
+    households - list of dicts of engine inputs, any missing take the defaults
+    returns list of dicts of the flat result columns and summary metrics, one per household
+    """
+    names = set().union(*households)
+    cols = {name: [h.get(name, INPUT_DEFAULTS[name]) for h in households] for name in names}
+    #prices left out by some households are those of their tariff or region, as in prepare_inputs
+    priced = [name for name in REGIONAL_PRICE_INPUTS if name in names]
+    if priced:
+        regional = regional_prices(cols.get('elec_tariff', ''), cols.get('grid_region', ''))
+        for name in priced:
+            defaults = regional.get(name, [INPUT_DEFAULTS[name]] * len(households))
+            cols[name] = [h.get(name, default) for h, default in zip(households, defaults)]
+    results = calculate(**cols)
+    out = {**to_columns(results), **summary_metrics(results)}
+    keys = list(out)
+    rows = zip(*[out[k].tolist() for k in keys])
+    return [dict(zip(keys, row)) for row in rows]
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent score requests into batches for one engine call.
+    max_batch - most households per batch
+    max_delay - seconds the first household of a batch waits for others to join
+    """
+    def __init__(self, max_batch=DEFAULT_MAX_BATCH, max_delay=DEFAULT_MAX_DELAY):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = asyncio.Queue()
+        self.batches = 0
+        self.households = 0
+        self.busy_seconds = 0.0
+
+    async def submit(self, households):
+        """
+        score a list of households, returning their results once their batch is done
+        """
+        loop = asyncio.get_running_loop()
+        futures = []
+        for household in households:
+            future = loop.create_future()
+            self.queue.put_nowait((household, future))
+            futures.append(future)
+        return await asyncio.gather(*futures)
+
+    def _drain(self, batch):
+        while len(batch) < self.max_batch and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_delay
+            self._drain(batch)
+            if len(batch) < self.max_batch and self.max_delay > 0:
+                await asyncio.sleep(max(deadline - loop.time(), 0))
+                self._drain(batch)
+
+            #scored on the event loop: a batch takes about a millisecond, less than a thread hand-off costs
+            start = time.perf_counter()
+            try:
+                results = score_households([household for household, future in batch])
+            except Exception as exc:
+                for household, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            finally:
+                self.busy_seconds += time.perf_counter() - start
+            for (household, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+            self.batches += 1
+            self.households += len(batch)
+
+    def stats(self):
+        return {'batches': self.batches, 'households': self.households,
+                'mean_batch': self.households / max(self.batches, 1),
+                'busy_seconds': round(self.busy_seconds, 3), 'queued': self.queue.qsize()}
+
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+def _response(status, payload, keep_alive):
+    try:
+        body = json.dumps(payload, allow_nan=False).encode()
+    except ValueError:
+        #NaN and Infinity are not JSON, so a non-finite result is an error rather than a body clients cannot parse
+        status, body = 500, json.dumps({'error': 'result is not a finite number'}).encode()
+    head = (f'HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n'
+            'Content-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode() + body
+
+
+class ScoringService:
+    """
+    asyncio HTTP server in front of a MicroBatcher
+    """
+    def __init__(self, max_batch=DEFAULT_MAX_BATCH, max_delay=DEFAULT_MAX_DELAY):
+        self.batcher = MicroBatcher(max_batch, max_delay)
+        self.requests = 0
+        self.started = time.time()
+
+    async def handle(self, method, path, body):
+        """
+        returns (status, payload) for one request
+        """
+        if path == '/health':
+            return 200, {'status': 'ok'}
+        if path == '/stats':
+            return 200, {'requests': self.requests, 'uptime_seconds': round(time.time() - self.started, 1),
+                         **self.batcher.stats()}
+        if path != '/score':
+            return 404, {'error': f'no such endpoint {path}'}
+        if method != 'POST':
+            return 405, {'error': 'use POST'}
+
+        try:
+            obj = json.loads(body or b'null')
+        except ValueError:
+            raise RequestError('body is not valid JSON')
+        is_list = isinstance(obj, list)
+        households = [parse_household(h) for h in (obj if is_list else [obj])]
+        if len(households) > MAX_HOUSEHOLDS:
+            raise RequestError(f'at most {MAX_HOUSEHOLDS} households per request', 413)
+        results = await self.batcher.submit(households)
+        return 200, (results if is_list else results[0])
+
+    async def serve_connection(self, reader, writer):
+        try:
+            while True:
+                #the request line and headers in one read
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except asyncio.LimitOverrunError:
+                    writer.write(_response(413, {'error': 'request headers too large'}, False))
+                    break
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split()
+                except ValueError:
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = (headers.get('connection', '').lower() != 'close'
+                              and version == 'HTTP/1.1')
+
+                try:
+                    length = int(headers.get('content-length', 0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    writer.write(_response(400, {'error': 'invalid content-length'}, False))
+                    break
+                if length > MAX_BODY:
+                    writer.write(_response(413, {'error': 'request body too large'}, False))
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                self.requests += 1
+                try:
+                    status, payload = await self.handle(method, target.split('?')[0], body)
+                except RequestError as exc:
+                    status, payload = exc.status, {'error': str(exc)}
+                except Exception as exc:
+                    status, payload = 500, {'error': str(exc)}
+                writer.write(_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=DEFAULT_PORT):
+        batcher = asyncio.create_task(self.batcher.run())
+        server = await asyncio.start_server(self.serve_connection, host, port, backlog=1024)
+        print(f'Scoring service on http://{host}:{port} (max batch {self.batcher.max_batch}, '
+              f'max delay {self.batcher.max_delay*1000:.1f} ms)')
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+#__________load generator______________
+
+async def _client(host, port, payloads, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for payload in payloads:
+            body = json.dumps(payload).encode()
+            start = time.perf_counter()
+            writer.write(f'POST /score HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n'
+                         f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+            await writer.drain()
+            head = await reader.readuntil(b'\r\n\r\n')
+            status = int(head.split(None, 2)[1])
+            length = int(head.lower().split(b'content-length:')[1].split(b'\r\n')[0])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def load_test(host='127.0.0.1', port=DEFAULT_PORT, n_requests=20000, concurrency=64, seed=0):
+    """
+    Send n_requests single-household requests over concurrency keep-alive connections.
+    returns dict of requests per second and latency percentiles (ms)
+    """
+    from parallel import random_households
+
+    columns = random_households(n_requests, seed)
+    payloads = [{name: values[i].item() for name, values in columns.items()} for i in range(n_requests)]
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*[_client(host, port, payloads[i::concurrency], latencies, errors)
+                           for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    ms = np.array(latencies) * 1000
+    return {'requests': len(latencies), 'errors': len(errors), 'seconds': round(elapsed, 2),
+            'requests_per_second': round(len(latencies) / elapsed),
+            'p50_ms': round(float(np.percentile(ms, 50)), 2), 'p99_ms': round(float(np.percentile(ms, 99)), 2),
+            'max_ms': round(float(ms.max()), 2)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Heat pump scoring service and its load generator.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve = sub.add_parser('serve', help='run the scoring service')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=DEFAULT_PORT)
+    serve.add_argument('--max-batch', type=int, default=DEFAULT_MAX_BATCH, help='households per batch (default %(default)s)')
+    serve.add_argument('--max-delay-ms', type=float, default=DEFAULT_MAX_DELAY*1000,
+                       help='longest wait for a batch to fill (default %(default)s)')
+    load = sub.add_parser('load', help='load test a running service')
+    load.add_argument('--host', default='127.0.0.1')
+    load.add_argument('--port', type=int, default=DEFAULT_PORT)
+    load.add_argument('--requests', type=int, default=20000)
+    load.add_argument('--concurrency', type=int, default=64)
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        service = ScoringService(args.max_batch, args.max_delay_ms / 1000)
+        try:
+            asyncio.run(service.serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+    else:
+        report = asyncio.run(load_test(args.host, args.port, args.requests, args.concurrency))
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
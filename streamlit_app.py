@@ -1,74 +1,131 @@
 # HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
 
 import streamlit as st
-import pandas as pd
-from helper import generate_df, make_stacked_bar_horiz
-from PIL import Image
-
-
-#__________ set default values______________
-#efficiencies and performance coefficients - default values
-boiler_heat_eff = 0.88
-boiler_hw_eff = 0.88
-immersion_hw_eff = 1
-#typical heat pump performance:
-hp_heat_scop_typ = 3.2
-hp_hw_cop_typ = 2.7
-#hi heat pump performance
-hp_heat_scop_hi = 3.8
-hp_hw_cop_hi = 2.8
-
-#Raise in temp (degC) from mains water to hot water AS USED
-hw_temp_raise_default = 25
-
-#carbon intensity values taken from SAP 10.2 (dec 2021)
-GAS_kgCO2perkWh = 0.21
-ELEC_RENEW_kgCO2perkWh = 0
-ELEC_AVE_kgCO2perkWh = 0.136
-
-# price cap October 2022 gas and electricity domestic standing and unit charges
-gas_stand = 28.0
-gas_unit = 10.3
-elec_stand = 46.0
-elec_unit = 34.0
+#only light modules are imported before the form is drawn - numpy, pandas, Altair and the
+#engine are imported once results are requested (see Results calculation below)
+from cache import results_cache
+import instrument
+import reference_tables
+import regions
+#default efficiencies, heat pump performance, carbon intensities and prices
+from defaults import (boiler_heat_eff, boiler_hw_eff, hp_heat_scop_typ, hp_hw_cop_typ,
+                      hp_heat_scop_hi, hp_hw_cop_hi, hw_temp_raise_default,
+                      gas_stand, gas_unit, elec_stand, elec_unit, MEASURES)
+
 
 # efficincy measures to choose from
-efficiency_opts = [('Draft proofing and/or door insulation (3%)', 0.03),
-                    ('Increased loft insulation (5%)', 0.05),
-                    ('Improved window glazing (5%)', 0.05),
-                    ('Cavity wall insulation (10%)', 0.1),
-                    ('Underfloor insulation (10%)', 0.1),
-                    ('Internal or external solid wall insulation (15%)', 0.15),
-                    ('Enter a custom heating demand saving', -1.0)]
+efficiency_opts = ([(f'{label} ({boost:.0%})', boost) for (label, boost, cost) in MEASURES]
+                   + [('Enter a custom heating demand saving', -1.0)])
 #____________ Page info________________________________________
 
 about_markdown = 'This app has been developed by UrbanTasker Inc. (urbantasker.com)' 
 
 st.set_page_config(layout="centered", menu_items={'Get Help': None, 'Report a Bug': None, 'About': about_markdown})
 
-#__________write some reference info to the sidebar____________
-
-df_tot = pd.DataFrame([['1', 2100, 7000], ['2', 2750, 9500], 
-                        ['3', 3000, 12000], ['4', 3500, 15000],
-                        ['5', 4300, 17000]],
-                        columns=['House size', 'Electricity (kWh)', 'Gas (kWh)'])
-df_tot.set_index('House size', inplace=True)                        
+#stage timings and profiling (see instrument.py) - for one run add ?trace=1 or ?profile=1 to the page url
+trace = instrument.PageTrace(trace=bool(st.query_params.get('trace')), profile=bool(st.query_params.get('profile')))
+if trace.enabled:
+    instrument.start_metrics_server()
+    instrument.registry.register_gauges('hp_results_cache', results_cache.stats)
+
+#__________portfolio mode_____________________________________
+#summaries of a batch.py results file instead of the single household form (see portfolio.py)
+view = st.sidebar.radio('View:', ['Single household', 'Portfolio'], index=1 if st.query_params.get('results') else 0)
+if view == 'Portfolio':
+    st.title('Heat Pump Portfolio Results')
+    st.write('Explore the results of many households scored with batch.py.  Text columns kept in the results with --keep, '
+    + 'such as province, tariff or retrofit package, can be used to group and filter the households.  Charts are built from '
+    + 'totals, percentiles and histograms worked out on the server, so they stay quick for a million households.')
+
+    import os
+    import time
+    import portfolio
+
+    #server files only from the configured results directory, anything else is uploaded
+    names = portfolio.results_files()
+    results_name = None
+    if names:
+        requested = st.query_params.get('results', '')
+        results_name = st.selectbox('Results file on the server:', ['(none)'] + names,
+                                    index=names.index(requested) + 1 if requested in names else 0)
+        results_name = None if results_name == '(none)' else results_name
+    uploaded = st.file_uploader('Upload a results file (CSV or Parquet):' if not names else 'Or upload a results file:',
+                                type=['csv', 'parquet'])
+    if results_name is None and uploaded is None:
+        trace.finish()
+        st.stop()
+
+    from helper import make_histogram, make_quantile_bands, make_group_bars
+
+    try:
+        if uploaded is not None:
+            key = ('portfolio', uploaded.name, uploaded.size, uploaded.file_id)
+            pf = results_cache.get_or_compute(key, lambda: portfolio.load(uploaded), shared=False)
+        else:
+            results_path = portfolio.resolve_results(results_name)
+            key = ('portfolio', results_path, os.path.getmtime(results_path))
+            pf = results_cache.get_or_compute(key, lambda: portfolio.load(results_path), shared=False)
+    except (OSError, ValueError):
+        #the reason is not shown, as it could describe files on the server
+        st.error(f'Could not read the results file {uploaded.name if uploaded is not None else results_name}.')
+        trace.finish()
+        st.stop()
+    trace.lap('portfolio_load')
+
+    start = time.perf_counter()
+    metric_label = st.selectbox('Metric:', list(portfolio.METRICS.values()))
+    metric = {label: name for name, label in portfolio.METRICS.items()}[metric_label]
+    cases = st.multiselect('Cases:', pf.cases(metric), default=list(pf.cases(metric)))
+    by = st.selectbox('Group by:', ['(none)'] + list(pf.groups))
+    by = None if by == '(none)' else by
+    filters = {}
+    with st.expander('Filters'):
+        for name in pf.groups:
+            filters[name] = st.multiselect(f'{name}:', pf.labels[name], default=list(pf.labels[name]))
+    mask = pf.mask(filters)
+    selected = pf.n if mask is None else int(mask.sum())
+    st.write(f'{selected:,} of {pf.n:,} households selected.')
+    if not selected or not cases:
+        trace.finish()
+        st.stop()
+
+    st.subheader('1. Distribution')
+    st.altair_chart(make_histogram(portfolio.histogram_frame(pf, metric, cases, mask), metric_label), use_container_width=True)
+
+    st.subheader('2. Percentiles' + (f' by {by}' if by else ''))
+    st.write('Lines span the 10th to 90th percentile of the households, bars the 25th to 75th, and ticks mark the median.')
+    df_bands = portfolio.quantile_frame(pf, metric, cases, by, mask)
+    st.altair_chart(make_quantile_bands(df_bands, metric_label), use_container_width=True)
+    st.dataframe(df_bands.style.format({name: '{:,.0f}' for name in df_bands.columns[2:]}))
+
+    st.subheader('3. Totals' + (f' by {by}' if by else ''))
+    c1, c2 = st.columns(2)
+    with c1:
+        quantity = st.radio('Total:', ['Costs', 'Emissions', 'Energy'])
+    with c2:
+        case_name = st.radio('Case:', pf.cases('costs_total'))
+    units = {'Costs': 'Annual running costs (£)', 'Emissions': 'Annual emissions (kg CO2)', 'Energy': 'Annual energy use (kWh)'}
+    df_totals = portfolio.totals_frame(pf, quantity.lower(), case_name, by, mask)
+    st.altair_chart(make_group_bars(df_totals, units[quantity], 1 if quantity == 'Costs' else 2), use_container_width=True)
+    if st.query_params.get('debug'):
+        st.caption(f'Aggregated in {time.perf_counter() - start:.3f} s')
+    trace.finish()
+    st.stop()
 
-df_hw = pd.DataFrame([['Washing up', 15], ['5 min water-saving shower', 30], ['10 min power shower', 150], ['Bath', 100]],
-columns=['Use', 'Hot water used (L)'])
-df_hw.set_index('Use', inplace=True)
+#__________write some reference info to the sidebar____________
 
-df_cook = pd.DataFrame([['Gas hob', 0.8], ['Gas grill', 1], ['Gas oven', 1.5]],
-columns=['Use', 'Gas consumption per use (kWh)'])
-df_cook.set_index('Use', inplace=True)
+#static tables are prebuilt Markdown, see reference_tables.py
+tables = reference_tables.load()
 
 st.sidebar.header('Reference information')
 st.sidebar.subheader('Typical total annual household energy consumption by number of bedrooms')
-st.sidebar.table(df_tot.style.format("{:,d}"))
+st.sidebar.markdown(tables['household_totals'])
 st.sidebar.subheader('Typical amounts of water for different uses')
-st.sidebar.table(df_hw)
+st.sidebar.markdown(tables['hot_water'])
 st.sidebar.subheader('Typical amounts of energy used for cooking with gas appliances')
-st.sidebar.table(df_cook.style.format(precision=1))
+st.sidebar.markdown(tables['cooking'])
+
+trace.lap('sidebar')
 
 #___________Main page__________________________________________
 
@@ -100,14 +157,16 @@ with tab1:
 
     c1, c2, c3 = st.columns(3)        
     with c1:
-        province = st.selectbox('Province:', ('Ontario', 'BC'))
+        province = st.selectbox('Province:', [region for region in regions.REGIONS if region != 'UK'])
+        #gas units, typical rates and carbon intensities of the province's main utility
+        region_data = regions.utility(province)
     with c2:
         elec_total_kWh = st.number_input('Annual electricity consumption (kWh):', min_value=0, max_value=100000, value=3000, step=100)
     with c3:
-        if province == 'Ontario':
-            gas_total_kWh = st.number_input("Annual gas consumption (m^3):", min_value=0, max_value=100000, value=12000, step=100)
-        else:
-            gas_total_kWh = st.number_input("Annual gas consumption (Joules):", min_value=0, max_value=1000, value=100, step=1)
+        gas_units = region_data['gas_units']
+        gas_total = st.number_input(f"Annual gas consumption ({gas_units}):", min_value=0, max_value=100000,
+                                    value=region_data['gas_typical'], step=10 if gas_units == 'm^3' else 1)
+        gas_total_kWh = gas_total * regions.GAS_UNITS[gas_units]
 
 
     st.subheader('2.  Hot water usage')
@@ -187,10 +246,13 @@ with tab2:
 
     op1 = 'Use the UK-average domestic energy price cap for direct debit paying customers for the period beginning October 2022'
     op2 = 'Use custom unit and standing charges'
+    op3 = 'Use a time-of-use or tiered electricity tariff'
+    op4 = 'Use typical rates for the selected province (in its currency)'
 
-    charge_option = st.radio('Prices to use:',[op1, op2])
+    charge_option = st.radio('Prices to use:',[op1, op2, op3, op4])
 
     is_two_tier_tariff = False
+    elec_tariff = ''
     #if user selects to input their own energy tariff
     if charge_option == op2:
         c1, c2 = st.columns(2)
@@ -206,13 +268,39 @@ with tab2:
         is_two_tier_tariff = st.checkbox('Add off-peak electricity tariff (e.g. like Economy7)')
 
         if is_two_tier_tariff:
-            st.write('In the heat pump scenarios we assume that the average energy consumed per off-peak tariff hour by heating is two-thirds that used in the' +
-            ' average peak-tariff hour. We also assume all of the hot water heating is performed in off-peak hours (unless using solar power) and none of the cooking.')
+            st.write('The off-peak hours are taken to start at midnight.  Each hour of the year is priced at the peak or off-peak rate: heating is spread over '
+            + 'the hours with the weather, a hot water cylinder is reheated on a timer in the off-peak hours, cooking follows typical mealtimes and '
+            + 'the rest of your electricity use keeps the off-peak percentage below.')
 
             elec_unit2 = st.number_input('Off-peak electricity unit cost (p/kWh):', min_value=0.0, max_value=100.0, value=18.0, step=0.01)  
             second_tariff_hours = st.slider('Number of hours of off-peak tariff per day:', 0, 10, 7, 1)
             pc_elec_second_tariff = st.slider('Percentage of electricity consumption (excluding heat pump) in off-peak hours:', 0, 100, 40, 1)
             pc_elec_second_tariff /= 100
+
+    #named tariffs price each hour of the year - use is spread over the year with typical daily and seasonal patterns
+    #only the selected province's tariffs are offered, with gas and the electricity standing charge at its typical rates,
+    #so the tariff's rates are never mixed with prices in another currency
+    if charge_option == op3:
+        import tariffs
+        region_tariffs = [name for name, spec in tariffs.TARIFFS.items() if spec['region'] == province]
+        gas_stand, gas_unit = region_data['gas_stand'], region_data['gas_unit']
+        elec_stand, elec_unit = region_data['elec_stand'], region_data['elec_unit']
+        if region_tariffs:
+            st.write('Electricity is priced by when it is used, with heating following the weather and hot water heated overnight. '
+            + f'Gas and the electricity standing charge are at the typical rates for {province}.')
+            elec_tariff = st.selectbox('Electricity tariff:', region_tariffs)
+        else:
+            st.write(f'There are no time-of-use or tiered tariffs for {province}, so its typical rates are used.')
+
+    if charge_option == op4:
+        gas_stand, gas_unit = region_data['gas_stand'], region_data['gas_unit']
+        elec_stand, elec_unit = region_data['elec_stand'], region_data['elec_unit']
+        st.write(f'Gas: {gas_unit:.1f} per kWh and {gas_stand:.0f} per day.  Electricity: {elec_unit:.1f} per kWh and {elec_stand:.0f} per day.  '
+        + f"({region_data['minor_unit']}, before taxes)")
+
+    #costs are in the currency of the prices used: the province's for its own rates and tariffs, otherwise pounds
+    currency_data = region_data if charge_option in (op3, op4) else regions.utility('UK')
+    currency, minor_unit = currency_data['currency'], currency_data['minor_unit']
         
     st.subheader('2.  Device performance')
     st.write('Results are calculated for both a typical and a high-performance heat pump installation.  '
@@ -240,16 +328,72 @@ with tab2:
     hw_temp_raise = st.number_input('Cold and hot water temperature difference (degrees C):', min_value=1, max_value=100, step=1, 
     help='The typical difference in temperature between mains water and hot water as used.', value=hw_temp_raise_default)
 
+    st.subheader('4.  Uncertainty')
+    st.write('Heat pump performance, future energy prices, hot water use and the savings achieved by efficiency measures are all uncertain. '
+    + 'Optionally, the results can include a range of likely outcomes, estimated by re-running the calculation many times with these values varied.')
+    is_uncertainty = st.checkbox('Show ranges of likely savings and emissions', value=False)
+
+    st.subheader('5.  Sensitivity')
+    st.write('Optionally, the results can show which of your inputs the cost saving depends on most, '
+    + 'and how the saving changes with the gas and electricity unit costs.')
+    is_sensitivity = st.checkbox('Show sensitivity of the cost saving to the inputs', value=False)
+
+    st.subheader('6.  Retrofit packages')
+    st.write('Optionally, the results can recommend the cheapest combinations of efficiency measures, heat pump install and tariff '
+    + 'that bring your annual emissions and/or running costs down to a target.  Enter 0 for no target.')
+    is_retrofit = st.checkbox('Recommend retrofit packages', value=False)
+    if is_retrofit:
+        target_emissions = st.number_input('Annual emissions target (kg of CO2):', min_value=0, max_value=100000, step=100, value=1000)
+        target_costs = st.number_input(f'Annual running cost target ({currency}):', min_value=0, max_value=100000, step=100, value=0)
+
+    st.subheader('7.  Heat pump models')
+    st.write('Optionally, the results can list the heat pump models from our catalog that suit your home best, '
+    + 'using each model\'s own performance, capacity and installed price instead of the typical and high-performance values above.')
+    is_models = st.checkbox('Recommend heat pump models', value=False)
+    if is_models:
+        model_objective = st.radio('Rank models by:', ['Running cost', 'Emissions', 'Payback'])
+
+    st.subheader('8.  Electricity emissions')
+    st.write('A heat pump uses most of its electricity in the coldest hours, when the grid is busiest.  Optionally, its emissions '
+    + 'can be calculated hour by hour, with the average mix of generation in each hour, or with the marginal generation that '
+    + 'meets extra load in each hour (usually gas-fired at peak times).')
+    grid_carbon_label = st.radio('Carbon intensity of grid electricity:',
+                                 ['Annual average', 'Hourly average', 'Hourly marginal'])
+    grid_carbon = {'Annual average': 'annual', 'Hourly average': 'average', 'Hourly marginal': 'marginal'}[grid_carbon_label]
+    is_elec_renewable = st.checkbox('My electricity is from a renewable (zero carbon) supply', value=False)
+
+    st.subheader('9.  Solar PV, battery and hot water cylinder')
+    st.write('Optionally, the results can step through each hour of the year with new solar panels, a home battery and the heat pump\'s '
+    + 'hot water cylinder, which loses some heat all the time.  Solar output meets the household\'s use first, and the cylinder and battery '
+    + 'store the surplus.  If you already have solar panels their output is netted off the electricity use entered above, so only enter '
+    + 'additional panels here.')
+    is_dispatch = st.checkbox('Simulate solar PV, battery and cylinder hour by hour', value=False)
+    if is_dispatch:
+        c1, c2, c3 = st.columns(3)
+        with c1:
+            pv_kWp = st.number_input('Solar PV array (kWp):', min_value=0.0, max_value=50.0, value=4.0, step=0.5)
+            battery_kWh = st.number_input('Battery capacity (kWh, 0 for none):', min_value=0.0, max_value=100.0, value=0.0, step=0.5)
+        with c2:
+            tank_litres = st.number_input('Hot water cylinder (litres):', min_value=0, max_value=1000, value=200, step=10)
+            tank_loss_kWhday = st.number_input('Cylinder standing loss (kWh a day):', min_value=0.0, max_value=10.0, value=1.5, step=0.1)
+        with c3:
+            export_unit = st.number_input(f'Payment for exported electricity ({minor_unit}/kWh):', min_value=0.0, max_value=100.0, value=5.0, step=0.5)
+        opts = ['Use my own solar first', 'Also charge from the grid in the cheapest tariff hours']
+        dispatch_strategy = st.radio('Battery and cylinder control:', opts)
+        dispatch_strategy = 'tariff' if dispatch_strategy == opts[1] else 'self_consumption'
+
 with tab3:
     #____________ Further Information____________________________
     st.subheader('1.  Carbon intensity')
     st.write("We use standard values for carbon intensity of different energy sources as set in the Standard Assessment Procedure (SAP) 10.2, "
     +"released December 2021.  These values only consider the CO$_2$ equivalent emissions associated per unit of energy, not the embedded emissions of the "
     + "energy generation and transmission infrastructure.  These values are: ")
-    costs_table = pd.DataFrame([['Mains Gas', GAS_kgCO2perkWh], ['Electricity (grid average)', ELEC_AVE_kgCO2perkWh],
-    ['Electricity (renewable only)', ELEC_RENEW_kgCO2perkWh]], columns=['Energy Source', 'CO2 Equivalent Emissions (kgCO2/kWh)'])
-    costs_table.set_index('Energy Source', inplace=True)
-    st.table(costs_table)
+    st.markdown(tables['carbon_intensity'])
+    st.write(f"For {province} we use {region_data['gas_kgCO2perkWh']:.3f} kgCO2/kWh for gas (combustion only) and "
+    + f"{region_data['elec_kgCO2perkWh']:.3f} kgCO2/kWh for the average of the provincial electricity grid, instead of the SAP values above.")
+    st.write("With hourly electricity emissions (Advanced Settings), each use of electricity - heating, hot water, cooking and the rest - "
+    + "is instead spread over the year by when it typically draws power, and multiplied by the grid's intensity in each hour.  The "
+    + "hourly series are illustrative, built from the provincial average and the shape of system demand.")
 
     st.subheader('2.  Other approximations and considerations')
     st.markdown(
@@ -259,7 +403,7 @@ with tab3:
     Some examples as to why this calculator may be slightly inaccurate include:
     1. Switching from a boiler to a heat pump may change your heat demand independently of any energy saving measures you implement, for example you may save energy by overshooting the set temperature less, or you may have a different set temperature at night.
     2. Atypical annual variation in heating demand will result in different heat pump performance, as will weather conditions different from the UK average.
-    3. Switching from a combi boiler to a heat pump will require you to install a hot water storage tank, which will impact the efficiency of heating hot water - some heat will be lost while storing the water, but less will be lost while waiting for the water to heat up on demand.
+    3. Switching from a combi boiler to a heat pump will require you to install a hot water storage tank, which will impact the efficiency of heating hot water - some heat will be lost while storing the water, but less will be lost while waiting for the water to heat up on demand.  The annual results ignore these standing losses; the optional hourly simulation of solar PV, battery and cylinder (Advanced Settings) includes them.
     4. Switching from gas to electric cooking (if you select gas cooking and disconnect from mains gas options) will change the energy demand of your cooking - electric is typically more efficient.       
     """
     )
@@ -280,208 +424,85 @@ st.markdown("<a href='#linkto_top'>^ Back to top ^</a>", unsafe_allow_html=True)
 
 
 #don't proceed until Update results has been pressed
+trace.lap('inputs')
 if not is_submit1:
+    trace.finish()
     st.stop()
 
-#_______________Results calculation______________________
-#prepare some variables
-
-#calculate hot water kWh/L
-GAS_HW_kWhperL = 4200 * hw_temp_raise/(3600 * 1000 * boiler_hw_eff)
-IMMERSION_HW_kWhperL = 4200 * hw_temp_raise/(3600 * 1000 * immersion_hw_eff)
+import numpy as np
+import pandas as pd
+from helper import generate_df, stacked_bar_horiz_spec, make_tornado, make_heatmap
+from engine import CASES, ENERGY_BREAKDOWN, COST_BREAKDOWN, SUMMARY_METRICS
+from results import ResultTable
+import depgraph
+import uncertainty
+import sensitivity
+import retrofit
+import catalog
+import dispatch
 
-#_____________first do the current case____________________
-if is_two_tier_tariff:
-    elec_unit_eff = (pc_elec_second_tariff*elec_unit2) + (1 - pc_elec_second_tariff)*elec_unit
-else:
-    elec_unit_eff = elec_unit
-
-costs_by_type = [['Current', 'Gas standing', gas_stand*3.65],
-                ['Current', 'Gas unit',  gas_total_kWh * gas_unit/100],
-                ['Current', 'Elec.  standing', elec_stand*3.65],
-                ['Current', 'Elec.  unit', elec_total_kWh * elec_unit_eff/100]] 
-            
-costs_total = (gas_stand + elec_stand)*3.65 + gas_total_kWh * gas_unit/100 + elec_total_kWh * elec_unit_eff/100
-
-# hot water energy demand
-if is_hw_gas:
-    gas_hw_kWh = hw_lday * 365 * GAS_HW_kWhperL
-    elec_hw_kWh = 0
-else:
-    gas_hw_kWh = 0
-    elec_hw_kWh = hw_lday * 365 * IMMERSION_HW_kWhperL
-
-#cooking demand - only done if gas
+#_______________Results calculation______________________
+#collect the household inputs - some only exist when the matching option is selected
+inputs = dict(gas_total_kWh=gas_total_kWh, elec_total_kWh=elec_total_kWh, hw_lday=hw_lday,
+              is_hw_gas=is_hw_gas, is_cook_gas=is_cook_gas, is_second_heatsource=is_second_heatsource,
+              efficiency_boost=efficiency_boost, is_disconnect_gas=is_disconnect_gas,
+              is_free_summer_hw=is_free_summer_hw, is_two_tier_tariff=is_two_tier_tariff,
+              gas_kgCO2perkWh=region_data['gas_kgCO2perkWh'], elec_kgCO2perkWh=region_data['elec_kgCO2perkWh'],
+              is_elec_renewable=is_elec_renewable, grid_region=province, grid_carbon=grid_carbon,
+              gas_stand=gas_stand, gas_unit=gas_unit, elec_stand=elec_stand, elec_unit=elec_unit,
+              boiler_heat_eff=boiler_heat_eff, boiler_hw_eff=boiler_hw_eff,
+              hp_heat_scop_typ=hp_heat_scop_typ, hp_hw_cop_typ=hp_hw_cop_typ,
+              hp_heat_scop_hi=hp_heat_scop_hi, hp_hw_cop_hi=hp_hw_cop_hi, hw_temp_raise=hw_temp_raise)
 if is_cook_gas:
-    gas_cook_kWh = gas_cook_kWhweek * 52
-else:
-    gas_cook_kWh = 0
+    inputs['gas_cook_kWhweek'] = gas_cook_kWhweek
+if is_second_heatsource:
+    inputs.update(second_heatsource_type=second_heatsource_type, second_heatsource_kWh=second_heatsource_kWh,
+                  is_second_heatsource_remains=is_second_heatsource_remains)
+if elec_tariff:
+    inputs['elec_tariff'] = elec_tariff
+if is_two_tier_tariff:
+    inputs.update(elec_unit2=elec_unit2, second_tariff_hours=second_tariff_hours,
+                  pc_elec_second_tariff=pc_elec_second_tariff)
 
-#gas heating is remainder after hot water and cooking removed
-gas_heat_kWh = gas_total_kWh - gas_hw_kWh - gas_cook_kWh
+#derived quantities are memoized graph nodes, so an edit only recomputes what depends on it
+graph = depgraph.engine_graph(results_cache)
 
-#see if there's any electric heating in addition:
-if is_second_heatsource:
-    if second_heatsource_type=='electric':
-        elec_heat_kWh = second_heatsource_kWh
-    else:
-        elec_heat_kWh = 0    
-    # elif second_heatsource_type=='other':
-    #     other_total_kWh = second_heatsource_kWh
-else:
-    elec_heat_kWh = 0
-
-#electric other is remainder after heating and hw removed
-elec_other_kWh = elec_total_kWh-elec_heat_kWh-elec_hw_kWh
-
-#if other electricity is now negative, assume user has overestimated either 
-# their electric hw usage or electric heating - whichever the greater.
-#reduce to bring other electricity to zero.
-if elec_other_kWh < 0:
-    if elec_hw_kWh > elec_heat_kWh:
-        elec_hw_kWh += elec_other_kWh
-    else: 
-        elec_heat_kWh += elec_other_kWh
-
-    elec_other_kWh = 0
-
-#select carbon intensity of electricity
-if is_elec_renewable:
-    elec_kgCO2perkWh = ELEC_RENEW_kgCO2perkWh
-else:
-    elec_kgCO2perkWh = ELEC_AVE_kgCO2perkWh
-
-#current energy usage table
-energy_usage = [['Current', 'Heating', gas_heat_kWh+elec_heat_kWh, gas_heat_kWh*GAS_kgCO2perkWh+elec_heat_kWh*elec_kgCO2perkWh],
-            ['Current', 'Hot water', gas_hw_kWh+elec_hw_kWh, gas_hw_kWh*GAS_kgCO2perkWh + elec_hw_kWh*elec_kgCO2perkWh],
-            ['Current', 'Cooking', gas_cook_kWh, gas_cook_kWh*GAS_kgCO2perkWh],
-            ['Current', 'Other Elec.', elec_other_kWh, elec_other_kWh*elec_kgCO2perkWh]]                
-
-energy_total = gas_total_kWh + elec_total_kWh
-emissions_total = sum([gas_heat_kWh*GAS_kgCO2perkWh, gas_hw_kWh*GAS_kgCO2perkWh, gas_cook_kWh*GAS_kgCO2perkWh, elec_total_kWh*elec_kgCO2perkWh])
-
-#___________now do the future/heat pump case_____________
-
-
-def do_heat_pump_case(install_type, gas_heat_kWh, elec_heat_kWh, gas_hw_kWh, elec_hw_kWh, gas_cook_kWh):
+def add_chart_data(key, breakdown, value_name, skip_cooking=False):
     """
-    install type either 'Typical' or 'Hi-performance'
+    graph node df_<key>: DataFrame of one chart, built from the three cases' <key> nodes
     """
-
-    #set heat pump performance coefficients to hi or typical:
-    if install_type == 'Hi-performance':
-        hp_heat_scop = hp_heat_scop_hi
-        hp_hw_cop = hp_hw_cop_hi
-    else:
-        hp_heat_scop = hp_heat_scop_typ
-        hp_hw_cop = hp_hw_cop_typ
-
-    #calculate future heating energy - dependent upon second heat source (if any)
-    if not is_second_heatsource:
-        elec_heat_kWh = (1 - efficiency_boost) * gas_heat_kWh * boiler_heat_eff/hp_heat_scop
-        gas_heat_kWh = 0
-    else:
-        if is_second_heatsource_remains:
-            if second_heatsource_type=='gas':
-                elec_heat_kWh = (1 - efficiency_boost) * (gas_heat_kWh - second_heatsource_kWh) * boiler_heat_eff/hp_heat_scop
-                gas_heat_kWh = second_heatsource_kWh
-            elif second_heatsource_type=='electric':
-                elec_heat_kWh = second_heatsource_kWh + (1 - efficiency_boost) * gas_heat_kWh * boiler_heat_eff/hp_heat_scop
-                gas_heat_kWh = 0
-        else:
-            if second_heatsource_type=='electric':
-                elec_heat_kWh = (1 - efficiency_boost) * (gas_heat_kWh * boiler_heat_eff + second_heatsource_kWh)/hp_heat_scop
-                gas_heat_kWh = 0
-            elif second_heatsource_type=='gas': #same as the no second heatsource case, as we assume same efficiency as boiler
-                elec_heat_kWh = (1 - efficiency_boost) * gas_heat_kWh * boiler_heat_eff/hp_heat_scop
-                gas_heat_kWh = 0
-            else:#other second heatsource, assume gas boiler efficiency, but not included in gas_heat_kWh
-                elec_heat_kWh = (1 - efficiency_boost) * (gas_heat_kWh + second_heatsource_kWh) * boiler_heat_eff/hp_heat_scop
-                gas_heat_kWh = 0
-
-    #hot water
-    if is_hw_gas:
-        elec_hw_kWh = gas_hw_kWh * boiler_heat_eff/hp_hw_cop
-    else:
-        elec_hw_kWh = elec_hw_kWh * immersion_hw_eff/hp_hw_cop
-
-    #gas cooking energy
-    if is_cook_gas:
-        if is_disconnect_gas:
-            emissions_cook = gas_cook_kWh * elec_kgCO2perkWh
-            elec_cook_kWh = gas_cook_kWh
-            gas_cook_kWh = 0   
-        else:
-            emissions_cook = gas_cook_kWh * GAS_kgCO2perkWh
-            elec_cook_kWh = 0
-    else:
-        emissions_cook = 0   
-        gas_cook_kWh = 0 #redundant, for clarity
-        elec_cook_kWh = 0 
-
-    #totals
-    elec_total_kWh = elec_other_kWh + elec_heat_kWh + elec_hw_kWh + elec_cook_kWh
-    gas_total_kWh = gas_heat_kWh + gas_cook_kWh
-
-    #new energy consumption and emissions table
-    case_name = install_type + ' HP Install'
-    energy_usage = [[case_name, 'Heating', gas_heat_kWh+elec_heat_kWh, gas_heat_kWh*GAS_kgCO2perkWh+elec_heat_kWh*elec_kgCO2perkWh],
-                [case_name, 'Hot water', elec_hw_kWh, elec_hw_kWh*elec_kgCO2perkWh],
-                [case_name, 'Cooking', gas_cook_kWh+elec_cook_kWh, emissions_cook],
-                [case_name, 'Other Elec.', elec_other_kWh, elec_other_kWh*elec_kgCO2perkWh]]   
-
-    energy_total = elec_heat_kWh + elec_hw_kWh + elec_cook_kWh  + elec_other_kWh + gas_heat_kWh + gas_cook_kWh
-    emissions_total = sum([elec_heat_kWh*elec_kgCO2perkWh, gas_heat_kWh*GAS_kgCO2perkWh, elec_hw_kWh*elec_kgCO2perkWh, emissions_cook, elec_other_kWh*elec_kgCO2perkWh])
-
-    #update costs
-
-    #don't include gas standing charge if disconnecting from gas
-    if is_disconnect_gas:
-        gas_stand_total = 0
-    else:
-        gas_stand_total = gas_stand*3.65
-
-    if is_two_tier_tariff:
-        #TODO: correct this!!!!
-        #this pc of heating in second tariff (second_tariff_hours limited to 10)
-        pc_heat_second_tariff = (2/3)*second_tariff_hours/((2/3)*10 + 14)
-        #all of hot water in second tariff (or free in summer solar)
-        #none of cooking in second tariff
-        #same pc of other elec in second tariff as original scenario
-
-        if is_free_summer_hw: #those with solar panels can get free hot water for 4 months
-            elec_unit_total_cost = elec_heat_kWh * (pc_heat_second_tariff*elec_unit2 + (1-pc_heat_second_tariff)*elec_unit) + \
-                elec_hw_kWh*(2/3)*elec_unit2 + elec_cook_kWh*elec_unit + elec_other_kWh*elec_unit_eff
-        else:
-            elec_unit_total_cost = elec_heat_kWh * (pc_heat_second_tariff*elec_unit2 + (1-pc_heat_second_tariff)*elec_unit) + \
-                elec_hw_kWh*elec_unit2 + elec_cook_kWh*elec_unit + elec_other_kWh*elec_unit_eff
-        elec_unit_total_cost /= 100
-    else:
-        if is_free_summer_hw: #those with solar panels can get free hot water for 4 months
-            elec_unit_total_cost = (elec_total_kWh - elec_hw_kWh/3)*elec_unit/100
-        else:
-            elec_unit_total_cost = elec_total_kWh*elec_unit/100
-
-    costs_by_type = [[case_name, 'Gas standing', gas_stand_total],
-                    [case_name, 'Gas unit',  gas_total_kWh*gas_unit/100],
-                    [case_name, 'Elec.  standing', elec_stand*3.65],
-                    [case_name, 'Elec.  unit', elec_unit_total_cost]] 
-    
-    costs_total = sum([gas_stand_total, gas_total_kWh*gas_unit/100, elec_stand*3.65, elec_unit_total_cost])
-
-    return energy_usage, costs_by_type, energy_total, emissions_total, costs_total
-
-energy_usage_typ, costs_by_type_typ, energy_total_typ, emissions_total_typ, costs_total_typ = \
-do_heat_pump_case('Typical', gas_heat_kWh, elec_heat_kWh, gas_hw_kWh, elec_hw_kWh, gas_cook_kWh)
-
-energy_usage_hi, costs_by_type_hi, energy_total_hi, emissions_total_hi, costs_total_hi = \
-do_heat_pump_case('Hi-performance', gas_heat_kWh, elec_heat_kWh, gas_hw_kWh, elec_hw_kWh, gas_cook_kWh)
-
-#if no gas heating, just delete cooking data entries (index 2):
-if not is_cook_gas:
-    energy_usage.pop(2)
-    energy_usage_hi.pop(2)
-    energy_usage_typ.pop(2)
+    def build(inp, *cases):
+        #if no gas cooking, just leave out the cooking data entries
+        skip = ('Cooking',) if skip_cooking and not inp['is_cook_gas'][0] else ()
+        return generate_df(ResultTable.from_results(dict(zip(CASES, cases)), [key], breakdown, [value_name], skip=skip))
+    graph.add('df_' + key, build, ['is_cook_gas'] if skip_cooking else [], depgraph.case_nodes(key))
+
+#the costs frame is cached without the currency, which is added to its column name when charted
+add_chart_data('costs', COST_BREAKDOWN, 'Costs')
+add_chart_data('emissions', ENERGY_BREAKDOWN, 'Emissions (kg of CO2)', skip_cooking=True)
+add_chart_data('energy', ENERGY_BREAKDOWN, 'Energy (kWh)', skip_cooking=True)
+
+def build_sensitivity(inputs):
+    """
+    one-at-a-time analysis and a unit cost grid around the entered values
+    """
+    df_tornado = sensitivity.one_at_a_time(inputs)
+    gas_values = np.linspace(0.5, 1.5, 21) * inputs['gas_unit']
+    elec_values = np.linspace(0.5, 1.5, 21) * inputs['elec_unit']
+    grid = sensitivity.factorial(inputs, {'gas_unit': gas_values, 'elec_unit': elec_values})
+    return df_tornado, sensitivity.grid_frame(grid, 'gas_unit', gas_values, 'elec_unit', elec_values, 'cost_saving_typ')
+
+totals = {key + '_total': [float(graph.get(name, inputs)[key + '_total'][0]) for name in depgraph.case_nodes(key)]
+          for key in ('energy', 'emissions', 'costs')}
+energy_total, energy_total_typ, energy_total_hi = totals['energy_total']
+emissions_total, emissions_total_typ, emissions_total_hi = totals['emissions_total']
+costs_total, costs_total_typ, costs_total_hi = totals['costs_total']
+#charts are a prebuilt Vega-Lite spec plus the data to show in it
+cost_label = f'Costs ({currency})'
+charts = {'costs': (graph.get('df_costs', inputs).rename(columns={'Costs': cost_label}), stacked_bar_horiz_spec(cost_label, 1)),
+          'emissions': (graph.get('df_emissions', inputs), stacked_bar_horiz_spec('Emissions (kg of CO2)')),
+          'energy': (graph.get('df_energy', inputs), stacked_bar_horiz_spec('Energy (kWh)'))}
+trace.lap('calculation')
 
 #_______________Present results_________________________
 
@@ -504,10 +525,6 @@ with result_container:
             """
             )
 
-    #calculate key values to show...
-    df_costs = generate_df(costs_by_type, [costs_by_type_typ, costs_by_type_hi], ['Costs (£)'])
-    df_energy = generate_df(energy_usage, [energy_usage_typ, energy_usage_hi], ['Energy (kWh)', 'Emissions (kg of CO2)'])
-
     #present costs, energy consumed and emissions side-by-side
     change_str2 = lambda v : '+' if v > 0 else '-'
 
@@ -521,18 +538,18 @@ with result_container:
 
     c1, c2, c3 = st.columns(3)
     with c1:
-        st.metric('Current', f"£{costs_total:,.0f}")
+        st.metric('Current', f"{currency}{costs_total:,.0f}")
     with c2:
         dcost = -100*(costs_total - costs_total_typ)/costs_total
-        st.metric('Typical HP Install', f"£{costs_total_typ:,.0f}", 
-        delta=f"{change_str2(dcost)}£{abs(costs_total - costs_total_typ):,.0f} ({change_str2(dcost)} {abs(dcost):.0f}%)", delta_color='inverse')
+        st.metric('Typical HP Install', f"{currency}{costs_total_typ:,.0f}", 
+        delta=f"{change_str2(dcost)}{currency}{abs(costs_total - costs_total_typ):,.0f} ({change_str2(dcost)} {abs(dcost):.0f}%)", delta_color='inverse')
     with c3:
         dcost = -100*(costs_total - costs_total_hi)/costs_total
-        st.metric('Hi-performance HP Install', f"£{costs_total_hi:,.0f}", 
-        delta=f"{change_str2(dcost)} £{abs(costs_total - costs_total_hi):,.0f} ({change_str2(dcost)} {abs(dcost):.0f}%)", delta_color='inverse')
+        st.metric('Hi-performance HP Install', f"{currency}{costs_total_hi:,.0f}", 
+        delta=f"{change_str2(dcost)} {currency}{abs(costs_total - costs_total_hi):,.0f} ({change_str2(dcost)} {abs(dcost):.0f}%)", delta_color='inverse')
 
-    bars = make_stacked_bar_horiz(df_costs, 'Costs (£)', 1)
-    st.altair_chart(bars, use_container_width=True)
+    st.vega_lite_chart(*charts['costs'], use_container_width=True)
+    trace.lap('costs')
 
     st.subheader('2. Annual Emissions')
     c1, c2, c3 = st.columns(3)
@@ -547,8 +564,8 @@ with result_container:
         st.metric('Hi-performance HP Install', f"{emissions_total_hi:,.0f} kg CO2", 
         delta=f"{change_str2(dcost)} {abs(emissions_total_hi - emissions_total):,.0f} kg CO2 ({change_str2(dcost)} {abs(dcost):.0f}%)", delta_color='inverse')
 
-    bars = make_stacked_bar_horiz(df_energy, 'Emissions (kg of CO2)')
-    st.altair_chart(bars, use_container_width=True)
+    st.vega_lite_chart(*charts['emissions'], use_container_width=True)
+    trace.lap('emissions')
 
     st.subheader('3. Annual Energy Usage')
     c1, c2, c3 = st.columns(3)
@@ -563,7 +580,99 @@ with result_container:
         st.metric('Hi-performance HP Install', f"{energy_total_hi:,.0f} kWh", 
         delta=f"{change_str2(dcost)} {abs(energy_total_hi - energy_total):,.0f} kWh ({change_str2(dcost)} {abs(dcost):.0f}%)", delta_color='inverse')
 
-    bars = make_stacked_bar_horiz(df_energy, 'Energy (kWh)')
-    st.altair_chart(bars, use_container_width=True)
+    st.vega_lite_chart(*charts['energy'], use_container_width=True)
+    trace.lap('energy')
+
+    if is_uncertainty:
+        st.subheader('4. Ranges of Likely Outcomes')
+        st.write(f'Based on {uncertainty.DEFAULT_DRAWS:,} calculations with heat pump performance and energy prices varied by '
+        + f'about {uncertainty.SCOP_REL_SD:.0%}, the hot water temperature raise by up to {uncertainty.HW_TEMP_RAISE_RANGE:.0f}$^\\circ$C '
+        + 'and between half and all of any efficiency saving achieved.  In 8 out of 10 cases the outcome lies between the low and high values.')
+        ranges = results_cache.get_or_compute(('uncertainty', inputs), lambda: uncertainty.run(inputs))
+        df_ranges = pd.DataFrame([ranges[name] for name in SUMMARY_METRICS], 
+                                 index=list(SUMMARY_METRICS.values()), columns=['Low (P10)', 'Median (P50)', 'High (P90)'])
+        st.table(df_ranges.style.format("{:,.0f}"))
+        trace.lap('uncertainty')
+
+    if is_sensitivity:
+        st.subheader('5. What Drives the Cost Saving')
+        st.write('How the annual cost saving of the typical heat pump install changes when each input is moved to a low or high value, '
+        + 'with everything else as entered.  The longest bars show the inputs it depends on most.')
+        df_tornado, df_grid = results_cache.get_or_compute(('sensitivity', inputs), lambda: build_sensitivity(inputs))
+        st.altair_chart(make_tornado(df_tornado, f'Cost saving ({currency})'), use_container_width=True)
+        st.write('Cost saving of the typical heat pump install for a range of gas and electricity unit costs.')
+        st.altair_chart(make_heatmap(df_grid, 'gas_unit', 'elec_unit', 'cost_saving_typ', 
+                                     f'Gas unit cost ({minor_unit}/kWh)', f'Electricity unit cost ({minor_unit}/kWh)'), use_container_width=True)
+        trace.lap('sensitivity')
+
+    if is_retrofit:
+        st.subheader('6. Cheapest Retrofit Packages')
+        st.write('The cheapest combinations of efficiency measures, heat pump install and tariff that meet your target, '
+        + 'using typical installed costs.  Any efficiency measures selected above are replaced by those in each package.')
+        max_emissions = target_emissions or None
+        max_cost = target_costs or None
+        #tariffs are offered in the region the prices are in
+        price_region = province if charge_option in (op3, op4) else 'UK'
+        df_packages = results_cache.get_or_compute(('retrofit', inputs, max_emissions, max_cost, price_region),
+                                                   lambda: retrofit.recommend(inputs, max_cost, max_emissions,
+                                                                              region=price_region))
+        if len(df_packages) == 0:
+            st.write('No combination of the measures meets the target.')
+        else:
+            df_packages = df_packages.set_index('rank')[['install_type', 'tariff', 'measures', 'capital_cost',
+                                                         'annual_saving', 'emissions', 'payback_years']]
+            df_packages.columns = ['HP install', 'Tariff', 'Efficiency measures', f'Cost ({currency})',
+                                   f'Annual saving ({currency})', 'Emissions (kg of CO2)', 'Payback (years)']
+            st.table(df_packages.style.format({f'Cost ({currency})': '{:,.0f}', f'Annual saving ({currency})': '{:,.0f}',
+                                               'Emissions (kg of CO2)': '{:,.0f}', 'Payback (years)': '{:,.1f}'}))
+        trace.lap('retrofit')
+
+    if is_models:
+        st.subheader('7. Best Heat Pump Models')
+        st.write('Models able to meet your home\'s estimated peak heat demand, with their installed price.  '
+        + 'Efficiency measures and prices are as entered above.')
+        by = {'Running cost': 'cost', 'Emissions': 'emissions', 'Payback': 'payback'}[model_objective]
+        df_models = results_cache.get_or_compute(('models', inputs, by), lambda: catalog.recommend_models(inputs, by))
+        if len(df_models) == 0:
+            st.write('No model in the catalog is big enough for your home.')
+        else:
+            df_models = df_models.set_index('rank')[['model', 'capacity_kW', 'heat_scop', 'price',
+                                                     'annual_saving', 'emissions', 'payback_years']]
+            df_models.columns = ['Model', 'Capacity (kW)', 'SCOP', f'Price ({currency})', f'Annual saving ({currency})',
+                                 'Emissions (kg of CO2)', 'Payback (years)']
+            st.table(df_models.style.format({'Capacity (kW)': '{:,.0f}', 'SCOP': '{:.2f}', f'Price ({currency})': '{:,.0f}',
+                                             f'Annual saving ({currency})': '{:,.0f}', 'Emissions (kg of CO2)': '{:,.0f}',
+                                             'Payback (years)': '{:,.1f}'}))
+        trace.lap('models')
+
+    if is_dispatch:
+        st.subheader('8. Solar PV, Battery and Cylinder')
+        st.write('Each hour of the year with the heat pump, solar panels, battery and cylinder, using typical weather and solar '
+        + f'output for {province}.  Electricity costs are the energy charges of the imported electricity less export payments, '
+        + 'excluding the standing charge.')
+        system = dict(pv_kWp=pv_kWp, battery_kWh=battery_kWh, tank_litres=tank_litres, tank_loss_kWhday=tank_loss_kWhday,
+                      export_unit=export_unit)
+        df_dispatch = results_cache.get_or_compute(('dispatch', inputs, province, dispatch_strategy, system),
+                                                   lambda: dispatch.compare(inputs, province, dispatch_strategy, system))
+        df_dispatch = df_dispatch.set_index('install_type')[['import_kWh', 'export_kWh', 'pv_used_kWh', 'tank_loss_kWh',
+                                                              'elec_cost', 'emissions']]
+        df_dispatch.index = [CASES[1], CASES[2]]
+        df_dispatch.columns = ['Imported (kWh)', 'Exported (kWh)', 'Solar used at home (kWh)', 'Cylinder losses (kWh)',
+                               f'Electricity cost ({currency})', 'Emissions (kg of CO2)']
+        st.table(df_dispatch.style.format('{:,.0f}'))
+        trace.lap('dispatch')
 
     st.write('If you found this tool helpful - please share!')
+
+#cache counters for operators, shown by adding ?debug=1 to the page url
+if st.query_params.get('debug'):
+    st.caption('Results cache: ' + ', '.join(f'{k} {v}' for k, v in results_cache.stats().items()))
+    st.caption('Recomputed: ' + (', '.join(graph.computed) or 'nothing'))
+
+profile_summary = trace.finish()
+if profile_summary:
+    with st.expander('Profile of this run'):
+        #the file name only - the directory is a path on the server
+        import os
+        st.write(f'Saved as {os.path.basename(trace.profile_path)}')
+        st.code(profile_summary)
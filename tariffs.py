@@ -0,0 +1,333 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Time-of-use and tiered electricity tariffs.  A tariff is described by a base rate, any
+# number of time periods (hours of the day, weekdays/weekends, months) with their own rates,
+# and optional monthly blocks charged at a higher rate above a threshold.  Each tariff is
+# compiled once into a dense 8760 hour rate array and per-month block arrays, so the energy
+# charge of a year of hourly load is a dot product with the rates.
+#
+# The annual engine has no hourly load, so its heating, hot water, cooking and other use are
+# spread over the year with typical hourly shapes and priced with the shape-weighted rates.
+#
+# Rates are in p (or cents) per kWh and standing charges in p per day, as in the engine.
+
+from functools import lru_cache
+
+import numpy as np
+
+
+HOURS = 8760
+MONTH_DAYS = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+#day of the week of 1 January, 0 is Monday; public holidays are not modelled
+YEAR_START_WEEKDAY = 0
+
+#calendar of every hour of the year
+HOUR_OF_DAY = np.arange(HOURS) % 24
+WEEKDAY = (np.arange(HOURS) // 24 + YEAR_START_WEEKDAY) % 7
+MONTH = np.repeat(np.arange(1, 13), np.array(MONTH_DAYS) * 24)
+MONTH_STARTS = np.concatenate([[0], np.cumsum(MONTH_DAYS)[:-1] * 24])
+
+#tariff definitions:
+#   region - climate used for the heating shape (see hourly.REGION_CLIMATE)
+#   rate - base rate (p/kWh), used outside all periods
+#   periods - later entries override earlier ones where they overlap:
+#       hours (start, end) end exclusive and may wrap past midnight, days 'weekday' or 'weekend',
+#       months (first, last) inclusive and may wrap past December; any may be left out
+#   blocks - kWh in a calendar month above threshold are charged at rate instead of the
+#       base rate, optionally only in some months; thresholds ascending
+#   standing - standing charge (p/day), replaces the entered one if given
+TARIFFS = {
+    'Ontario TOU': {'region': 'Ontario', 'rate': 7.6, 'periods': [
+        {'rate': 12.2, 'days': 'weekday', 'months': (11, 4), 'hours': (11, 17)},
+        {'rate': 15.8, 'days': 'weekday', 'months': (11, 4), 'hours': (7, 11)},
+        {'rate': 15.8, 'days': 'weekday', 'months': (11, 4), 'hours': (17, 19)},
+        {'rate': 12.2, 'days': 'weekday', 'months': (5, 10), 'hours': (7, 11)},
+        {'rate': 12.2, 'days': 'weekday', 'months': (5, 10), 'hours': (17, 19)},
+        {'rate': 15.8, 'days': 'weekday', 'months': (5, 10), 'hours': (11, 17)}]},
+    'Ontario ULO': {'region': 'Ontario', 'rate': 7.6, 'periods': [
+        {'rate': 12.2, 'days': 'weekday', 'hours': (7, 16)},
+        {'rate': 12.2, 'days': 'weekday', 'hours': (21, 23)},
+        {'rate': 28.4, 'days': 'weekday', 'hours': (16, 21)},
+        {'rate': 2.8, 'hours': (23, 7)}]},
+    'Ontario tiered': {'region': 'Ontario', 'rate': 9.3, 'blocks': [
+        {'threshold': 1000, 'rate': 11.0, 'months': (11, 4)},
+        {'threshold': 600, 'rate': 11.0, 'months': (5, 10)}]},
+    #1,350 kWh per two month billing period
+    'BC step': {'region': 'BC', 'rate': 11.43, 'blocks': [{'threshold': 675, 'rate': 17.21}]},
+}
+
+#share of each day's use in each hour, midnight first
+DAILY_SHAPES = {
+    #cylinder reheated on a timer overnight, with an afternoon top-up
+    'hot_water': [0.1, 0.15, 0.15, 0.15, 0.15, 0.1, 0, 0, 0, 0, 0, 0,
+                  0, 0, 0.1, 0.1, 0, 0, 0, 0, 0, 0, 0, 0],
+    'cooking': [0, 0, 0, 0, 0, 0, 0, 0.05, 0.05, 0, 0, 0.1,
+                0.15, 0.05, 0, 0, 0.1, 0.25, 0.2, 0.05, 0, 0, 0, 0],
+    #typical domestic use with an evening peak
+    'other': [0.025, 0.02, 0.02, 0.02, 0.02, 0.025, 0.035, 0.05, 0.05, 0.04, 0.04, 0.04,
+              0.04, 0.04, 0.04, 0.04, 0.05, 0.065, 0.075, 0.075, 0.07, 0.06, 0.045, 0.035],
+}
+COMPONENTS = ('heating', 'hot_water', 'cooking', 'other')
+
+#months in which hot water is free for households with solar panels (is_free_summer_hw)
+FREE_HW_MONTHS = (5, 8)
+
+#entered two tier tariffs (is_two_tier_tariff, e.g. Economy 7) charge elec_unit2 for the first
+#second_tariff_hours of each day, as dispatch.price_profiles, and heating follows this climate
+TWO_TIER_REGION = 'UK'
+
+
+def _in_range(values, first, last):
+    """
+    values between first and last inclusive, wrapping round if last < first
+    """
+    if first <= last:
+        return (values >= first) & (values <= last)
+    return (values >= first) | (values <= last)
+
+
+def period_mask(period):
+    """
+    (8760,) bool array of the hours a tariff period covers
+    """
+    mask = np.ones(HOURS, dtype=bool)
+    if 'months' in period:
+        mask &= _in_range(MONTH, *period['months'])
+    if 'hours' in period:
+        start, end = period['hours']
+        mask &= _in_range(HOUR_OF_DAY, start, (end - 1) % 24)
+    days = period.get('days', 'all')
+    if days == 'weekday':
+        mask &= WEEKDAY < 5
+    elif days == 'weekend':
+        mask &= WEEKDAY >= 5
+    elif days != 'all':
+        raise ValueError(f'Unknown days {days!r}, use weekday, weekend or all')
+    return mask
+
+
+@lru_cache(maxsize=None)
+def compile_tariff(name):
+    """
+    Dense arrays of a tariff in TARIFFS:
+        rates - (8760,) rate in each hour (p/kWh)
+        thresholds, increments - (12, n_blocks) monthly block thresholds (kWh) and the extra
+            rate above each one; thresholds of unused blocks are inf
+        standing - standing charge (p/day) or nan to keep the entered one
+    """
+    if name not in TARIFFS:
+        raise ValueError(f'Unknown tariff {name!r}, choose from: ' + ', '.join(TARIFFS))
+    spec = TARIFFS[name]
+    rates = np.full(HOURS, float(spec['rate']))
+    for period in spec.get('periods', []):
+        rates[period_mask(period)] = period['rate']
+
+    blocks = spec.get('blocks', [])
+    thresholds = np.full((12, max(len(blocks), 1)), np.inf)
+    increments = np.zeros_like(thresholds)
+    months = np.arange(1, 13)
+    for month in range(12):
+        applying = [b for b in blocks if _in_range(months[month], *b.get('months', (1, 12)))]
+        previous = float(spec['rate'])
+        for j, block in enumerate(sorted(applying, key=lambda b: b['threshold'])):
+            thresholds[month, j] = block['threshold']
+            increments[month, j] = block['rate'] - previous
+            previous = block['rate']
+
+    compiled = {'rates': rates, 'thresholds': thresholds, 'increments': increments,
+                'standing': float(spec.get('standing', np.nan)), 'region': spec.get('region', 'Ontario')}
+    for arr in (rates, thresholds, increments):
+        arr.flags.writeable = False
+    return compiled
+
+
+@lru_cache(maxsize=None)
+def component_shapes(region):
+    """
+    (n_components, 8760) share of each component's annual use in each hour, in COMPONENTS
+    order, plus hot water with the free summer months removed as a last row
+    """
+    #imported here as hourly imports the engine, which imports this module
+    from hourly import REGION_CLIMATE, heating_profile, synthetic_weather
+
+    shapes = [heating_profile(synthetic_weather(*REGION_CLIMATE[region]))]
+    for name in COMPONENTS[1:]:
+        daily = np.asarray(DAILY_SHAPES[name], dtype=float)
+        shapes.append(np.tile(daily / daily.sum(), 365) / 365)
+    free_hw = shapes[1] * ~_in_range(MONTH, *FREE_HW_MONTHS)
+    shapes = np.vstack(shapes + [free_hw])
+    shapes.flags.writeable = False
+    return shapes
+
+
+@lru_cache(maxsize=None)
+def _component_factors(name):
+    """
+    shape-weighted rate (p/kWh) of each component, and each component's share of its use in each month
+    """
+    tariff = compile_tariff(name)
+    shapes = component_shapes(tariff['region'])
+    return shapes @ tariff['rates'], np.add.reduceat(shapes, MONTH_STARTS, axis=1)
+
+
+def off_peak_mask(hours):
+    """
+    (8760,) bool array of the hours of a two tier tariff's off-peak rate: the first hours of each day
+    """
+    return HOUR_OF_DAY < hours
+
+
+def compile_two_tier(peak, off_peak, hours):
+    """
+    Dense arrays of an entered two tier tariff, laid out as compile_tariff
+    peak, off_peak - rates (p/kWh); hours - off-peak hours a night, from midnight
+    """
+    rates = np.where(off_peak_mask(hours), float(off_peak), float(peak))
+    return {'rates': rates, 'thresholds': np.full((12, 1), np.inf), 'increments': np.zeros((12, 1)),
+            'standing': np.nan, 'region': TWO_TIER_REGION}
+
+
+@lru_cache(maxsize=None)
+def _off_peak_shares(hours):
+    """
+    share of each component_shapes row's use in the off-peak hours of a two tier tariff, so a
+    use's shape-weighted rate on compile_two_tier's rates is peak + (off_peak - peak) * share
+    """
+    shares = component_shapes(TWO_TIER_REGION) @ off_peak_mask(hours)
+    shares.flags.writeable = False
+    return shares
+
+
+def two_tier_costs(peak, off_peak, hours, other_share, heating, hot_water, cooking, other, free_summer_hw=False):
+    """
+    Annual energy charge (£) of the engine's annual electricity use on entered two tier tariffs.
+    peak, off_peak, hours - elec_unit, elec_unit2 and second_tariff_hours per household
+    other_share - share of other use in the off-peak hours (pc_elec_second_tariff), as the household knows it
+    Heating and cooking are priced by their hourly shapes; a hot water cylinder is reheated on a
+    timer in the off-peak hours, so all of it is at the off-peak rate whenever there are any.
+    """
+    peak, off_peak, hours, other_share, heating, hot_water, cooking, other, free = np.broadcast_arrays(
+        *[np.asarray(v, dtype=np.float64) for v in (peak, off_peak, hours, other_share, heating,
+                                                    hot_water, cooking, other)], free_summer_hw)
+    hours = np.clip(np.round(hours), 0, 24).astype(np.intp)
+    shares = np.stack([_off_peak_shares(h) for h in range(25)])[hours]
+    #hot water outside the free summer months: share of the year's hot water use left to pay for
+    paid_hw = np.where(free, component_shapes(TWO_TIER_REGION)[4].sum(), 1.0)
+    hw_share = np.where(hours > 0, 1.0, 0.0)
+    step = off_peak - peak
+    costs = (heating * (peak + step*shares[:, 0]) + hot_water * paid_hw * (peak + step*hw_share)
+             + cooking * (peak + step*shares[:, 2]) + other * (peak + step*other_share))
+    return costs / 100
+
+
+def block_charges(monthly_kWh, tariff):
+    """
+    monthly_kWh - (..., 12) use in each calendar month
+    returns (...) extra charge (p) of the tariff's blocks
+    """
+    excess = np.maximum(monthly_kWh[..., None] - tariff['thresholds'], 0)
+    return (excess * tariff['increments']).sum(axis=(-2, -1))
+
+
+def bill(name, load):
+    """
+    name - tariff in TARIFFS, or a compiled tariff such as compile_two_tier's
+    load - (8760,) or (n, 8760) hourly electricity use (kWh), e.g. from hourly.simulate or meter data
+    returns annual energy charge (£), excluding the standing charge
+    """
+    tariff = compile_tariff(name) if isinstance(name, str) else name
+    load = np.asarray(load, dtype=np.float64)
+    monthly = np.add.reduceat(load, MONTH_STARTS, axis=-1)
+    return (load @ tariff['rates'] + block_charges(monthly, tariff)) / 100
+
+
+def bills(names, load):
+    """
+    annual energy charges (£) of the same hourly load on several tariffs, as (n, n_tariffs)
+    """
+    compiled = [compile_tariff(name) for name in names]
+    load = np.atleast_2d(np.asarray(load, dtype=np.float64))
+    charges = load @ np.stack([t['rates'] for t in compiled], axis=1)
+    monthly = np.add.reduceat(load, MONTH_STARTS, axis=-1)
+    for j, tariff in enumerate(compiled):
+        charges[:, j] += block_charges(monthly, tariff)
+    return charges / 100
+
+
+def _groups(names):
+    """
+    (name, index array) of the households on each tariff; a few comparisons against the
+    known names are much cheaper than sorting the names of a large portfolio
+    """
+    names = np.atleast_1d(np.asarray(names, dtype=str))
+    groups, covered = [], 0
+    for name in TARIFFS:
+        idx = np.nonzero(names == name)[0]
+        if len(idx):
+            groups.append((name, idx))
+            covered += len(idx)
+    if covered < len(names):
+        compile_tariff(next(n for n in np.unique(names) if n not in TARIFFS))
+    return groups
+
+
+def _component_use(n, heating, hot_water, cooking, other, free_summer_hw):
+    """
+    returns a function of household indices giving their use (kWh) in the rows of component_shapes:
+    heating, hot water, cooking, other and hot water outside the free months
+    """
+    kWh = [np.broadcast_to(np.asarray(use, dtype=np.float64), n) for use in (heating, hot_water, cooking, other)]
+    free = np.broadcast_to(free_summer_hw, n)
+
+    def use(idx):
+        out = np.empty((len(idx), len(kWh) + 1))
+        for j, col in enumerate(kWh):
+            out[:, j] = col[idx]
+        is_free = free[idx]
+        out[:, 4] = np.where(is_free, out[:, 1], 0)
+        out[:, 1] = np.where(is_free, 0, out[:, 1])
+        return out
+    return use
+
+
+def component_costs(names, heating, hot_water, cooking, other, free_summer_hw=False):
+    """
+    Annual energy charge (£) of the engine's annual electricity use on named tariffs.
+    names - tariff name per household
+    heating, hot_water, cooking, other - annual electricity use (kWh) per household
+    free_summer_hw - hot water in FREE_HW_MONTHS costs nothing
+    """
+    n = np.size(names)
+    component_use = _component_use(n, heating, hot_water, cooking, other, free_summer_hw)
+    costs = np.zeros(n)
+    for name, idx in _groups(names):
+        effective, monthly_share = _component_factors(name)
+        use = component_use(idx)
+        costs[idx] = use @ effective
+        tariff = compile_tariff(name)
+        if tariff['increments'].any():
+            costs[idx] += block_charges(use @ monthly_share, tariff)
+    return costs / 100
+
+
+def monthly_use(names, heating, hot_water, cooking, other, free_summer_hw=False):
+    """
+    (n, 12) electricity use (kWh) in each calendar month of the engine's annual use on named
+    tariffs, as component_costs charges the blocks on
+    """
+    n = np.size(names)
+    component_use = _component_use(n, heating, hot_water, cooking, other, free_summer_hw)
+    monthly = np.zeros((n, 12))
+    for name, idx in _groups(names):
+        monthly[idx] = component_use(idx) @ _component_factors(name)[1]
+    return monthly
+
+
+def standing_charges(names, default):
+    """
+    annual standing charge (£) per household: the tariff's where it sets one, otherwise default (p/day)
+    """
+    standing = np.array(np.broadcast_to(default, np.size(names)), dtype=np.float64)
+    for name, idx in _groups(names):
+        if not np.isnan(compile_tariff(name)['standing']):
+            standing[idx] = compile_tariff(name)['standing']
+    return standing * 3.65
@@ -0,0 +1,9 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# The modules live at the top of the repository, so make them importable however pytest is run.
+#
+#   python -m pytest -q
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
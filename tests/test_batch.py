@@ -0,0 +1,51 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Reading households files: engine inputs from columns, blanks and regional lookups.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from batch import input_columns, input_names
+from defaults import INPUT_DEFAULTS
+
+
+def test_blank_flags_take_defaults_and_blank_figures_stay_nan():
+    df = pd.DataFrame({'is_hw_gas': [False, None], 'grid_carbon': [None, 'marginal'],
+                       'elec_total_kWh': [3500, None]})
+    inputs = input_columns(df)
+    assert inputs['is_hw_gas'].tolist() == [False, INPUT_DEFAULTS['is_hw_gas']]
+    assert inputs['grid_carbon'].tolist() == [INPUT_DEFAULTS['grid_carbon'], 'marginal']
+    assert inputs['elec_total_kWh'][0] == 3500 and np.isnan(inputs['elec_total_kWh'][1])
+
+
+def test_other_columns_ignored():
+    assert set(input_columns(pd.DataFrame({'id': [1], 'gas_total_kWh': [9000]}))) == {'gas_total_kWh'}
+
+
+def test_region_gives_prices_and_gas_use():
+    df = pd.DataFrame({'region': ['BC', 'Ontario', None], 'gas_total': [90, 2400, 12000],
+                       'elec_unit': [11.0, np.nan, 30.0]})
+    inputs = input_columns(df)
+    #gas_total is in the region's billing unit: GJ in BC, m^3 in Ontario, kWh without a region
+    np.testing.assert_allclose(inputs['gas_total_kWh'], [90 * 277.78, 2400 * 10.55, 12000])
+    np.testing.assert_allclose(inputs['gas_unit'], [5.0, 4.3, 10.3])
+    assert inputs['grid_region'].tolist() == ['BC', 'Ontario', 'UK']
+    #a price column is used as given, not replaced by the region's
+    assert inputs['elec_unit'][0] == 11.0 and inputs['elec_unit'][2] == 30.0
+
+
+def test_postal_code_locates_utility():
+    inputs = input_columns(pd.DataFrame({'postal_code': ['v8g 1a1', 'K1A 0B1']}))
+    assert inputs['grid_region'].tolist() == ['BC', 'Ontario']
+    np.testing.assert_allclose(inputs['gas_unit'], [7.2, 4.3])
+
+
+def test_unknown_region_rejected():
+    with pytest.raises(ValueError, match='Unknown region'):
+        input_columns(pd.DataFrame({'region': ['Narnia']}))
+
+
+def test_input_names_include_location_columns():
+    names = input_names(['id'])
+    assert {'region', 'utility', 'postal_code', 'gas_total', 'id'} <= names
+    assert set(INPUT_DEFAULTS) <= names
@@ -0,0 +1,77 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# The vectorized engine against figures of the original scalar calculation in streamlit_app.py,
+# for the form's default household and a few edge cases.  Entered two tier tariffs are left out:
+# they are now priced hour by hour rather than with the original two thirds approximation.
+
+import numpy as np
+import pytest
+
+from engine import CASES, calculate, prepare_inputs
+
+#household: (inputs, [costs_total, energy_total, emissions_total] of each case in CASES order)
+BASELINE = {
+    'default': ({},
+        [2526.1, 15000.0, 2928.0, 2485.41332, 6515.627411, 886.125328, 2354.007346, 6129.139254, 833.562939]),
+    'electric_hot_water': ({'is_hw_gas': False, 'hw_lday': 200},
+        [2526.1, 15000.0, 2928.0, 1956.300617, 4959.41358, 674.480247, 1769.567105, 4410.197368, 599.786842]),
+    'gas_cooking': ({'is_cook_gas': True, 'gas_cook_kWhweek': 10},
+        [2526.1, 15000.0, 2928.0, 2490.35332, 6892.627411, 975.877328, 2366.624189, 6528.718202, 926.385675]),
+    'gas_second_heat_kept': ({'is_second_heatsource': True, 'second_heatsource_type': 'gas',
+                              'second_heatsource_kWh': 2000, 'is_second_heatsource_remains': True},
+        [2526.1, 15000.0, 2928.0, 2504.41332, 7965.627411, 1231.325328, 2402.533662, 7665.98136, 1190.573465]),
+    'electric_second_heat_replaced': ({'is_second_heatsource': True, 'second_heatsource_type': 'electric',
+                                       'second_heatsource_kWh': 2000, 'is_second_heatsource_remains': False},
+        [2526.1, 15000.0, 2928.0, 2017.91332, 5140.627411, 699.125328, 1852.954715, 4655.455044, 633.141886]),
+    'disconnect_free_hw_boost': ({'is_disconnect_gas': True, 'is_cook_gas': True, 'gas_cook_kWhweek': 8,
+                                  'is_free_summer_hw': True, 'efficiency_boost': 0.25, 'hw_temp_raise': 40},
+        [2526.1, 15000.0, 2928.0, 2167.083284, 6615.959066, 899.770433, 2095.957585, 6380.479825, 867.745256]),
+    'renewable_electricity': ({'is_elec_renewable': True, 'gas_total_kWh': 20000, 'elec_total_kWh': 4500},
+        [3860.1, 24500.0, 4200.0, 3743.41332, 10215.627411, 0.0, 3493.902083, 9481.770833, 0.0]),
+    'no_gas_no_elec': ({'gas_total_kWh': 0, 'elec_total_kWh': 0, 'hw_lday': 0},
+        [270.1, 0.0, 0.0, 270.1, 0.0, 0.0, 270.1, 0.0, 0.0]),
+    'custom_prices': ({'gas_stand': 30.0, 'gas_unit': 7.5, 'elec_stand': 50.0, 'elec_unit': 28.0},
+        [2032.0, 15000.0, 2928.0, 2116.375675, 6515.627411, 886.125328, 2008.158991, 6129.139254, 833.562939]),
+}
+TOTALS = ('costs_total', 'energy_total', 'emissions_total')
+
+
+def _totals(results, i=0):
+    return [results[case_name][key][i] for case_name in CASES for key in TOTALS]
+
+
+@pytest.mark.parametrize('name', list(BASELINE))
+def test_matches_scalar_calculation(name):
+    inputs, expected = BASELINE[name]
+    np.testing.assert_allclose(_totals(calculate(**inputs)), expected, rtol=1e-9, atol=1e-6)
+
+
+def test_batch_matches_single_households():
+    #every household in one call, inputs any of them leave out taking the defaults
+    households = [inputs for inputs, _ in BASELINE.values()]
+    defaults = prepare_inputs()
+    cols = {name: [h.get(name, defaults[name][0]) for h in households] for name in set().union(*households)}
+    results = calculate(**cols)
+    for i, (_, expected) in enumerate(BASELINE.values()):
+        np.testing.assert_allclose(_totals(results, i), expected, rtol=1e-9, atol=1e-6)
+
+
+def test_default_breakdowns():
+    results = calculate()
+    current = results[CASES[0]]
+    np.testing.assert_allclose(current['costs'][0], [102.2, 1236.0, 167.9, 1020.0])
+    np.testing.assert_allclose(current['energy'][0], [7765.861742, 4234.138258, 0.0, 3000.0])
+    np.testing.assert_allclose(current['emissions'][0], [1630.830966, 889.169034, 0.0, 408.0])
+
+
+def test_unknown_input_rejected():
+    with pytest.raises(ValueError, match='Unknown household inputs'):
+        calculate(gas_total=12000)
+
+
+def test_prices_default_to_the_tariff_region():
+    #a named Canadian tariff is in cents, so gas and standing charges default to its region's
+    inp = prepare_inputs(elec_tariff=['', 'BC step'], grid_region=['Ontario', ''])
+    np.testing.assert_allclose(inp['gas_unit'], [4.3, 5.0])
+    np.testing.assert_allclose(inp['elec_stand'], [100.0, 21.0])
+    #prices given are kept
+    np.testing.assert_allclose(prepare_inputs(gas_unit=7.0, grid_region='BC')['gas_unit'], [7.0])
@@ -0,0 +1,58 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Request validation and responses of the scoring service.
+
+import json
+
+import pytest
+
+from service import RequestError, _response, parse_household, score_households
+
+
+def test_valid_household_passes():
+    household = {'gas_total_kWh': 15000, 'is_hw_gas': False, 'elec_tariff': 'Ontario ULO',
+                 'grid_carbon': 'marginal', 'grid_region': 'Ontario', 'hw_temp_raise': 0}
+    assert parse_household(household) == household
+
+
+@pytest.mark.parametrize('household, message', [
+    ([1, 2], 'JSON object'),
+    ({'gas_total': 12000}, 'unknown input'),
+    ({'is_hw_gas': 1}, 'true or false'),
+    ({'elec_tariff': 3}, 'must be a string'),
+    ({'gas_total_kWh': True}, 'must be a number'),
+    ({'gas_total_kWh': '12000'}, 'must be a number'),
+    ({'gas_total_kWh': float('nan')}, 'must be a number'),
+    ({'gas_total_kWh': float('inf')}, 'must be a number'),
+    ({'gas_total_kWh': -1}, '0 or more'),
+    ({'hp_heat_scop_typ': 0}, 'above 0'),
+    ({'boiler_hw_eff': 0, 'hw_temp_raise': 0}, 'above 0'),
+    ({'efficiency_boost': 1.5}, 'at most 1'),
+    ({'second_tariff_hours': 25}, 'at most 24'),
+    ({'elec_tariff': 'Economy 7'}, 'unknown tariff'),
+    ({'grid_carbon': 'hourly'}, 'unknown grid carbon basis'),
+    ({'grid_region': 'Narnia'}, 'unknown grid region'),
+])
+def test_invalid_household_rejected(household, message):
+    with pytest.raises(RequestError, match=message) as info:
+        parse_household(household)
+    assert info.value.status == 400
+
+
+def test_missing_prices_follow_each_household_region():
+    #prices one household gives are not applied to the others
+    bc, uk = score_households([{'grid_region': 'BC'}, {'gas_unit': 9.0}])
+    only_bc, = score_households([{'grid_region': 'BC'}])
+    assert bc['costs_total'] == pytest.approx(only_bc['costs_total'])
+    assert uk['costs_gas_unit'] == pytest.approx(12000 * 9.0 / 100)
+
+
+def test_response_is_strict_json():
+    ok = _response(200, score_households([{}]), True)
+    head, body = ok.split(b'\r\n\r\n', 1)
+    assert head.startswith(b'HTTP/1.1 200')
+    json.loads(body)
+
+    broken = _response(200, {'costs_total': float('inf')}, True)
+    head, body = broken.split(b'\r\n\r\n', 1)
+    assert head.startswith(b'HTTP/1.1 500')
+    assert b'Infinity' not in body and b'NaN' not in body
@@ -0,0 +1,89 @@
+# HEAT PUMP COST BENEFIT ANALYSIS AND EMISSIONS ESTIMATOR
+# Monte Carlo uncertainty analysis.  The inputs the Further Information tab admits are
+# uncertain - heat pump performance, energy prices, hot water temperature raise and the
+# savings actually achieved by efficiency measures - are sampled around the user's values
+# and every draw is evaluated by the engine in one vectorized call per batch.
+#
+# Draws are processed in fixed-size batches and summarised with a streaming histogram,
+# so memory does not grow with the number of draws.
+
+import numpy as np
+
+from engine import INPUT_DEFAULTS, SUMMARY_METRICS, calculate, summary_metrics
+
+
+#spread of the sampled inputs
+SCOP_REL_SD = 0.15          #relative standard deviation of heating SCOP and hot water COP
+PRICE_REL_SD = 0.15         #relative standard deviation of gas and electricity unit prices
+HW_TEMP_RAISE_RANGE = 5.0   #hot water temperature raise uniform within +/- this (degC)
+#fraction of the stated efficiency saving actually achieved: triangular (low, mode, high)
+EFFICIENCY_REALISED = (0.5, 0.9, 1.0)
+
+QUANTILES = (0.1, 0.5, 0.9)
+DEFAULT_DRAWS = 100000
+DEFAULT_BATCH = 25000
+
+class StreamingQuantiles:
+    """
+    Approximate quantiles of a stream of values in fixed memory.
+    Values are counted into a histogram whose range is set from the first batch with
+    generous padding; later values outside it fall in the end bins and the running
+    min/max keep the extreme quantiles bounded.
+    """
+    def __init__(self, bins=4096):
+        self.bins = bins
+        self.edges = None
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if values.size == 0:
+            return
+        lo, hi = values.min(), values.max()
+        if self.edges is None:
+            pad = (hi - lo) * 0.5 or abs(lo) * 0.1 or 1.0
+            self.edges = np.linspace(lo - pad, hi + pad, self.bins + 1)
+        self.min, self.max = min(self.min, lo), max(self.max, hi)
+        idx = np.searchsorted(self.edges, values, side='right') - 1
+        self.counts += np.bincount(np.clip(idx, 0, self.bins - 1), minlength=self.bins)
+
+    def quantiles(self, qs=QUANTILES):
+        total = self.counts.sum()
+        if total == 0:
+            return np.full(len(qs), np.nan)
+        cdf = np.concatenate([[0], np.cumsum(self.counts) / total])
+        return np.clip(np.interp(qs, cdf, self.edges), self.min, self.max)
+
+
+def sample_inputs(inputs, n, rng):
+    """
+    inputs - one household's engine inputs (scalars), missing ones take the engine defaults
+    returns inputs with the uncertain ones replaced by n random draws
+    """
+    draws = dict(inputs)
+    value = lambda name: inputs.get(name, INPUT_DEFAULTS[name])
+    for name in ('hp_heat_scop_typ', 'hp_hw_cop_typ', 'hp_heat_scop_hi', 'hp_hw_cop_hi'):
+        draws[name] = np.maximum(value(name) * rng.normal(1, SCOP_REL_SD, n), 1.0)
+    for name in ('gas_unit', 'elec_unit', 'elec_unit2'):
+        #lognormal with the entered price as its mean
+        draws[name] = value(name) * rng.lognormal(-PRICE_REL_SD**2/2, PRICE_REL_SD, n)
+    draws['hw_temp_raise'] = np.maximum(
+        value('hw_temp_raise') + rng.uniform(-HW_TEMP_RAISE_RANGE, HW_TEMP_RAISE_RANGE, n), 1.0)
+    draws['efficiency_boost'] = value('efficiency_boost') * rng.triangular(*EFFICIENCY_REALISED, n)
+    return draws
+
+
+def run(inputs, n_draws=DEFAULT_DRAWS, batch_size=DEFAULT_BATCH, seed=0, qs=QUANTILES):
+    """
+    inputs - one household's engine inputs, as collected by the app
+    returns dict of metric name -> array of the quantiles qs
+    """
+    rng = np.random.default_rng(seed)
+    estimators = {name: StreamingQuantiles() for name in SUMMARY_METRICS}
+    for start in range(0, n_draws, batch_size):
+        n = min(batch_size, n_draws - start)
+        for name, values in summary_metrics(calculate(**sample_inputs(inputs, n, rng))).items():
+            estimators[name].update(values)
+    return {name: est.quantiles(qs) for name, est in estimators.items()}